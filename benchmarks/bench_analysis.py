@@ -0,0 +1,66 @@
+"""
+Global analysis: score.analyze('key') vs the per-measure histogram index of score_analysis.py.
+
+For each synthetic score (bench_pipeline.py) it times music21's whole-score key analysis, building the
+ScoreAnalysis index, a whole-score key from the index, and key queries over sliding 8-measure windows from the
+index vs analyze('key') on the same measures. Every key from the index is checked against music21's.
+
+    python benchmarks/bench_analysis.py [--cases 64x4 512x16] [--window 8] [--repeat 3]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_pipeline import generate_score  # noqa: E402
+from score_analysis import ScoreAnalysis  # noqa: E402
+
+
+def timed(fn, repeat):
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        runs.append(time.perf_counter() - t0)
+    return result, statistics.median(runs)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", nargs="+", default=["64x4", "512x16"], help="MEASURESxPARTS")
+    parser.add_argument("--window", type=int, default=8)
+    parser.add_argument("--windows", type=int, default=8, help="windows compared per score")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'score':<10} {'analyze(key)':>13} {'build':>10} {'key':>9} "
+          f"{'window analyze':>15} {'window key':>11}  result")
+    for spec in args.cases:
+        measures, parts = (int(n) for n in spec.lower().split("x"))
+        score = generate_score(measures, parts)
+        expected, analyze_s = timed(lambda: score.analyze("key"), args.repeat)
+        analysis, build_s = timed(lambda: ScoreAnalysis(score), args.repeat)
+        found, key_s = timed(analysis.key, args.repeat)
+        mismatches = int(str(found) != str(expected))
+
+        step = max(1, (measures - args.window) // max(1, args.windows - 1))
+        starts = list(range(1, max(2, measures - args.window + 2), step))[:args.windows]
+        window_analyze, window_key = [], []
+        for start in starts:
+            end = start + args.window - 1
+            want, seconds = timed(lambda: score.measures(start, end).analyze("key"), 1)
+            window_analyze.append(seconds)
+            got, seconds = timed(lambda: analysis.key(start, end), args.repeat)
+            window_key.append(seconds)
+            mismatches += str(got) != str(want)
+
+        print(f"{spec:<10} {analyze_s * 1000:11.1f}ms {build_s * 1000:8.1f}ms {key_s * 1000:7.2f}ms "
+              f"{statistics.median(window_analyze) * 1000:13.1f}ms {statistics.median(window_key) * 1000:9.2f}ms  "
+              f"{found} ({'matches music21' if not mismatches else f'{mismatches} MISMATCHES'})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Many (score, prompt) pairs: one /api/llama3 request after another vs one /api/llama3/batch request.
+
+Each of --scores synthetic scores (bench_pipeline.py) gets --prompts prompts that go to the stub LLM (which
+waits --latency seconds per call). Result caches are cleared before each run and every item is "fresh", so
+both runs make the same model calls. The report shows the wall time, the time to the first batch result, and
+how many times a score was parsed.
+
+    python benchmarks/bench_batch.py [--scores 3] [--prompts 8] [--measures 32] [--latency 0.5]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from music21.musicxml.xmlObjects import MusicXMLWarning  # noqa: E402
+
+import llm_client  # noqa: E402
+import server  # noqa: E402
+from bench_pipeline import generate_score  # noqa: E402
+from musicxml_io import score_to_musicxml  # noqa: E402
+from stub_llm_server import start_stub  # noqa: E402
+
+
+def reset():
+    for cache in (server.score_cache, server.plan_results, server.prompt_results):
+        cache.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scores", type=int, default=3)
+    parser.add_argument("--prompts", type=int, default=8)
+    parser.add_argument("--measures", type=int, default=32)
+    parser.add_argument("--parts", type=int, default=2)
+    parser.add_argument("--latency", default="0.5", help="stub latency per call (seconds or a distribution)")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore", MusicXMLWarning)
+
+    stub, url = start_stub(latency=args.latency)
+    llm_client.set_default_client(llm_client.LLMClient(base_url=url))
+    server.candidate_pool.warm()
+    client = server.app.test_client()
+
+    parses = []
+    parse = server.score_cache._parse
+    server.score_cache._parse = lambda xml: (parses.append(1), parse(xml))[1]
+
+    scores = {f"s{i}": score_to_musicxml(generate_score(args.measures + i, args.parts)) for i in range(args.scores)}
+    items = [{"id": f"{name}-{j}", "score": name, "prompt": f"make measures 1-4 more joyful, take {j}"}
+             for name in scores for j in range(args.prompts)]
+
+    reset()
+    parses.clear()
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # the handlers print the prompt and plans
+        for item in items:
+            response = client.post("/api/llama3", json={"xml": scores[item["score"]], "prompt": item["prompt"],
+                                                        "fresh": True})
+            assert response.status_code == 200, response.get_data()[:200]
+    one_by_one, one_by_one_parses = time.perf_counter() - t0, len(parses)
+
+    reset()
+    parses.clear()
+    first = None
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = client.post("/api/llama3/batch", json={"scores": scores, "items": items, "fresh": True},
+                               buffered=False)
+        events = []
+        for line in response.response:
+            for text in line.decode("utf-8").splitlines():
+                events.append(json.loads(text))
+                if first is None:
+                    first = time.perf_counter() - t0
+    batch = time.perf_counter() - t0
+    done = events[-1]
+
+    print(f"{len(items)} items ({args.scores} scores x {args.prompts} prompts, {args.measures}+ measures x "
+          f"{args.parts} parts), stub latency {args.latency}s, BATCH_CONCURRENCY={server.BATCH_CONCURRENCY}")
+    print(f"  one request each: {one_by_one:7.2f}s  {one_by_one_parses} parses")
+    print(f"  one batch:        {batch:7.2f}s  {len(parses)} parses, first result after {first:.2f}s, "
+          f"{done['errors']} errors")
+
+    server.candidate_pool.shutdown()
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Response size and time of /api/llama3 with full MusicXML options vs measure deltas, with and without gzip.
+
+Uses the synthetic scores of bench_pipeline.py and a prompt that edits 4 measures, against the stub LLM (so the
+options come from music21) and with a transpose prompt the intent rules and the XML rewriter handle.
+
+    python benchmarks/bench_delta.py [--cases 64x4 512x16] [--repeat 3]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from music21.musicxml.xmlObjects import MusicXMLWarning  # noqa: E402
+
+import llm_client  # noqa: E402
+import server  # noqa: E402
+from bench_pipeline import generate_score  # noqa: E402
+from musicxml_io import score_to_musicxml  # noqa: E402
+from stub_llm_server import start_stub  # noqa: E402
+
+PROMPTS = {
+    "llm": "make measures 1-4 more joyful",
+    "rules": "transpose measures 1-4 up 2 semitones",
+}
+
+
+def post(client, body, encoding, repeat):
+    sizes, runs = set(), []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        response = client.post("/api/llama3", json=body, headers={"Accept-Encoding": encoding})
+        runs.append(time.perf_counter() - t0)
+        assert response.status_code == 200, response.get_data()[:200]
+        sizes.add(len(response.get_data()))
+    return max(sizes), statistics.median(runs)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", nargs="+", default=["64x4", "512x16"], help="MEASURESxPARTS")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    warnings.simplefilter("ignore", MusicXMLWarning)
+
+    stub, url = start_stub()
+    llm_client.set_default_client(llm_client.LLMClient(base_url=url))
+    server.candidate_pool.warm()
+    client = server.app.test_client()
+
+    print(f"{'score':<10} {'prompt':<6} {'response':<8} {'encoding':<9} {'bytes':>12} {'time':>10}")
+    for spec in args.cases:
+        measures, parts = (int(n) for n in spec.lower().split("x"))
+        xml = score_to_musicxml(generate_score(measures, parts))
+        for label, prompt in PROMPTS.items():
+            for fmt in ("full", "delta"):
+                body = {"prompt": prompt, "xml": xml, "response": fmt}
+                post(client, body, "identity", 1)  # warm the score and result caches
+                for encoding in ("identity", "gzip"):
+                    size, seconds = post(client, body, encoding, args.repeat)
+                    print(f"{spec:<10} {label:<6} {fmt:<8} {encoding:<9} {size:>12,} {seconds * 1000:8.1f}ms")
+
+    server.candidate_pool.shutdown()
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Measure the rule-based intent parser on the labelled corpus (benchmarks/intent_corpus.jsonl).
+
+Each line is {"prompt": ..., "expected": [[action, params], ...] or null, "measures": [start, end]}; expected
+is the first candidate's actions in order, null for prompts that should go to the LLM. Reports the hit rate on
+deterministic prompts, plan accuracy, false positives on prompts meant for the model, and parse time.
+
+    python benchmarks/bench_intent_parser.py [--verbose]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from intent_parser import parse_intent  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_corpus.jsonl")
+GLOBAL_INFO = {"key": "C major", "time_signature": "4/4", "tempo": 100}
+
+
+def plan_of(candidate):
+    steps = [[candidate["action"], candidate["params"]]]
+    steps += [[a["action"], a["params"]] for a in candidate["secondary_actions"]]
+    return steps
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding="utf-8") as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+
+    deterministic = [c for c in corpus if c["expected"] is not None]
+    creative = [c for c in corpus if c["expected"] is None]
+    hits = correct = false_positives = 0
+    times = []
+
+    for case in corpus:
+        t0 = time.perf_counter()
+        candidates = parse_intent(case["prompt"], lambda: GLOBAL_INFO)
+        times.append(time.perf_counter() - t0)
+
+        if case["expected"] is None:
+            if candidates is not None:
+                false_positives += 1
+                print(f"FALSE POSITIVE  {case['prompt']!r} -> {plan_of(candidates[0])}")
+            continue
+        if candidates is None:
+            print(f"MISS            {case['prompt']!r}")
+            continue
+        hits += 1
+        measures = candidates[0]["target"]["measures"]
+        got_range = [measures[0], measures[-1]] if measures else None
+        if plan_of(candidates[0]) == case["expected"] and got_range == case.get("measures"):
+            correct += 1
+            if args.verbose:
+                print(f"OK              {case['prompt']!r} -> {plan_of(candidates[0])} ({len(candidates)} candidates)")
+        else:
+            print(f"WRONG PLAN      {case['prompt']!r} -> {plan_of(candidates[0])} {got_range}, "
+                  f"expected {case['expected']} {case.get('measures')}")
+
+    print()
+    print(f"prompts: {len(corpus)} ({len(deterministic)} deterministic, {len(creative)} for the model)")
+    print(f"hit rate on deterministic prompts: {hits}/{len(deterministic)} = {hits / len(deterministic):.0%}")
+    print(f"correct plans among hits:          {correct}/{hits}")
+    print(f"false positives on model prompts:  {false_positives}/{len(creative)}")
+    print(f"share of all traffic served by rules: {hits + false_positives}/{len(corpus)} "
+          f"= {(hits + false_positives) / len(corpus):.0%}")
+    print(f"parse time: mean {sum(times) / len(times) * 1e6:.0f}us, max {max(times) * 1e6:.0f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Checks and timings for llm_client against the local stub server.
+
+- per-call OpenAI client (the old call_llama3_with_prompt) vs the pooled client: latency and TCP connections
+- retries: a stub failing a share of requests still answers every call
+- timeouts: a backend slower than the read timeout fails fast instead of hanging
+- async: concurrent achat calls share one pool
+
+    python benchmarks/bench_llm_client.py --calls 50
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from openai import OpenAI
+
+from llm_client import LLMClient
+from stub_llm_server import start_stub
+
+MESSAGES = [{"role": "user", "content": "transpose up a whole tone"}]
+
+
+def timed(fn, calls):
+    times = []
+    for _ in range(calls):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def report(label, times, server):
+    stats = server.state.stats()
+    print(f"{label:<28} mean {statistics.mean(times) * 1000:7.2f}ms  "
+          f"p95 {sorted(times)[int(len(times) * 0.95) - 1] * 1000:7.2f}ms  "
+          f"connections {stats['connections']:4d}  requests {stats['requests']:4d}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=50)
+    args = parser.parse_args()
+
+    server, url = start_stub()
+    times = timed(lambda: OpenAI(base_url=url, api_key="sk-local").chat.completions.create(
+        model="llama3", messages=MESSAGES), args.calls)
+    report("client per call", times, server)
+    server.shutdown()
+
+    server, url = start_stub()
+    client = LLMClient(base_url=url)
+    times = timed(lambda: client.chat(MESSAGES), args.calls)
+    report("pooled client", times, server)
+    client.close()
+    server.shutdown()
+
+    server, url = start_stub(fail_rate=0.3, seed=1)
+    client = LLMClient(base_url=url, max_retries=4, backoff=0.01)
+    ok = sum(1 for _ in range(args.calls) if client.chat(MESSAGES))
+    stats = server.state.stats()
+    print(f"retries: {ok}/{args.calls} calls answered, {stats['failures']} injected failures retried")
+    client.close()
+    server.shutdown()
+
+    server, url = start_stub(latency=2.0)
+    client = LLMClient(base_url=url, read_timeout=0.2, max_retries=1, backoff=0.01)
+    t0 = time.perf_counter()
+    try:
+        client.chat(MESSAGES)
+        print("timeout: call unexpectedly succeeded")
+    except Exception as e:
+        print(f"timeout: {type(e).__name__} after {time.perf_counter() - t0:.2f}s (2 attempts, 0.2s read timeout)")
+    client.close()
+    server.shutdown()
+
+    server, url = start_stub(latency=0.05)
+    client = LLMClient(base_url=url, max_connections=8)
+
+    async def burst():
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(client.achat(MESSAGES) for _ in range(args.calls)))
+        elapsed = time.perf_counter() - t0
+        await client.aclose()
+        return results, elapsed
+
+    results, elapsed = asyncio.run(burst())
+    stats = server.state.stats()
+    print(f"async: {len(results)} concurrent calls in {elapsed:.2f}s over {stats['connections']} connections")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
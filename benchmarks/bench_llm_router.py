@@ -0,0 +1,102 @@
+"""
+LLM router against stub replicas with injected latency and failures.
+
+Three stubs stand in for Llama3 replicas: a fast one, one with a slow tail (slow_rate of its requests take
+slow_latency) and one that fails every request. The same concurrent load goes to:
+
+    single          one LLMClient on the slow-tailed replica
+    router          least outstanding requests + circuit breaker over all three, no hedging
+    router+hedge    the same, hedging calls still running after the p-th percentile latency
+
+Then the failing replica is brought back and the report shows the health check closing its circuit.
+
+    python benchmarks/bench_llm_router.py [--requests 400] [--concurrency 8]
+"""
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import llm_client  # noqa: E402
+import llm_router  # noqa: E402
+from stub_llm_server import start_stub  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "make measures 1-4 more joyful"}]
+
+
+def drive(client, requests, concurrency):
+    """Latencies of successful calls and the number of failed ones"""
+    def one(_):
+        t0 = time.perf_counter()
+        try:
+            client.chat(MESSAGES)
+        except Exception:
+            return None
+        return time.perf_counter() - t0
+
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    return [r for r in results if r is not None], sum(r is None for r in results)
+
+
+def report(label, latencies, errors, wall):
+    p = lambda q: llm_router.percentile(latencies, q) * 1000 if latencies else float("nan")  # noqa: E731
+    total = len(latencies) + errors
+    print(f"{label:<14} {p(50):8.0f}ms {p(95):8.0f}ms {p(99):8.0f}ms {p(100):8.0f}ms "
+          f"{errors / total:8.1%} {total / wall:8.1f}/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-latency", type=float, default=1.0)
+    parser.add_argument("--hedge-percentile", type=float, default=90)
+    args = parser.parse_args()
+
+    fast, fast_url = start_stub(latency=args.latency, seed=1)
+    tail, tail_url = start_stub(latency=args.latency, slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+                                seed=2)
+    broken, broken_url = start_stub(latency=args.latency, fail_rate=1.0, seed=3)
+    urls = [fast_url, tail_url, broken_url]
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}; replicas: {args.latency * 1000:.0f}ms, "
+          f"{args.latency * 1000:.0f}ms with {args.slow_rate:.0%} at {args.slow_latency * 1000:.0f}ms, always 503")
+    print(f"{'':<14} {'p50':>10} {'p95':>10} {'p99':>10} {'max':>10} {'errors':>8} {'rate':>10}")
+
+    single = llm_client.LLMClient(base_url=tail_url)
+    t0 = time.perf_counter()
+    latencies, errors = drive(single, args.requests, args.concurrency)
+    report("single", latencies, errors, time.perf_counter() - t0)
+    single.close()
+
+    for label, hedge in (("router", 0), ("router+hedge", args.hedge_percentile)):
+        router = llm_router.LLMRouter.from_urls(urls, hedge_percentile=hedge, breaker_cooldown=5,
+                                                health_interval=0.5)
+        t0 = time.perf_counter()
+        latencies, errors = drive(router, args.requests, args.concurrency)
+        report(label, latencies, errors, time.perf_counter() - t0)
+        stats = router.stats()
+        print(f"{'':<14} requests per replica {[b['requests'] for b in stats['backends']]}, "
+              f"states {[b['state'] for b in stats['backends']]}, hedges {stats['hedges']} "
+              f"(won {stats['hedge_wins']}), hedge delay {stats['hedge_delay_ms'] or '-'}ms")
+        if hedge:
+            broken.state.fail_rate = 0.0
+            time.sleep(1.5)
+            drive(router, 50, args.concurrency)
+            stats = router.stats()
+            print(f"after the failing replica recovered: states {[b['state'] for b in stats['backends']]}, "
+                  f"requests per replica {[b['requests'] for b in stats['backends']]}")
+        router.close()
+
+    for stub in (fast, tail, broken):
+        stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
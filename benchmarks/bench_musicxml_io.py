@@ -0,0 +1,90 @@
+"""
+Compare the old NamedTemporaryFile parse/write round-trip with the in-memory path in musicxml_io.
+
+    python benchmarks/bench_musicxml_io.py [score.musicxml] [--measures 64] [--repeat 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from music21 import converter, note, stream  # noqa: E402
+
+from musicxml_io import parse_musicxml_string, score_to_musicxml  # noqa: E402
+
+
+def synthetic_score(measures):
+    s = stream.Score()
+    for p_idx in range(2):
+        p = stream.Part()
+        for m_num in range(1, measures + 1):
+            m = stream.Measure(number=m_num)
+            for beat in range(4):
+                m.append(note.Note(60 + (m_num + beat + p_idx * 7) % 24, quarterLength=1))
+            p.append(m)
+        s.insert(0, p)
+    return score_to_musicxml(s)
+
+
+def parse_via_tempfile(xml_str):
+    with tempfile.NamedTemporaryFile(mode="w+", suffix=".xml", delete=False, encoding="utf-8") as f:
+        f.write(xml_str)
+        f.flush()
+        path = f.name
+    try:
+        return converter.parse(path, forceSource=True)
+    finally:
+        os.remove(path)
+
+
+def write_via_tempfile(score):
+    with tempfile.NamedTemporaryFile(mode="r+", suffix=".xml", delete=False, encoding="utf-8") as tmp:
+        path = tmp.name
+    try:
+        score.write("musicxml", fp=path)
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+
+def timeit(fn, arg, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(arg)
+        samples.append(time.perf_counter() - t0)
+    return statistics.median(samples)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("path", nargs="?")
+    ap.add_argument("--measures", type=int, default=64)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    if args.path:
+        with open(args.path, encoding="utf-8") as f:
+            xml_str = f.read()
+    else:
+        xml_str = synthetic_score(args.measures)
+
+    score = parse_musicxml_string(xml_str)
+    rows = [
+        ("parse  tempfile", timeit(parse_via_tempfile, xml_str, args.repeat)),
+        ("parse  memory", timeit(parse_musicxml_string, xml_str, args.repeat)),
+        ("write  tempfile", timeit(write_via_tempfile, score, args.repeat)),
+        ("write  memory", timeit(score_to_musicxml, score, args.repeat)),
+    ]
+    print(f"score: {len(xml_str)} bytes, median of {args.repeat}")
+    for name, sec in rows:
+        print(f"{name:<16} {sec * 1000:9.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Compare the per-note music21 actions with the NumPy note-table engine and check that both produce the same MusicXML.
+
+    python benchmarks/bench_note_table.py [--sizes 1000 10000 100000] [--no-check]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from music21 import chord, dynamics, key, meter, note, stream  # noqa: E402
+
+import server  # noqa: E402
+from musicxml_io import score_to_musicxml  # noqa: E402
+from score_cache import freeze_score, thaw_score  # noqa: E402
+
+CASES = [
+    ("transpose", server.transpose_notes, {"semitones": 3}),
+    ("adjust_rhythm", server.adjust_rhythm, {"scale": 0.85}),
+    ("modify_dynamics", server.modify_dynamics, {"dynamics_shift": 1}),
+    ("change_mode", server.change_mode, {"from": "major", "to": "minor"}),
+]
+
+
+def synthetic_score(n_notes, parts=2):
+    """A piano-like score with single notes, triads, accidentals, key changes and dynamics"""
+    per_part = n_notes // parts
+    s = stream.Score()
+    names = ["C4", "E-4", "F#4", "G4", "B-3", "D5", "A4", "C#5"]
+    for p_idx in range(parts):
+        p = stream.Part()
+        count = 0
+        m_num = 1
+        while count < per_part:
+            m = stream.Measure(number=m_num)
+            if m_num == 1:
+                m.append(meter.TimeSignature("4/4"))
+            if m_num % 16 == 1:
+                m.append(key.KeySignature((m_num // 16) % 5 - 2))
+            if m_num % 4 == 1:
+                m.insert(0, dynamics.Dynamic(["p", "mf", "f"][m_num % 3]))
+            for beat in range(4):
+                root = names[(m_num + beat + p_idx) % len(names)]
+                if beat % 2:
+                    el = chord.Chord([root, note.Note(root).transpose("M3").pitch, note.Note(root).transpose("P5").pitch])
+                    count += 3
+                else:
+                    el = note.Note(root)
+                    count += 1
+                el.quarterLength = 1
+                m.append(el)
+            p.append(m)
+            m_num += 1
+        s.insert(0, p)
+    return s
+
+
+def normalized_xml(score):
+    # music21 gives id-less parts random ids and stamps the date; neither is part of the edit
+    xml = score_to_musicxml(score)
+    xml = re.sub(r' id="[^"]*"', "", xml)
+    return re.sub(r"<encoding-date>.*?</encoding-date>", "", xml)
+
+
+def run(frozen, fn, params, engine):
+    server.ACTION_ENGINE = engine
+    score = thaw_score(frozen)
+    t0 = time.perf_counter()
+    fn(score, params)
+    return time.perf_counter() - t0, score
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    ap.add_argument("--no-check", action="store_true", help="skip the MusicXML equality check")
+    args = ap.parse_args()
+
+    print(f"{'notes':>8} {'action':<16} {'music21':>10} {'numpy':>10} {'speedup':>8}  identical")
+    for size in args.sizes:
+        frozen = freeze_score(synthetic_score(size))
+        for name, fn, params in CASES:
+            t_m21, s_m21 = run(frozen, fn, params, "music21")
+            t_np, s_np = run(frozen, fn, params, "numpy")
+            same = "-" if args.no_check else str(normalized_xml(s_m21) == normalized_xml(s_np))
+            print(f"{size:>8} {name:<16} {t_m21 * 1000:>8.1f}ms {t_np * 1000:>8.1f}ms {t_m21 / t_np:>7.1f}x  {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Benchmark suite: every stage of the /api/llama3 pipeline over synthetic scores of increasing size.
+
+Scores are generated deterministically (seeded) with 8 to 2000 measures and 1 to 16 parts, and contain single
+notes, chords, rests, accidentals, dynamics, key and time signature changes and tempo marks. For each score the
+suite times fix_steps, parsing, key analysis, snippet extraction (score.measures + export), build_prompt, the LLM
+call against the stub server, every entry in server.ACTIONS on a fresh copy, and serialization, then writes the
+medians as JSON. --compare prints the ratio against an earlier run, to spot regressions between commits.
+
+    python benchmarks/bench_pipeline.py [--cases 8x1 64x4 2000x1] [--repeat 3] [--out results.json]
+    python benchmarks/bench_pipeline.py --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import music21  # noqa: E402
+from music21 import chord, dynamics, key, meter, note, stream, tempo  # noqa: E402
+from music21.musicxml.xmlObjects import MusicXMLWarning  # noqa: E402
+
+import llm_client  # noqa: E402
+import server  # noqa: E402
+from musicxml_io import parse_musicxml_string, score_to_musicxml  # noqa: E402
+from score_cache import freeze_score, thaw_score  # noqa: E402
+from stub_llm_server import start_stub  # noqa: E402
+
+DEFAULT_CASES = ["8x1", "8x4", "64x2", "64x16", "256x4", "512x8", "2000x1", "2000x2"]
+
+ACTION_PARAMS = {
+    "transpose": {"semitones": 2},
+    "change_tempo": {"ratio": 1.2},
+    "adjust_rhythm": {"scale": 0.5},
+    "modify_dynamics": {"dynamics_shift": 1},
+    "add_articulation": {"style": "staccato"},
+    "change_mode": {"from": "major", "to": "minor"},
+    "add_chord_tone": {"interval": "M3"},
+    "repeat_segment": {"times": 2},
+    "add_seventh_chords": {"chord_type": "major seventh"},
+}
+
+PITCHES = ["C4", "D4", "E-4", "E4", "F4", "F#4", "G4", "A4", "B-4", "B4", "C5", "D5", "C#5", "G#3", "A3"]
+DURATIONS = [0.5, 1.0, 1.0, 1.5, 2.0]
+
+
+def generate_score(measures, parts, seed=0):
+    """A deterministic multi-part score with chords, rests, dynamics, key/time signature changes and tempo marks"""
+    rng = random.Random(seed * 1000003 + measures * 31 + parts)
+    score = stream.Score()
+    for p_idx in range(parts):
+        part = stream.Part(id=f"P{p_idx + 1}")
+        part.partName = f"Part {p_idx + 1}"
+        octave_shift = [0, -12, 12, -24][p_idx % 4]
+        for number in range(1, measures + 1):
+            m = stream.Measure(number=number)
+            beats = 3 if (number - 1) // 32 % 2 else 4
+            if number == 1 or number % 32 == 1:
+                m.append(meter.TimeSignature(f"{beats}/4"))
+            if number == 1 or number % 24 == 1:
+                m.append(key.KeySignature(rng.randint(-3, 3)))
+            if p_idx == 0 and (number == 1 or number % 16 == 1):
+                m.insert(0, tempo.MetronomeMark(number=rng.choice([60, 72, 90, 100, 120, 144])))
+            if number % 4 == 1:
+                m.insert(0, dynamics.Dynamic(rng.choice(["pp", "p", "mp", "mf", "f", "ff"])))
+            filled = 0.0
+            while filled < beats:
+                length = min(rng.choice(DURATIONS), beats - filled)
+                roll = rng.random()
+                root = note.Note(rng.choice(PITCHES)).pitch.transpose(octave_shift)
+                if roll < 0.1:
+                    el = note.Rest()
+                elif roll < 0.35:
+                    el = chord.Chord([root, root.transpose("M3"), root.transpose("P5")])
+                else:
+                    el = note.Note(root)
+                el.quarterLength = length
+                m.append(el)
+                filled += length
+            part.append(m)
+        score.insert(0, part)
+    return score
+
+
+def timed(fn, repeat):
+    """Median, min and all run times of fn() over repeat runs"""
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - t0)
+    return {"median": statistics.median(runs), "min": min(runs), "runs": runs}
+
+
+def timed_on_copy(frozen, fn, repeat):
+    """Like timed, but each run gets a freshly thawed score (the thaw isn't timed)"""
+    runs = []
+    for _ in range(repeat):
+        score = thaw_score(frozen)
+        t0 = time.perf_counter()
+        fn(score)
+        runs.append(time.perf_counter() - t0)
+    return {"median": statistics.median(runs), "min": min(runs), "runs": runs}
+
+
+def bench_case(measures, parts, repeat, client):
+    score = generate_score(measures, parts)
+    xml = score_to_musicxml(score)
+    # the editor sends steps like <step>Bb</step>; fix_steps has work to do on those
+    raw_xml = xml.replace("<step>B</step>\n          <alter>-1</alter>", "<step>Bb</step>")
+    frozen = freeze_score(parse_musicxml_string(xml))  # freezing consumes the score it is given
+    parsed = thaw_score(frozen)
+    notes = len(parsed.recurse().notes)
+    end = min(4, measures)
+    info = {"key": "C major", "time_signature": "4/4", "tempo": 100}
+    snippet = score_to_musicxml(parsed.measures(1, end))
+    prompt = server.build_prompt(f"make measures 1-{end} more joyful", info, snippet)
+
+    stages = {
+        "fix_steps": timed(lambda: server.fix_steps(raw_xml), repeat),
+        "parse": timed(lambda: parse_musicxml_string(xml), repeat),
+        "analyze_key": timed_on_copy(frozen, lambda s: s.analyze("key"), repeat),
+        "snippet": timed(lambda: score_to_musicxml(parsed.measures(1, end)), repeat),
+        "build_prompt": timed(lambda: server.build_prompt(f"make measures 1-{end} more joyful", info, snippet),
+                              repeat),
+        "llm": timed(lambda: server.call_llama3_with_prompt(prompt, client=client), repeat),
+        "serialize": timed(lambda: score_to_musicxml(parsed), repeat),
+    }
+    for name, fn in server.ACTIONS.items():
+        params = ACTION_PARAMS.get(name, {})
+        stages[f"action:{name}"] = timed_on_copy(frozen, lambda s, fn=fn, params=params: fn(s, params), repeat)
+    return {"measures": measures, "parts": parts, "notes": notes, "xml_bytes": len(xml), "stages": stages}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_case(case, baseline=None):
+    print(f"\n{case['measures']} measures x {case['parts']} parts: {case['notes']} notes, "
+          f"{case['xml_bytes'] / 1024:.0f} KiB of MusicXML")
+    for name, t in case["stages"].items():
+        line = f"  {name:<28} {t['median'] * 1000:10.2f}ms"
+        if baseline is not None and name in baseline["stages"]:
+            before = baseline["stages"][name]["median"]
+            line += f"   {before * 1000:10.2f}ms before  x{t['median'] / before:5.2f}" if before else ""
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", nargs="+", default=DEFAULT_CASES, help="MEASURESxPARTS, e.g. 64x4")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", default="bench_pipeline.json")
+    parser.add_argument("--compare", help="an earlier --out file to compare against")
+    args = parser.parse_args()
+    # some actions leave overlapping notes that music21 warns about on export; that's not what is measured
+    warnings.simplefilter("ignore", MusicXMLWarning)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = {(c["measures"], c["parts"]): c for c in json.load(f)["cases"]}
+
+    stub, url = start_stub()
+    client = llm_client.LLMClient(base_url=url)
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "music21": music21.__version__,
+            "machine": platform.machine(),
+            "repeat": args.repeat,
+            "action_engine": server.ACTION_ENGINE,
+        },
+        "cases": [],
+    }
+    bench_case(8, 1, 1, client)  # warm-up: first-call costs (imports, caches, the LLM connection) aren't measured
+    for spec in args.cases:
+        measures, parts = (int(n) for n in spec.lower().split("x"))
+        case = bench_case(measures, parts, args.repeat, client)
+        results["cases"].append(case)
+        print_case(case, baseline.get((measures, parts)))
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1)
+    print(f"\nwrote {args.out}")
+    client.close()
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
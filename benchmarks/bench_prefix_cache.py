@@ -0,0 +1,115 @@
+"""
+Time to first token with and without a warm prompt prefix.
+
+Streams a series of /api/llama3 prompts (different instructions and measure ranges of one score) to the stub LLM
+with a per-token prefill cost. The stub hashes prompt tokens in blocks like vLLM's automatic prefix caching, so
+the static system message is only prefilled once when the prefix cache is on. Rows:
+
+    no prefix cache   every request prefills the whole prompt
+    cold prefix       the first request on a fresh prefix cache
+    warm prefix       later requests, which reuse the cached system message
+    variable first    warm cache, but the per-request text placed before the static text
+
+    python benchmarks/bench_prefix_cache.py [score.musicxml] [--prefill-rate 2000] [--format xml|digest]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import llm_client  # noqa: E402
+import server  # noqa: E402
+from bench_note_table import synthetic_score  # noqa: E402
+from musicxml_io import score_to_musicxml  # noqa: E402
+from stub_llm_server import start_stub  # noqa: E402
+
+PROMPTS = [
+    "make measures {a}-{b} more joyful",
+    "make measures {a}-{b} sound darker and slower",
+    "give measures {a}-{b} a modern feel",
+    "make measures {a}-{b} calmer",
+    "make measures {a}-{b} sound like a march",
+    "add some tension to measures {a}-{b}",
+    "make measures {a}-{b} dreamier",
+    "let measures {a}-{b} build to a climax",
+]
+
+
+def requests_for(xml, fmt, count):
+    """User messages for count different prompts over the score"""
+    req = server.Llama3Request("", xml, snippet_format=fmt)
+    last = req.index.numbers[-1] if req.index.numbers else 4
+    out = []
+    for i in range(count):
+        a = 1 + (i * 3) % max(1, last - 3)
+        req = server.Llama3Request(PROMPTS[i % len(PROMPTS)].format(a=a, b=a + 3), xml, snippet_format=fmt)
+        req._global_info = {"key": "C major", "time_signature": "4/4", "tempo": 100}
+        out.append(req.full_prompt())
+    return out
+
+
+def ttft(client, messages):
+    t0 = time.perf_counter()
+    first = None
+    for _ in client.stream_chat(messages):  # read to the end so the connection goes back to the pool
+        if first is None:
+            first = time.perf_counter() - t0
+    return first if first is not None else time.perf_counter() - t0
+
+
+def run(prompts, fmt, prefill_rate, prefix_cache, layout="system"):
+    """[(ttft, prompt tokens, cached tokens)] per prompt against a fresh stub"""
+    stub, url = start_stub(prefill_rate=prefill_rate, prefix_cache=prefix_cache)
+    client = llm_client.LLMClient(base_url=url)
+    rows = []
+    for prompt in prompts:
+        messages = server.llama3_messages(prompt, fmt)
+        if layout == "variable first":
+            messages = [{"role": "user", "content": messages[1]["content"] + messages[0]["content"]}]
+        before = stub.state.stats()
+        elapsed = ttft(client, messages)
+        after = stub.state.stats()
+        rows.append((elapsed, after["prompt_tokens"] - before["prompt_tokens"],
+                     after["cached_tokens"] - before["cached_tokens"]))
+    client.close()
+    stub.shutdown()
+    return rows
+
+
+def report(label, rows):
+    times = [r[0] for r in rows]
+    tokens = sum(r[1] for r in rows)
+    cached = sum(r[2] for r in rows) / tokens if tokens else 0.0
+    print(f"{label:<18} {len(rows):>4} {statistics.median(times) * 1000:9.0f}ms {max(times) * 1000:9.0f}ms "
+          f"{tokens // len(rows):>9} {cached:>9.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("score", nargs="?")
+    parser.add_argument("--prefill-rate", type=float, default=2000, help="stub prompt tokens per second")
+    parser.add_argument("--format", choices=sorted(server.SNIPPET_FORMATS), default="xml")
+    parser.add_argument("--requests", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.score:
+        xml = open(args.score, encoding="utf-8").read()
+    else:
+        xml = score_to_musicxml(synthetic_score(500))
+    xml = server.fix_steps(xml)
+    prompts = requests_for(xml, args.format, args.requests)
+    system_chars = len(server.SYSTEM_MESSAGES[args.format])
+
+    print(f"format {args.format}, system message {system_chars} chars, stub prefill {args.prefill_rate:g} tokens/s")
+    print(f"{'':<18} {'reqs':>4} {'ttft p50':>11} {'ttft max':>11} {'tokens':>9} {'cached':>9}")
+    report("no prefix cache", run(prompts, args.format, args.prefill_rate, False))
+    rows = run(prompts, args.format, args.prefill_rate, True)
+    report("cold prefix", rows[:1])
+    report("warm prefix", rows[1:])
+    report("variable first", run(prompts, args.format, args.prefill_rate, True, layout="variable first")[1:])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Prompt size and LLM latency with the MusicXML snippet vs the compact score digest.
+
+For each score, builds the full /api/llama3 prompt both ways and reports characters, tokens (tiktoken's
+cl100k_base if installed, otherwise an approximate count), the time to build the snippet, and the round trip
+to the stub LLM with a prefill cost per prompt token.
+
+    python benchmarks/bench_score_digest.py [score.musicxml ...] [--prefill-rate 2000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import llm_client  # noqa: E402
+import server  # noqa: E402
+from bench_note_table import synthetic_score  # noqa: E402
+from musicxml_io import score_to_musicxml  # noqa: E402
+from stub_llm_server import approx_tokens, start_stub  # noqa: E402
+
+try:
+    import tiktoken
+except ImportError:  # the approximate count is close enough to compare the two formats
+    tiktoken = None
+
+
+def count_tokens(text):
+    if tiktoken is not None:
+        return len(tiktoken.get_encoding("cl100k_base").encode(text))
+    return approx_tokens(text)
+
+
+def measure(label, xml, client, prompt):
+    rows = []
+    for fmt in ("xml", "digest"):
+        req = server.Llama3Request(prompt, xml, snippet_format=fmt)
+        req._global_info = {"key": "C major", "time_signature": "4/4", "tempo": 100}
+        t0 = time.perf_counter()
+        full_prompt = req.full_prompt()
+        build = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        server.call_llama3_with_prompt(full_prompt, client=client, snippet_format=fmt)
+        round_trip = time.perf_counter() - t0
+        text = "".join(m["content"] for m in server.llama3_messages(full_prompt, fmt))
+        rows.append((fmt, len(text), count_tokens(text), build, round_trip))
+
+    (_, xml_chars, xml_tokens, _, xml_rt), (_, dg_chars, dg_tokens, _, dg_rt) = rows
+    for fmt, chars, tokens, build, rt in rows:
+        print(f"{label:<26} {fmt:<7} {chars:>9} {tokens:>9} {build * 1000:9.1f}ms {rt * 1000:9.0f}ms")
+    print(f"{'':<26} {'ratio':<7} {xml_chars / dg_chars:>8.1f}x {xml_tokens / dg_tokens:>8.1f}x "
+          f"{'':>11} {xml_rt / dg_rt:>8.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("scores", nargs="*")
+    parser.add_argument("--notes", type=int, nargs="+", default=[500, 2000])
+    parser.add_argument("--prefill-rate", type=float, default=2000, help="stub prompt tokens per second")
+    parser.add_argument("--prompt", default="make measures 1-4 more joyful")
+    args = parser.parse_args()
+
+    stub, url = start_stub(prefill_rate=args.prefill_rate)
+    client = llm_client.LLMClient(base_url=url)
+    print(f"tokens: {'tiktoken cl100k_base' if tiktoken else 'approximate (words + punctuation)'}; "
+          f"stub prefill {args.prefill_rate:g} tokens/s")
+    print(f"{'score':<26} {'format':<7} {'chars':>9} {'tokens':>9} {'build':>11} {'round trip':>11}")
+
+    cases = [(os.path.basename(path), open(path, encoding="utf-8").read()) for path in args.scores]
+    cases += [(f"synthetic {n} notes", score_to_musicxml(synthetic_score(n))) for n in args.notes]
+    for label, xml in cases:
+        xml = server.fix_steps(xml)
+        measure(label + " (whole)", xml, client, "make it more joyful")
+        measure(label + " (m1-4)", xml, client, args.prompt)
+
+    client.close()
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
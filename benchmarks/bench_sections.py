@@ -0,0 +1,76 @@
+"""
+A whole-score prompt on long scores: one prompt vs sections sent to the model concurrently.
+
+The stub LLM charges a prefill time per prompt token (--prefill-rate tokens/s) on top of a fixed latency, so a
+long prompt costs what it would on a real server. For each synthetic score (bench_pipeline.py) the same "make
+it more joyful" request runs with "sections": false and "sections": true (result caches cleared, "fresh": true),
+and the report shows the wall time, the number of model calls and the largest prompt in tokens.
+
+    python benchmarks/bench_sections.py [--cases 64x2 256x4] [--prefill-rate 4000] [--latency 0.5]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from music21.musicxml.xmlObjects import MusicXMLWarning  # noqa: E402
+
+import llm_client  # noqa: E402
+import server  # noqa: E402
+from bench_pipeline import generate_score  # noqa: E402
+from musicxml_io import score_to_musicxml  # noqa: E402
+from stub_llm_server import start_stub  # noqa: E402
+
+PROMPT = "make it more joyful"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", nargs="+", default=["64x2", "256x4"], help="MEASURESxPARTS")
+    parser.add_argument("--prefill-rate", type=float, default=4000, help="prompt tokens per second")
+    parser.add_argument("--latency", default="0.5", help="stub latency per call (seconds or a distribution)")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore", MusicXMLWarning)
+
+    stub, url = start_stub(latency=args.latency, prefill_rate=args.prefill_rate)
+    llm_client.set_default_client(llm_client.LLMClient(base_url=url))
+    server.candidate_pool.warm()
+    client = server.app.test_client()
+
+    # every model call passes its messages to count_prompt; note each prompt's size (about 4 chars a token)
+    prompts = []
+    count_prompt = server.count_prompt
+
+    def record(messages):
+        prompts.append(sum(len(m["content"]) for m in messages) // 4)
+        count_prompt(messages)
+
+    server.count_prompt = record
+
+    print(f"{'score':<9} {'mode':<9} {'time':>9} {'calls':>6} {'largest prompt':>15} {'status':>7}")
+    for spec in args.cases:
+        measures, parts = (int(n) for n in spec.lower().split("x"))
+        xml = score_to_musicxml(generate_score(measures, parts))
+        for use_sections in (False, True):
+            for cache in (server.plan_results, server.prompt_results):
+                cache.clear()
+            prompts.clear()
+            body = {"prompt": PROMPT, "xml": xml, "fresh": True, "sections": use_sections}
+            t0 = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):  # the handler prints the prompt and plans
+                response = client.post("/api/llama3", json=body)
+            seconds = time.perf_counter() - t0
+            print(f"{spec:<9} {'sections' if use_sections else 'one':<9} {seconds:8.2f}s {len(prompts):>6} "
+                  f"{max(prompts, default=0):>9,} tok {response.status_code:>7}")
+
+    server.candidate_pool.shutdown()
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Follow-up prompts with the score uploaded every time vs through an edit session.
+
+For each synthetic score (bench_pipeline.py) it runs the same follow-up prompt (a transpose the intent rules and
+the XML rewriter answer, so the score handling dominates) three ways: uploading the XML with an empty score
+cache (what a follow-up on a just-accepted option costs today), uploading it with the score cached, and naming
+a session. It then accepts an option and undoes it, and reports the request bytes and the undo patch size.
+
+    python benchmarks/bench_session.py [--cases 64x4 256x8] [--repeat 3]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from music21.musicxml.xmlObjects import MusicXMLWarning  # noqa: E402
+
+import server  # noqa: E402
+from bench_pipeline import generate_score  # noqa: E402
+from musicxml_io import score_to_musicxml  # noqa: E402
+
+PROMPT = "transpose measures 1-4 up 2 semitones"
+
+
+def post(client, path, body):
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # the handlers print the prompt and plans
+        response = client.post(path, json=body)
+    seconds = time.perf_counter() - t0
+    assert response.status_code in (200, 201), response.get_data()[:200]
+    return response.get_json(), seconds
+
+
+def median_of(repeat, fn):
+    return statistics.median(fn() for _ in range(repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", nargs="+", default=["64x4", "256x8"], help="MEASURESxPARTS")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    warnings.simplefilter("ignore", MusicXMLWarning)
+    client = server.app.test_client()
+
+    print(f"{'score':<8} {'xml bytes':>10} {'upload, cold':>13} {'upload, cached':>15} {'session':>9} "
+          f"{'session bytes':>14} {'accept':>8} {'undo':>8} {'patch bytes':>12}")
+    for spec in args.cases:
+        measures, parts = (int(n) for n in spec.lower().split("x"))
+        xml = score_to_musicxml(generate_score(measures, parts))
+        upload = {"prompt": PROMPT, "xml": xml}
+
+        def cold():
+            server.score_cache.clear()
+            return post(client, "/api/llama3", upload)[1]
+
+        cold_s = median_of(args.repeat, cold)
+        cached_s = median_of(args.repeat, lambda: post(client, "/api/llama3", upload)[1])
+
+        created, _ = post(client, "/api/sessions", {"xml": xml})
+        sid = created["session"]
+        server.sessions.get(sid).score_entry()  # wait for the background parse
+        by_session = {"prompt": PROMPT, "session": sid}
+        session_s = median_of(args.repeat, lambda: post(client, "/api/llama3", by_session)[1])
+
+        _, accept_s = post(client, f"/api/sessions/{sid}/accept", {"option": 1})
+        patch_bytes = sum(len(p) for _, p in server.sessions.get(sid)._undo)
+        server.sessions.get(sid).score_entry()  # the accepted option is parsed in the background; let it finish
+        _, undo_s = post(client, f"/api/sessions/{sid}/undo", {})
+        server.sessions.delete(sid)
+
+        print(f"{spec:<8} {len(xml):>10,} {cold_s * 1000:11.1f}ms {cached_s * 1000:13.1f}ms "
+              f"{session_s * 1000:7.1f}ms {len(json.dumps(by_session)):>14,} {accept_s * 1000:6.1f}ms "
+              f"{undo_s * 1000:6.1f}ms {patch_bytes:>12,}")
+
+    server.candidate_pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+N identical /api/llama3 requests at once, with and without single-flight coalescing.
+
+Fires the same score and prompt from N threads through the Flask test client against the stub LLM, with every
+cache cleared first, and reports wall time, LLM calls made and the in-flight stats.
+
+    python benchmarks/bench_single_flight.py [score.musicxml] [--clients 16] [--latency 0.5]
+"""
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import llm_client  # noqa: E402
+import server  # noqa: E402
+from bench_note_table import synthetic_score  # noqa: E402
+from musicxml_io import score_to_musicxml  # noqa: E402
+from stub_llm_server import start_stub  # noqa: E402
+
+
+def burst(xml, prompt, clients):
+    for cache in (server.score_cache, server.plan_results, server.prompt_results):
+        cache.clear()
+    client = server.app.test_client()
+
+    def one(_):
+        response = client.post("/api/llama3", json={"prompt": prompt, "xml": xml})
+        return response.status_code
+
+    t0 = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(clients) as pool:
+        statuses = list(pool.map(one, range(clients)))
+    return time.perf_counter() - t0, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("score", nargs="?")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.5, help="stub LLM seconds per call")
+    parser.add_argument("--prompt", default="make measures 1-4 more joyful")
+    args = parser.parse_args()
+
+    stub, url = start_stub(latency=args.latency)
+    llm_client.set_default_client(llm_client.LLMClient(base_url=url))
+    server.INTENT_RULES = False
+    server.candidate_pool.warm()
+    xml = open(args.score, encoding="utf-8").read() if args.score else score_to_musicxml(synthetic_score(500))
+    xml = server.fix_steps(xml)
+
+    print(f"{args.clients} identical requests at once, stub LLM {args.latency * 1000:.0f}ms")
+    for label, coalesce in (("independent", False), ("coalesced", True)):
+        server.COALESCE_REQUESTS = coalesce
+        server.in_flight = server.SingleFlight()
+        before = stub.state.stats()["requests"]
+        wall, statuses = burst(xml, args.prompt, args.clients)
+        calls = stub.state.stats()["requests"] - before
+        ok = sum(s == 200 for s in statuses)
+        print(f"{label:<12} wall {wall:6.2f}s  ok {ok}/{len(statuses)}  LLM calls {calls:>3}  "
+              f"in-flight stats {server.in_flight.stats()}")
+
+    server.candidate_pool.shutdown()
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Startup and first-request latency: a cold process vs one warmed by serve.warm_up(), and the pre-forked server.
+
+Each mode runs in a fresh interpreter. "cold" imports server and answers requests straight away; "warm" runs
+serve.warm_up() first, as serve.py does before forking. Both send the same LLM-path request (stub LLM, result
+caches cleared before each request) several times; the first one carries every first-call cost. Then serve.py
+is started with --workers workers, and the report shows its startup log, the time until it accepts connections
+and the first requests it answers.
+
+    python benchmarks/bench_startup.py [score.musicxml] [--requests 3] [--workers 2]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+PROMPT = "make measures 1-4 more joyful"
+
+
+def child(mode, score_path, requests):
+    started = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, HERE)
+    import llm_client
+    import server
+    from stub_llm_server import start_stub
+    imported = time.perf_counter()
+    warm = None
+    if mode == "warm":
+        import serve
+        serve.warm_up()
+        warm = time.perf_counter() - imported
+
+    stub, url = start_stub()
+    llm_client.set_default_client(llm_client.LLMClient(base_url=url))
+    server.candidate_pool.warm()
+    client = server.app.test_client()
+    xml = open(score_path, encoding="utf-8").read()
+    latencies = []
+    for _ in range(requests):
+        for cache in (server.score_cache, server.plan_results, server.prompt_results):
+            cache.clear()
+        t0 = time.perf_counter()
+        response = client.post("/api/llama3", json={"prompt": PROMPT, "xml": xml})
+        latencies.append(time.perf_counter() - t0)
+        assert response.status_code == 200, response.get_data()[:200]
+    server.candidate_pool.shutdown()
+    stub.shutdown()
+    return {"import": imported - started, "warm_up": warm, "requests": latencies}
+
+
+def run_child(mode, score_path, requests):
+    out = subprocess.run([sys.executable, __file__, score_path, "--child", mode, "--requests", str(requests)],
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def prefork(score_path, workers, port):
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, HERE)
+    try:
+        import httpx
+    except ImportError:  # the openai package ships its HTTP client as httpx2
+        import httpx2 as httpx
+    from stub_llm_server import start_stub
+
+    stub, url = start_stub()
+    env = dict(os.environ, LLM_BASE_URL=url, PORT=str(port), HOST="127.0.0.1", SERVE_WORKERS=str(workers))
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "serve.py")], env=env, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, text=True)
+    log = []
+    ready = 0
+    while ready < workers:
+        line = proc.stdout.readline()
+        if not line:
+            raise RuntimeError("serve.py exited:\n" + "".join(log))
+        log.append(line)
+        ready += " ready" in line
+    ready_at = time.perf_counter() - t0
+    # keep reading the server's output so it never blocks on a full pipe
+    threading.Thread(target=proc.stdout.read, daemon=True).start()
+
+    xml = open(score_path, encoding="utf-8").read()
+    results = []
+    for i in range(workers * 2):
+        # a new connection each time, so the kernel hands it to whichever worker accepts first
+        with httpx.Client(timeout=60) as client:
+            t1 = time.perf_counter()
+            response = client.post(f"http://127.0.0.1:{port}/api/llama3",
+                                   json={"prompt": f"{PROMPT} ({i})", "xml": xml, "fresh": True})
+            results.append((time.perf_counter() - t1, response.status_code))
+    proc.terminate()
+    proc.wait(10)
+    stub.shutdown()
+    return log, ready_at, results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("score", nargs="?", default=os.path.join(ROOT, "test.musicxml"))
+    parser.add_argument("--requests", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--port", type=int, default=5071)
+    parser.add_argument("--child", choices=["cold", "warm"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child(args.child, args.score, args.requests)))
+        return
+
+    print(f"{'process':<8} {'import':>9} {'warm-up':>9}   requests (result caches cleared before each)")
+    for mode in ("cold", "warm"):
+        r = run_child(mode, args.score, args.requests)
+        warm = f"{r['warm_up'] * 1000:7.0f}ms" if r["warm_up"] is not None else f"{'-':>9}"
+        print(f"{mode:<8} {r['import'] * 1000:7.0f}ms {warm}   "
+              + "  ".join(f"{s * 1000:6.1f}ms" for s in r["requests"]))
+
+    log, ready_at, results = prefork(args.score, args.workers, args.port)
+    print(f"\nserve.py with {args.workers} workers: all ready {ready_at:.2f}s after launch")
+    for line in log:
+        print("  " + line.rstrip())
+    print("first requests after startup (a new connection each, spread over the workers by the kernel):")
+    print("  " + "  ".join(f"{latency * 1000:6.1f}ms" for latency, _ in results)
+          + f"   statuses {[status for _, status in results]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Time to first option: /api/llama3 (whole answer, then both candidates) vs /api/llama3/stream.
+
+Runs the Flask app in-process against the stub LLM streaming its answer token by token. The first
+candidate takes the direct-XML fast path and the second needs the process pool (add_chord_tone).
+
+    python benchmarks/bench_streaming.py [--notes 1000] [--token-delay 0.005]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import llm_client  # noqa: E402
+import server  # noqa: E402
+from bench_note_table import synthetic_score  # noqa: E402
+from musicxml_io import score_to_musicxml  # noqa: E402
+from stub_llm_server import start_stub  # noqa: E402
+
+CANDIDATES = {
+    "candidates": [
+        {"id": "v1", "target": {"measures": []}, "action": "transpose", "params": {"semitones": 2},
+         "secondary_actions": [{"action": "add_articulation", "params": {"style": "staccato"}},
+                               {"action": "modify_dynamics", "params": {"dynamics_shift": 1}}]},
+        {"id": "v2", "target": {"measures": []}, "action": "add_chord_tone", "params": {"interval": "M3"},
+         "secondary_actions": [{"action": "transpose", "params": {"semitones": -1}},
+                               {"action": "adjust_rhythm", "params": {"scale": 0.5}}]},
+    ]
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--notes", type=int, default=1000)
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    stub, url = start_stub(content=json.dumps(CANDIDATES), token_delay=args.token_delay)
+    llm_client.set_default_client(llm_client.LLMClient(base_url=url))
+
+    server.candidate_pool.warm()
+    client = server.app.test_client()
+    body = {"prompt": "make it brighter", "xml": score_to_musicxml(synthetic_score(args.notes))}
+
+    for run in range(args.repeat):
+        t0 = time.perf_counter()
+        r = client.post("/api/llama3", json=body)
+        whole = time.perf_counter() - t0
+        assert r.status_code == 200 and all(r.get_json()["options"])
+
+        t0 = time.perf_counter()
+        r = client.post("/api/llama3/stream", json=body, buffered=False)
+        arrivals = []
+        for line in r.response:
+            for raw in line.splitlines():
+                event = json.loads(raw)
+                if event["type"] == "option":
+                    arrivals.append((event["index"], time.perf_counter() - t0, bool(event["xml"])))
+        total = time.perf_counter() - t0
+        r.close()
+
+        first = min(t for _, t, _ in arrivals)
+        print(f"run {run + 1}: /api/llama3 first option {whole * 1000:7.0f}ms | "
+              f"/stream first option {first * 1000:7.0f}ms, all {total * 1000:7.0f}ms "
+              f"(order {[i for i, _, _ in arrivals]}, ok {all(ok for _, _, ok in arrivals)})")
+
+    server.candidate_pool.shutdown()
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Load generator: replays recorded requests against the server and reports latency per endpoint.
+
+Requests come from a JSONL file, one per line: {"endpoint": "/api/llama3", "prompt": "...", "xml_file": "..."}
+(xml_file is relative to the JSONL file; "xml" inlines the score, and "body" adds fields to the POST body). They
+are sent in order, round robin, either open loop at --rps (evenly spaced, or --poisson arrivals; latency counts
+from when a request was due, so a backed-up server shows up as latency rather than a lower send rate) or closed
+loop with --concurrency clients that each send their next request as soon as the last one is answered.
+
+By default the server runs in-process (Flask app on a werkzeug server in a thread) against the stub LLM, with
+--llm-latency as a distribution (see stub_llm_server.py) and answers picked from recorded_candidates.jsonl; --url
+drives an already running server instead. The report has, per endpoint, the requests sent, throughput, error
+rate, status codes and p50/p95/p99/max latency; for streams, the time to the first event too.
+
+    python benchmarks/load_replay.py --rps 20 --duration 30 --llm-latency lognormal:0.8,0.5
+    python benchmarks/load_replay.py --concurrency 16 --requests 500 --url http://127.0.0.1:5000 --json out.json
+"""
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+try:
+    import httpx
+except ImportError:  # the openai package ships its HTTP client as httpx2
+    import httpx2 as httpx
+
+from llm_router import percentile  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_requests(path):
+    """[(endpoint, body)] from a JSONL request file"""
+    base = os.path.dirname(os.path.abspath(path))
+    scores = {}
+    requests = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            body = {"prompt": record.get("prompt", "")}
+            if "xml_file" in record:
+                xml_path = os.path.join(base, record["xml_file"])
+                if xml_path not in scores:
+                    with open(xml_path, encoding="utf-8") as x:
+                        scores[xml_path] = x.read()
+                body["xml"] = scores[xml_path]
+            elif "xml" in record:
+                body["xml"] = record["xml"]
+            body.update(record.get("body", {}))
+            requests.append((record.get("endpoint", "/api/llama3"), body))
+    return requests
+
+
+def start_app(llm_latency, responses, seed):
+    """The Flask app on a local server in a thread, against a stub LLM. Returns (base_url, stop)."""
+    import logging
+
+    from werkzeug.serving import make_server
+
+    import llm_client
+    import server
+    from stub_llm_server import load_responses, start_stub
+
+    stub, llm_url = start_stub(latency=llm_latency, seed=seed,
+                               responses=load_responses(responses) if responses else None)
+    llm_client.set_default_client(llm_client.LLMClient(base_url=llm_url))
+    server.candidate_pool.warm()
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # no access log line per request
+    http = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+
+    def stop():
+        http.shutdown()
+        server.candidate_pool.shutdown()
+        stub.shutdown()
+
+    return f"http://127.0.0.1:{http.server_port}", stop
+
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_endpoint = collections.defaultdict(lambda: {"latency": [], "first_event": [], "statuses": {}})
+
+    def add(self, endpoint, status, latency, first_event=None):
+        with self.lock:
+            entry = self.by_endpoint[endpoint]
+            entry["statuses"][status] = entry["statuses"].get(status, 0) + 1
+            entry["latency"].append(latency)
+            if first_event is not None:
+                entry["first_event"].append(first_event)
+
+    def report(self, wall):
+        report = {}
+        for endpoint, entry in sorted(self.by_endpoint.items()):
+            count = sum(entry["statuses"].values())
+            errors = sum(n for status, n in entry["statuses"].items() if status != 200)
+            row = {
+                "requests": count,
+                "throughput": count / wall if wall else 0.0,
+                "error_rate": errors / count if count else 0.0,
+                "statuses": {str(k): v for k, v in sorted(entry["statuses"].items(), key=lambda kv: str(kv[0]))},
+            }
+            for name in ("latency", "first_event"):
+                if entry[name]:
+                    row[name] = {f"p{q}": percentile(entry[name], q) for q in (50, 95, 99)}
+                    row[name]["max"] = max(entry[name])
+            report[endpoint] = row
+        return report
+
+
+def send(client, url, endpoint, body, results, due):
+    """One request; latency is measured from due (a perf_counter time)"""
+    first_event = None
+    try:
+        if endpoint.endswith("/stream"):
+            with client.stream("POST", url + endpoint, json=body) as response:
+                status = response.status_code
+                for line in response.iter_lines():
+                    if not line.strip():
+                        continue
+                    if first_event is None:
+                        first_event = time.perf_counter() - due
+                    if status == 200 and json.loads(line).get("type") == "error":
+                        status = "stream-error"
+        else:
+            response = client.post(url + endpoint, json=body)
+            status = response.status_code
+    except Exception as e:
+        # not only httpx errors: in the open-loop pool nothing else would ever see the exception
+        status = type(e).__name__
+    results.add(endpoint, status, time.perf_counter() - due, first_event)
+
+
+def open_loop(client, url, requests, results, rps, count, duration, poisson, seed, max_outstanding):
+    """Send at a fixed rate regardless of how fast answers come back"""
+    rng = random.Random(seed)
+    pool = concurrent.futures.ThreadPoolExecutor(max_outstanding)
+    start = time.perf_counter()
+    due = start
+    sent = 0
+    for endpoint, body in itertools.cycle(requests):
+        if sent >= count or due - start >= duration:
+            break
+        wait = due - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        pool.submit(send, client, url, endpoint, body, results, due)
+        sent += 1
+        due += rng.expovariate(rps) if poisson else 1.0 / rps
+    pool.shutdown(wait=True)
+    return time.perf_counter() - start
+
+
+def closed_loop(client, url, requests, results, concurrency, count, duration):
+    """concurrency clients, each sending its next request as soon as the last one is answered"""
+    queue = itertools.cycle(requests)
+    lock = threading.Lock()
+    start = time.perf_counter()
+    sent = [0]
+
+    def worker():
+        while True:
+            with lock:
+                if sent[0] >= count or time.perf_counter() - start >= duration:
+                    return
+                sent[0] += 1
+                endpoint, body = next(queue)
+            send(client, url, endpoint, body, results, time.perf_counter())
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start
+
+
+def print_report(report, wall):
+    print(f"\n{'endpoint':<22} {'requests':>8} {'rate':>8} {'errors':>7} {'p50':>9} {'p95':>9} {'p99':>9} "
+          f"{'max':>9}  statuses")
+    for endpoint, row in report.items():
+        lat = row.get("latency", {})
+        ms = lambda name: f"{lat[name] * 1000:7.0f}ms" if name in lat else f"{'-':>9}"  # noqa: E731
+        print(f"{endpoint:<22} {row['requests']:>8} {row['throughput']:6.1f}/s {row['error_rate']:7.1%} "
+              f"{ms('p50')} {ms('p95')} {ms('p99')} {ms('max')}  {row['statuses']}")
+        if "first_event" in row:
+            fe = row["first_event"]
+            print(f"{'  first event':<22} {'':>8} {'':>8} {'':>7} {fe['p50'] * 1000:7.0f}ms {fe['p95'] * 1000:7.0f}ms "
+                  f"{fe['p99'] * 1000:7.0f}ms {fe['max'] * 1000:7.0f}ms")
+    print(f"wall {wall:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("requests_file", nargs="?", default=os.path.join(HERE, "load_requests.jsonl"))
+    parser.add_argument("--url", help="a running server (default: start one in-process against the stub LLM)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--rps", type=float, help="open loop at this many requests per second")
+    mode.add_argument("--concurrency", type=int, help="closed loop with this many clients (default 8)")
+    parser.add_argument("--poisson", action="store_true", help="exponential gaps between open-loop arrivals")
+    parser.add_argument("--requests", type=int, default=200, help="stop after this many requests")
+    parser.add_argument("--duration", type=float, default=float("inf"), help="or after this many seconds")
+    parser.add_argument("--max-outstanding", type=int, default=256, help="open loop: requests in flight at most")
+    parser.add_argument("--llm-latency", default="lognormal:0.5,0.5", help="stub LLM latency distribution")
+    parser.add_argument("--responses", default=os.path.join(HERE, "recorded_candidates.jsonl"),
+                        help="recorded LLM answers for the stub")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    requests = load_requests(args.requests_file)
+    stop = None
+    url = args.url.rstrip("/") if args.url else None
+    if url is None:
+        url, stop = start_app(args.llm_latency, args.responses, args.seed)
+
+    results = Results()
+    limits = httpx.Limits(max_connections=args.max_outstanding, max_keepalive_connections=args.max_outstanding)
+    with httpx.Client(timeout=300, limits=limits) as client:
+        if args.rps:
+            print(f"open loop at {args.rps} rps{' (poisson)' if args.poisson else ''}, {len(requests)} recorded "
+                  f"requests against {url}")
+            wall = open_loop(client, url, requests, results, args.rps, args.requests, args.duration, args.poisson,
+                             args.seed, args.max_outstanding)
+        else:
+            concurrency = args.concurrency or 8
+            print(f"closed loop with {concurrency} clients, {len(requests)} recorded requests against {url}")
+            wall = closed_loop(client, url, requests, results, concurrency, args.requests, args.duration)
+
+    report = results.report(wall)
+    print_report(report, wall)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"wall": wall, "mode": "open" if args.rps else "closed", "endpoints": report}, f, indent=1)
+        print(f"wrote {args.json}")
+    if stop is not None:
+        stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""
+Local stand-in for the OpenAI-compatible Llama3 backend.
+
+Serves POST /v1/chat/completions with a canned candidates JSON (or one picked at random from recorded
+responses) after a delay drawn from a latency distribution, and can fail a fraction of requests with 503 to
+exercise retries (fail_first fails the first requests instead, and fail_status picks the status, e.g. 429).
+A latency is a number of seconds or a distribution: uniform:LOW,HIGH, normal:MEAN,SD,
+lognormal:MEDIAN,SIGMA or exp:MEAN. slow_rate makes that fraction of requests take slow_latency
+instead of latency, for a long latency tail. With "stream": true the content is sent as SSE chunks,
+token_delay seconds apart. prefill_rate (prompt tokens per second) adds a delay proportional to the prompt
+size before the first byte, like a real server's prefill. With prefix_cache, prompt tokens are hashed in blocks
+the way vLLM's automatic prefix caching does, and blocks of a prefix seen before cost no prefill; usage reports
+them as prompt_tokens_details.cached_tokens. GET /stats reports requests, failures, prompt and cached tokens,
+and how many TCP connections were opened (keep-alive reuse shows up as fewer connections than requests).
+
+    python benchmarks/stub_llm_server.py --port 8000 --latency 0.2 --fail-rate 0.1
+    python benchmarks/stub_llm_server.py --latency lognormal:1.5,0.4 --responses benchmarks/recorded_candidates.jsonl
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_CANDIDATES = {
+    "candidates": [
+        {
+            "id": "v1",
+            "target": {"measures": []},
+            "action": "transpose",
+            "params": {"semitones": 2},
+            "secondary_actions": [
+                {"action": "add_articulation", "params": {"style": "staccato"}},
+                {"action": "modify_dynamics", "params": {"dynamics_shift": 1}},
+            ],
+        },
+        {
+            "id": "v2",
+            "target": {"measures": []},
+            "action": "change_tempo",
+            "params": {"ratio": 1.25},
+            "secondary_actions": [
+                {"action": "adjust_rhythm", "params": {"scale": 0.5}},
+                {"action": "add_articulation", "params": {"style": "accent"}},
+            ],
+        },
+    ]
+}
+
+
+def approx_tokens(text):
+    """Rough BPE-like token count: words and individual punctuation characters"""
+    return len(re.findall(r"\w+|[^\w\s]", text))
+
+
+def prompt_tokens(messages):
+    return sum(approx_tokens(m.get("content") or "") for m in messages)
+
+
+def prompt_blocks(messages, block_tokens):
+    """Chained hashes of the prompt's full token blocks, as a prefix cache keys them"""
+    tokens = []
+    for m in messages:
+        tokens += [f"<{m.get('role')}>"] + re.findall(r"\w+|[^\w\s]", m.get("content") or "")
+    hashes, h = [], b""
+    for i in range(0, len(tokens) - block_tokens + 1, block_tokens):
+        h = hashlib.sha1(h + "\x00".join(tokens[i:i + block_tokens]).encode("utf-8")).digest()
+        hashes.append(h)
+    return hashes
+
+
+def latency_sampler(spec):
+    """rng -> seconds for a latency spec: a number, or uniform:LOW,HIGH / normal:MEAN,SD / lognormal:MEDIAN,SIGMA / exp:MEAN"""
+    if isinstance(spec, (int, float)):
+        return lambda rng: float(spec)
+    kind, _, args = str(spec).partition(":")
+    if not args:
+        value = float(kind)
+        return lambda rng: value
+    if kind not in ("uniform", "normal", "lognormal", "exp"):
+        raise ValueError(f"unknown latency distribution {spec!r}")
+    values = [float(v) for v in args.split(",")]
+    if len(values) != (1 if kind == "exp" else 2):
+        raise ValueError(f"wrong number of parameters for {kind} latency: {spec!r}")
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        return lambda rng: values[0] * math.exp(rng.gauss(0.0, values[1]))
+    return lambda rng: rng.expovariate(1.0 / values[0])
+
+
+def load_responses(path):
+    """Recorded model answers, one JSON object per line (a {"content": "..."} line is used verbatim)"""
+    responses = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                responses.append(record["content"] if set(record) == {"content"} else json.dumps(record))
+    return responses
+
+
+class StubState:
+    def __init__(self, content=None, latency=0.0, fail_rate=0.0, seed=None, token_delay=0.0, token_chars=4,
+                 prefill_rate=0.0, prefix_cache=False, block_tokens=16, slow_rate=0.0, slow_latency=0.0,
+                 responses=None, fail_first=0, fail_status=503):
+        self.content = content if content is not None else json.dumps(DEFAULT_CANDIDATES)
+        self.responses = list(responses or [])
+        self.latency = latency
+        self.sample_latency = latency_sampler(latency)
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.token_delay = token_delay
+        self.token_chars = token_chars  # characters per streamed "token"
+        self.prefill_rate = prefill_rate
+        self.prefix_cache = prefix_cache
+        self.block_tokens = block_tokens
+        self.cached_blocks = set()
+        self.fail_rate = fail_rate
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.connections = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def pick(self):
+        """(latency before the first byte, content) for one request"""
+        with self.lock:
+            slow = self.random.random() < self.slow_rate
+            latency = self.slow_latency if slow else self.sample_latency(self.random)
+            content = self.random.choice(self.responses) if self.responses else self.content
+        return latency, content
+
+    def cached_prefix(self, messages):
+        """How many leading prompt tokens are already in the prefix cache; caches the rest"""
+        if not self.prefix_cache:
+            return 0
+        hits = 0
+        with self.lock:
+            blocks = prompt_blocks(messages, self.block_tokens)
+            for h in blocks:
+                if h not in self.cached_blocks:
+                    break
+                hits += 1
+            self.cached_blocks.update(blocks)
+        return hits * self.block_tokens
+
+    def stats(self):
+        with self.lock:
+            return {"requests": self.requests, "failures": self.failures, "connections": self.connections,
+                    "prompt_tokens": self.prompt_tokens, "cached_tokens": self.cached_tokens}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def setup(self):
+        super().setup()
+        # headers and body go out as separate writes; don't let Nagle hold the body back
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.state.lock:
+            self.server.state.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except (ConnectionResetError, BrokenPipeError):
+            pass  # the client went away, e.g. a pooled connection closed at shutdown
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        state = self.server.state
+        if self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, state.stats())
+        elif self.path.rstrip("/").endswith("/models"):
+            # health probe: fails like chat calls do while fail_rate is 1
+            if state.fail_rate >= 1.0:
+                self._send_json(503, {"error": {"message": "injected failure", "type": "server_error"}})
+            else:
+                self._send_json(200, {"object": "list", "data": [{"id": "llama3", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        state = self.server.state
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": "not found"})
+            return
+
+        with state.lock:
+            state.requests += 1
+            fail = state.requests <= state.fail_first or state.random.random() < state.fail_rate
+            if fail:
+                state.failures += 1
+        latency, content = state.pick()
+        tokens = prompt_tokens(request.get("messages", []))
+        cached = min(state.cached_prefix(request.get("messages", [])), tokens)
+        with state.lock:
+            state.prompt_tokens += tokens
+            state.cached_tokens += cached
+        delay = latency + ((tokens - cached) / state.prefill_rate if state.prefill_rate else 0.0)
+        if delay:
+            time.sleep(delay)
+        if fail:
+            self._send_json(state.fail_status, {"error": {"message": "injected failure", "type": "server_error"}})
+            return
+
+        if request.get("stream"):
+            self._stream(request, state, content)
+            return
+
+        self._send_json(200, {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "llama3"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": tokens, "completion_tokens": 0, "total_tokens": tokens,
+                      "prompt_tokens_details": {"cached_tokens": cached}},
+        })
+
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _stream(self, request, state, content):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        pieces = [content[i:i + state.token_chars] for i in range(0, len(content), state.token_chars)]
+        for i, piece in enumerate(pieces + [None]):
+            chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model", "llama3"),
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": piece} if piece is not None else {},
+                    "finish_reason": None if piece is not None else "stop",
+                }],
+            }
+            if i and state.token_delay:
+                time.sleep(state.token_delay)
+            self._write_chunk(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n")
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+
+def start_stub(host="127.0.0.1", port=0, **options):
+    """Run a stub server in a background thread. Returns (server, base_url); server.state has the stats."""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.state = StubState(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", default="0", help="seconds before each response, or a distribution")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of requests that take --slow-latency")
+    parser.add_argument("--slow-latency", type=float, default=0.0, help="seconds before a slow response")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed chunks")
+    parser.add_argument("--prefill-rate", type=float, default=0.0, help="prompt tokens per second (0 = instant)")
+    parser.add_argument("--prefix-cache", action="store_true", help="skip prefill for previously seen prefixes")
+    parser.add_argument("--response", help="file whose contents are returned as the message content")
+    parser.add_argument("--responses", help="JSONL of recorded answers, one picked at random per request")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    content = open(args.response, encoding="utf-8").read() if args.response else None
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    server.daemon_threads = True
+    server.state = StubState(content=content, latency=args.latency, fail_rate=args.fail_rate,
+                             token_delay=args.token_delay, prefill_rate=args.prefill_rate,
+                             prefix_cache=args.prefix_cache, slow_rate=args.slow_rate,
+                             slow_latency=args.slow_latency, seed=args.seed,
+                             responses=load_responses(args.responses) if args.responses else None)
+    print(f"stub LLM listening on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
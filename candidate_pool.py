@@ -0,0 +1,182 @@
+import concurrent.futures
+import concurrent.futures.process
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+import metrics
+from score_cache import thaw_score
+
+
+# -------------------------------
+# Parallel candidate materialization
+# -------------------------------
+# Each candidate plan is CPU-bound music21 work that holds the GIL, so the
+# candidates of one request are applied in separate worker processes. Workers
+# receive the frozen (pickled) score from the score cache, thaw their own copy
+# and return the resulting MusicXML string along with the timing spans they
+# recorded, which result() replays into the request process's metrics.
+#
+# A running task can't be cancelled, so a candidate that times out while its
+# worker is still busy would hold that worker for good. Instead the pool it runs
+# in is retired: later candidates go to a fresh pool, work already queued on the
+# old one still finishes, and after one more timeout whatever is left of the old
+# pool's workers is killed.
+
+DEFAULT_WORKERS = int(os.environ.get("CANDIDATE_WORKERS", min(4, os.cpu_count() or 1)))
+DEFAULT_TIMEOUT = float(os.environ.get("CANDIDATE_TIMEOUT", 60))
+
+
+def _init_worker(pids):
+    # tell the pool which process this is, so a retired pool's workers can be found and killed
+    pids.put(os.getpid())
+    # import music21 up front so the first candidate doesn't pay for it
+    import music21  # noqa: F401
+    from music21 import converter, stream, note, chord, dynamics, tempo, articulations, key, interval  # noqa: F401
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def _materialize(apply_fn, frozen, plan, option_number):
+    with metrics.collect() as spans:
+        with metrics.span("thaw"):
+            score = thaw_score(frozen)
+        xml = apply_fn(plan, score, option_number)
+    return xml, spans
+
+
+class CandidatePool:
+    """
+    Warm process pool that applies candidate plans concurrently.
+    apply_fn(plan, score, option_number) -> str must be a module-level function so it can be pickled.
+    With workers=0 everything runs inline in the calling thread.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = None
+        self._pids = None  # queue the current pool's workers put their pid on as they start
+        self._retired = []  # [(executor, its pid queue)] waiting to be killed
+        self._lock = threading.Lock()
+        self.recycled = 0
+
+    def _get_executor(self):
+        # created lazily so a process that forks after import gets its own pool
+        with self._lock:
+            if self._executor is None:
+                context = multiprocessing.get_context()
+                self._pids = context.SimpleQueue()
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=context, initializer=_init_worker,
+                    initargs=(self._pids,),
+                )
+            return self._executor
+
+    def warm(self):
+        """Start every worker process now instead of on the first request"""
+        if self.workers <= 0:
+            return
+        executor = self._get_executor()
+        for f in [executor.submit(_warm_up) for _ in range(self.workers)]:
+            f.result()
+
+    def submit(self, apply_fn, cached_score, candidate, option_number):
+        """Start one candidate and return its Future, to be read with result(); with workers=0 it runs now"""
+        if self.workers <= 0:
+            future = concurrent.futures.Future()
+            try:
+                # spans recorded here already belong to the calling request
+                with metrics.span("thaw"):
+                    score = cached_score.copy()
+                future.set_result((apply_fn(candidate, score, option_number), []))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        executor = self._get_executor()
+        future = executor.submit(_materialize, apply_fn, cached_score.frozen, candidate, option_number)
+        future.executor = executor  # the pool to retire if this candidate hangs, or drop if it breaks
+        return future
+
+    def result(self, future, timeout, label="Candidate"):
+        """The MusicXML a submitted candidate produced, or "" if it failed or didn't finish within timeout"""
+        try:
+            xml, spans = future.result(timeout=max(0.0, timeout))
+            metrics.replay(spans)
+            return xml
+        except concurrent.futures.process.BrokenProcessPool:
+            logging.error("%s lost its worker process", label)
+            self._discard(getattr(future, "executor", None))
+        except concurrent.futures.TimeoutError:
+            logging.error("%s timed out", label)
+            self.abandon(future)
+        except Exception:
+            logging.exception("%s failed", label)
+        return ""
+
+    def abandon(self, future):
+        """Give up on a candidate: cancel it if it hasn't started, else retire the pool its worker is busy in"""
+        if future.cancel() or future.done():
+            return
+        executor = getattr(future, "executor", None)
+        with self._lock:
+            if executor is None or executor is not self._executor:
+                return  # inline, or its pool is already retired
+            self._retired.append((executor, self._pids))
+            self._executor = self._pids = None
+            self.recycled += 1
+        logging.error("Retiring a candidate pool with a stuck worker; its workers are killed in %.0fs", self.timeout)
+        executor.shutdown(wait=False)  # candidates already queued on it still run
+        timer = threading.Timer(self.timeout, self._kill_retired, args=(executor,))
+        timer.daemon = True
+        timer.start()
+
+    def _discard(self, executor):
+        """Drop a broken pool; later candidates start a fresh one. Other pools (and their candidates) are left alone."""
+        with self._lock:
+            if executor is None or executor is not self._executor:
+                return  # inline, already replaced, or a retired pool whose workers were killed
+            self._executor = self._pids = None
+        executor.shutdown(wait=False)
+
+    def _kill_retired(self, executor=None):
+        """Kill the workers of a retired pool (every retired pool with executor=None)"""
+        with self._lock:
+            doomed = [r for r in self._retired if executor is None or r[0] is executor]
+            self._retired = [r for r in self._retired if r not in doomed]
+        pids = set()
+        for _, queue in doomed:
+            while not queue.empty():
+                pids.add(queue.get())
+        # only processes that are still our children, so a recycled pid is never hit
+        for process in multiprocessing.active_children():
+            if process.pid in pids:
+                process.kill()
+
+    def materialize(self, apply_fn, cached_score, candidates, timeout=None, option_numbers=None):
+        """
+        Apply every candidate to its own copy of cached_score (a score_cache.CachedScore).
+        Returns one MusicXML string per candidate, in order; "" for a candidate that failed or timed out.
+        option_numbers defaults to "1", "2", ... in candidate order.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        if option_numbers is None:
+            option_numbers = [str(i + 1) for i in range(len(candidates))]
+        futures = [self.submit(apply_fn, cached_score, c, n) for c, n in zip(candidates, option_numbers)]
+        # all candidates start together, so each one gets the same deadline
+        deadline = time.monotonic() + timeout
+        return [
+            self.result(f, deadline - time.monotonic(), f"Candidate {n}")
+            for f, n in zip(futures, option_numbers)
+        ]
+
+    def shutdown(self):
+        self._kill_retired()
+        with self._lock:
+            executor, self._executor, self._pids = self._executor, None, None
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
@@ -0,0 +1,72 @@
+import json
+
+
+# -------------------------------
+# Incremental candidates parser
+# -------------------------------
+# The model answers {"candidates": [{...}, {...}]}. While the answer is still
+# streaming in, CandidateStreamParser scans the text it has so far and hands
+# out each element of the top-level "candidates" array as soon as its closing
+# brace arrives, so the first candidate can be applied while the second one is
+# still being generated.
+
+class CandidateStreamParser:
+    def __init__(self):
+        self.text = ""
+        self.count = 0          # candidates handed out so far
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None
+        self._key = None        # last key seen in the top-level object
+        self._array_depth = None
+        self._object_start = None
+
+    def feed(self, piece):
+        """Add the next piece of text; returns the candidates (dicts) completed by it"""
+        self.text += piece
+        found = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_string = text[self._string_start + 1:i]
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch == ":" and self._depth == 1:
+                self._key = self._last_string
+            elif ch == "," and self._depth == 1:
+                self._key = None
+            elif ch in "{[":
+                if ch == "[" and self._depth == 1 and self._key == "candidates":
+                    self._array_depth = self._depth + 1
+                elif ch == "{" and self._depth == self._array_depth:
+                    self._object_start = i
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if ch == "}" and self._depth == self._array_depth and self._object_start is not None:
+                    try:
+                        candidate = json.loads(text[self._object_start:i + 1])
+                    except json.JSONDecodeError:
+                        candidate = None
+                    self._object_start = None
+                    if isinstance(candidate, dict):
+                        self.count += 1
+                        found.append(candidate)
+                elif ch == "]" and self._array_depth is not None and self._depth == self._array_depth - 1:
+                    self._array_depth = None
+        self._pos = len(text)
+        return found
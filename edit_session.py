@@ -0,0 +1,424 @@
+import base64
+import difflib
+import fcntl
+import glob
+import json
+import os
+import re
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+# -------------------------------
+# Edit sessions
+# -------------------------------
+# Without a session the editor uploads the whole score with every prompt and
+# the server hashes, parses and analyzes it again. A session keeps the current
+# score on the server: its normalized MusicXML, its content hash and its
+# CachedScore (the frozen parse plus the key analysis and measure digests
+# derived from it). Follow-up prompts name the session instead of sending XML,
+# "accept option N" makes one of the last prompt's options the new current
+# score without sending it back, and undo steps back through earlier versions.
+#
+# Every change gets a new version number; a request that names a version other
+# than the current one is refused (VersionConflict), so two tabs can't edit
+# over each other. Earlier versions are kept as reverse patches: the document
+# is cut into chunks at each <part> and <measure>, the chunk lists are diffed,
+# and only the old chunks of the hunks that differ are kept (zlib-compressed).
+# An edit to four measures of a 10 MB score leaves a patch of a few KB.
+#
+# Sessions expire SESSION_TTL seconds after their last use, and the least
+# recently used ones go first when their total size passes SESSION_MAX_MB.
+#
+# A store is in-memory by default. Processes that serve the same clients (the
+# pre-forked workers of serve.py) share one through SESSION_DIR instead: each
+# session is a file there, written whole with an atomic rename under a lock
+# file, and each process keeps its own parse of the scores it has served. A
+# file starts with a line holding its revision, so a process that already has
+# the session only reads the rest when another one changed it.
+
+SESSION_TTL = float(os.environ.get("SESSION_TTL", 1800))
+SESSION_MAX_MB = int(os.environ.get("SESSION_MAX_MB", 512))
+SESSION_MAX_UNDO = int(os.environ.get("SESSION_MAX_UNDO", 50))
+SESSION_DIR = os.environ.get("SESSION_DIR") or None
+
+_SESSION_ID = re.compile(r"[0-9a-f]{32}")
+
+_CHUNK = re.compile(r"(?=<(?:part|measure)[\s>])")
+
+
+class SessionNotFound(KeyError):
+    pass
+
+
+class VersionConflict(Exception):
+    def __init__(self, version):
+        super().__init__(f"the session is at version {version}")
+        self.version = version
+
+
+def xml_patch(new_xml, old_xml):
+    """A compressed reverse patch: apply_patch(new_xml, patch) == old_xml"""
+    new_chunks, old_chunks = _CHUNK.split(new_xml), _CHUNK.split(old_xml)
+    matcher = difflib.SequenceMatcher(None, new_chunks, old_chunks, autojunk=False)
+    hunks = [
+        (i1, i2, "".join(old_chunks[j1:j2]))
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != "equal"
+    ]
+    return zlib.compress(json.dumps(hunks).encode("utf-8"))
+
+
+def apply_patch(new_xml, patch):
+    chunks = _CHUNK.split(new_xml)
+    out, pos = [], 0
+    for i1, i2, text in json.loads(zlib.decompress(patch)):
+        out.extend(chunks[pos:i1])
+        out.append(text)
+        pos = i2
+    out.extend(chunks[pos:])
+    return "".join(out)
+
+
+class EditSession:
+    """
+    One editor's score on the server. load(xml) -> CachedScore parses (or finds) the current score; it is
+    called at most once per version and the entry is held until the score changes.
+    """
+
+    def __init__(self, xml, key, load):
+        self.id = uuid.uuid4().hex
+        self.xml = xml
+        self.key = key
+        self.version = 0
+        self.created = self.touched = time.time()
+        self._load = load
+        self._entry = None
+        self._undo = []  # [(version, reverse patch)], oldest first
+        self._offered = None  # (version, [option XML]) from the last prompt
+        self._lock = threading.Lock()
+        self._store = None  # the SessionStore whose directory holds this session, if it is shared
+        self.revision = 0  # bumped by every write to the shared file
+
+    @contextmanager
+    def _synced(self):
+        """Hold the session's lock; in a shared store also its file lock, with the latest state read in"""
+        with self._lock:
+            if self._store is None:
+                yield
+                return
+            with self._store._file_lock(self.id):
+                self._store._read(self)
+                yield
+
+    def current(self):
+        """(xml, key, version, CachedScore) of the current score; concurrent callers wait for one parse"""
+        with self._lock:
+            if self._entry is None:
+                self._entry = self._load(self.xml)
+            return self.xml, self.key, self.version, self._entry
+
+    def score_entry(self):
+        return self.current()[3]
+
+    def check(self, version):
+        """Raise VersionConflict unless version is None or the current version"""
+        if version is not None and int(version) != self.version:
+            raise VersionConflict(self.version)
+
+    def offer(self, version, options):
+        """Remember the options a prompt produced, so one of them can be accepted by number"""
+        with self._synced():
+            if version == self.version:
+                self._offered = (version, list(options))
+                self._save()
+
+    def option(self, number):
+        """
+        (option `number` (1-based) of the last prompt on the current version, that version), or None. Commit
+        the option with that version, so it can't land on a newer score.
+        """
+        with self._synced():
+            if self._offered is None or self._offered[0] != self.version:
+                return None
+            options = self._offered[1]
+            if 1 <= number <= len(options) and options[number - 1]:
+                return options[number - 1], self.version
+            return None
+
+    def commit(self, xml, key, version=None):
+        """Make xml the current score; returns the new version"""
+        with self._synced():
+            self.check(version)
+            old_xml, old_version = self.xml, self.version
+        patch = xml_patch(xml, old_xml)  # outside the lock, it's the slow part
+        with self._synced():
+            if self.version != old_version:
+                raise VersionConflict(self.version)
+            self._undo.append((old_version, patch))
+            del self._undo[:-SESSION_MAX_UNDO]
+            self._set(xml, key)
+            self._save()
+            return self.version
+
+    def undo(self, key_of, version=None):
+        """Go back to the score before the last change; returns the new version, or None if there is none"""
+        with self._synced():
+            self.check(version)
+            if not self._undo:
+                return None
+            _, patch = self._undo.pop()
+            xml = apply_patch(self.xml, patch)
+            self._set(xml, key_of(xml))
+            self._save()
+            return self.version
+
+    def _set(self, xml, key):
+        self.xml = xml
+        self.key = key
+        self.version += 1
+        self._entry = None
+        self._offered = None
+
+    def _save(self):
+        if self._store is not None:
+            self._store._write(self)
+
+    def dumps(self):
+        """The session as text: a header line (revision, version, key), then the score, undo patches and options"""
+        header = {"revision": self.revision, "version": self.version, "key": self.key}
+        body = {
+            "xml": self.xml,
+            "created": self.created,
+            "undo": [[v, base64.b64encode(p).decode("ascii")] for v, p in self._undo],
+            "offered": self._offered,
+        }
+        return json.dumps(header) + "\n" + json.dumps(body)
+
+    def loads(self, header, body):
+        """Take the state dumps() wrote; the parse is kept only if the score is the same"""
+        if header["key"] != self.key:
+            self._entry = None
+        self.revision, self.version, self.key = header["revision"], header["version"], header["key"]
+        self.xml = body["xml"]
+        self.created = body["created"]
+        self._undo = [(v, base64.b64decode(p)) for v, p in body["undo"]]
+        self._offered = tuple(body["offered"]) if body["offered"] else None
+
+    @property
+    def undo_depth(self):
+        return len(self._undo)
+
+    @property
+    def size(self):
+        """Bytes held: the score text and parse, the undo patches and the offered options"""
+        entry, offered = self._entry, self._offered
+        return (len(self.xml) + (entry.size if entry is not None else 0) + sum(len(p) for _, p in self._undo)
+                + (sum(len(o or "") for o in offered[1]) if offered else 0))
+
+    def to_dict(self, with_xml=False):
+        body = {"session": self.id, "version": self.version, "undo": self.undo_depth}
+        if with_xml:
+            body["xml"] = self.xml
+        return body
+
+
+class SessionStore:
+    """
+    Edit sessions by id, expired after ttl seconds unused and evicted least recently used first past max_bytes.
+    load(xml) -> CachedScore is handed to every session. With a directory (or after share()) the sessions
+    live in files there, and every store on the same directory sees the same sessions; max_bytes then
+    counts the files.
+    """
+
+    def __init__(self, load, ttl=SESSION_TTL, max_bytes=SESSION_MAX_MB * 1024 * 1024, directory=SESSION_DIR):
+        self._load = load
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.directory = None
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+        if directory is not None:
+            self.share(directory)
+
+    def share(self, directory):
+        """Keep the sessions as files in directory, shared with every other store (and process) using it"""
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def create(self, xml, key):
+        session = EditSession(xml, key, self._load)
+        if self.directory is not None:
+            session._store = self
+            with self._file_lock(session.id):
+                self._write(session)
+        with self._lock:
+            self._sessions[session.id] = session
+            self.created += 1
+        self.trim()
+        return session
+
+    def get(self, session_id):
+        """The session, marked as just used; raises SessionNotFound"""
+        if self.directory is not None:
+            return self._get_shared(session_id)
+        self._expire()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                raise SessionNotFound(session_id)
+            self._sessions.move_to_end(session_id)
+            session.touched = time.time()
+        return session
+
+    def _get_shared(self, session_id):
+        self._expire()
+        if not _SESSION_ID.fullmatch(session_id):
+            raise SessionNotFound(session_id)
+        try:
+            os.utime(self._path(session_id))  # the file's mtime is when the session was last used
+        except FileNotFoundError:
+            with self._lock:
+                self._sessions.pop(session_id, None)
+            raise SessionNotFound(session_id) from None
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                # first use in this process: an empty session that _read fills in
+                session = EditSession("", None, self._load)
+                session.id, session.revision, session._store = session_id, -1, self
+                self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+        with session._lock:
+            self._read(session)
+            session.touched = time.time()
+        return session
+
+    def delete(self, session_id):
+        with self._lock:
+            found = self._sessions.pop(session_id, None) is not None
+        if self.directory is not None and _SESSION_ID.fullmatch(session_id):
+            found = self._remove(session_id)
+        return found
+
+    def _path(self, session_id):
+        return os.path.join(self.directory, session_id + ".session")
+
+    @contextmanager
+    def _file_lock(self, session_id):
+        fd = os.open(os.path.join(self.directory, session_id + ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)  # closing the descriptor releases the lock
+
+    def _read(self, session):
+        """Bring session up to its file's revision; raises SessionNotFound if the file is gone"""
+        try:
+            with open(self._path(session.id), encoding="utf-8") as f:
+                header = json.loads(f.readline())
+                if header["revision"] != session.revision:
+                    session.loads(header, json.loads(f.read()))
+        except FileNotFoundError:
+            raise SessionNotFound(session.id) from None
+
+    def _write(self, session):
+        session.revision += 1
+        path = self._path(session.id)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(session.dumps())
+        os.replace(tmp, path)  # readers never see a half-written session
+
+    def _remove(self, session_id):
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            return False
+        try:
+            os.remove(os.path.join(self.directory, session_id + ".lock"))
+        except FileNotFoundError:
+            pass
+        return True
+
+    def _files(self):
+        """[(mtime, bytes, session id)] of the shared sessions, least recently used first"""
+        files = []
+        for path in glob.glob(os.path.join(self.directory, "*.session")):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, os.path.basename(path)[:-len(".session")]))
+        return sorted(files)
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        if self.directory is not None:
+            files = self._files()
+            for touched, _, session_id in files:
+                if touched < cutoff and self._remove(session_id):
+                    self.expired += 1
+            live = {session_id for touched, _, session_id in files if touched >= cutoff}
+            with self._lock:
+                # drop this process's copies of sessions another process expired, evicted or deleted
+                for session_id in [i for i in self._sessions if i not in live]:
+                    del self._sessions[session_id]
+            return
+        with self._lock:
+            for session_id in [i for i, s in self._sessions.items() if s.touched < cutoff]:
+                del self._sessions[session_id]
+                self.expired += 1
+
+    def trim(self):
+        """Drop expired sessions, then the least recently used ones until the rest fit in max_bytes"""
+        self._expire()
+        if self.directory is not None:
+            files = self._files()
+            total = sum(size for _, size, _ in files)
+            for _, size, session_id in files[:-1]:
+                if total <= self.max_bytes:
+                    break
+                if self._remove(session_id):
+                    self.evicted += 1
+                total -= size
+            return
+        with self._lock:
+            total = sum(s.size for s in self._sessions.values())
+            # the session in use (the most recent) is never evicted, even if it alone is over the limit
+            while total > self.max_bytes and len(self._sessions) > 1:
+                _, old = self._sessions.popitem(last=False)
+                total -= old.size
+                self.evicted += 1
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+        if self.directory is not None:
+            for path in glob.glob(os.path.join(self.directory, "*.session")):
+                self._remove(os.path.basename(path)[:-len(".session")])
+
+    def stats(self) -> dict:
+        if self.directory is not None:
+            files = self._files()
+            count, size = len(files), sum(size for _, size, _ in files)
+        else:
+            with self._lock:
+                count, size = len(self._sessions), sum(s.size for s in self._sessions.values())
+        return {
+            "sessions": count,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "created": self.created,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "shared": self.directory is not None,
+        }
@@ -0,0 +1,320 @@
+import re
+
+
+# -------------------------------
+# Rule-based intent parser
+# -------------------------------
+# Mechanical instructions ("transpose measures 5-8 up 2 semitones", "play one
+# octave lower", "make it 25% faster") map to a plan without asking the model.
+# A prompt is split into clauses; every clause, once the measure range and
+# filler words are taken out, has to match one of the rules below completely.
+# If any clause is left unexplained (a creative or ambiguous request) the
+# parser returns None and the prompt goes to the LLM as before.
+
+NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12,
+}
+
+INTERVAL_SEMITONES = {
+    "minor second": 1, "major second": 2, "minor third": 3, "major third": 4, "third": 4,
+    "perfect fourth": 5, "fourth": 5, "tritone": 6, "perfect fifth": 7, "fifth": 7,
+    "minor sixth": 8, "major sixth": 9, "sixth": 9, "minor seventh": 10, "major seventh": 11,
+}
+
+CHORD_TONES = {
+    "minor third": "m3", "major third": "M3", "third": "M3", "perfect fourth": "P4", "fourth": "P4",
+    "perfect fifth": "P5", "fifth": "P5", "minor sixth": "m6", "major sixth": "M6", "sixth": "M6",
+    "octave": "P8",
+}
+
+PITCH_CLASSES = {"c": 0, "d": 2, "e": 4, "f": 5, "g": 7, "a": 9, "b": 11}
+
+_NUMBER = r"[+-]?\d+|" + "|".join(sorted(NUMBER_WORDS, key=len, reverse=True))
+_INTERVAL = "|".join(sorted(INTERVAL_SEMITONES, key=len, reverse=True))
+_CHORD_TONE = "|".join(sorted(CHORD_TONES, key=len, reverse=True))
+_TONIC = r"[a-g](?:#|b|-| sharp| flat)?"
+
+RANGE_RE = re.compile(
+    r"(?:\b(?:in|for|on|over|across|to|from|of)\s+)?(?:\bthe\s+)?\b(?:measures?|bars?|mm\.?)\s*"
+    r"(\d+)(?:\s*(?:-|–|to|through|thru)\s*(\d+))?"
+)
+CLAUSE_SPLIT_RE = re.compile(r"\s*(?:,|;|\band then\b|\bthen\b|\band also\b|\balso\b|\band\b)\s*")
+FILLER_RE = re.compile(
+    r"\b(?:please|can you|could you|would you|i want to|i'd like to|let's|just|now|for me|"
+    r"make|play|sound|set|put|turn|change|switch|convert|move|shift|"
+    r"the|whole|entire|full|piece|song|melody|tune|music|score|passage|section|it|this|everything|all|notes?)\b"
+)
+
+TRANSPOSE_RE = re.compile(
+    rf"(?:transpose\s+)?(?:(?P<verb>raise|lower)\s+)?(?:(?P<d1>up|down)\s+)?(?:by\s+)?(?:(?P<n>{_NUMBER})\s+)?"
+    rf"(?P<unit>semitones?|half[- ]?steps?|half[- ]?tones?|whole[- ]?steps?|whole[- ]?tones?|tones?|steps?|octaves?|"
+    rf"{_INTERVAL})(?:\s+(?P<d2>up|down|higher|lower|above|below))?"
+)
+TRANSPOSE_TO_RE = re.compile(rf"transpose\s+(?:in)?to\s+(?P<tonic>{_TONIC})(?:\s+(?:major|minor))?(?:\s+key)?")
+PERCENT_RE = re.compile(
+    r"(?:(?P<verb>speed up|slow down|faster|slower)\s+)?(?:by\s+)?(?P<pct>\d+(?:\.\d+)?)\s*(?:%|percent)"
+    r"(?:\s+(?P<dir>faster|slower|quicker))?"
+)
+DOUBLE_RE = re.compile(r"twice as fast|double\s+(?:tempo|speed|time)|2x\s+faster|double-time")
+HALF_RE = re.compile(r"half\s+(?:as fast|tempo|speed|time)|half-time")
+BPM_RE = re.compile(r"(?:tempo\s+)?(?:to|at)\s+(?P<bpm>\d+(?:\.\d+)?)\s*(?:bpm)?|tempo\s+(?P<bpm2>\d+(?:\.\d+)?)\s*(?:bpm)?")
+DYNAMICS_RE = re.compile(
+    r"(?P<much>much\s+|a lot\s+|way\s+)?(?:a (?:little|bit)\s+|slightly\s+)?"
+    r"(?P<dir>louder|softer|quieter|more loudly|more softly|more quietly)"
+    r"(?:\s+by\s+(?P<n>" + _NUMBER + r")\s+(?:levels?|steps?))?"
+)
+VOLUME_RE = re.compile(
+    r"(?P<dir>increase|raise|decrease|reduce|lower)\s+(?:volume|dynamics?)"
+    r"(?:\s+by\s+(?P<n>" + _NUMBER + r")(?:\s+(?:levels?|steps?))?)?"
+)
+ARTICULATION_RE = re.compile(
+    r"(?:(?:add|with|use)\s+)?(?P<style>staccato|accents?|accented)"
+    r"(?:\s+(?:articulations?|marks?|to|on))*"
+)
+MODE_RE = re.compile(
+    rf"(?:(?:key|mode)\s+)?(?:(?:in)?to\s+|in\s+)?"
+    rf"(?:(?P<article>a)\s+(?=(?:major|minor)\s+(?:key|mode|tonality|scale))|(?P<tonic>{_TONIC})\s+)?"
+    rf"(?P<mode>major|minor)(?:\s+(?:key|mode|tonality|scale))?"
+)
+REPEAT_RE = re.compile(rf"repeat(?:\s+(?P<twice>twice|thrice)|\s+(?P<n>{_NUMBER})\s+times)?")
+SEVENTH_RE = re.compile(
+    r"add\s+(?P<type>dominant|major|minor|half-diminished|diminished)?\s*(?:seventh|7th)\s+chords?"
+)
+CHORD_TONE_RE = re.compile(
+    rf"(?:add\s+(?:a\s+|an\s+)?(?:harmony\s+)?(?:(?:a|an)\s+)?(?P<tone>{_CHORD_TONE})(?:\s+(?:above|on top|harmony))?"
+    rf"|harmoni[sz]e\s+(?:in|with)\s+(?P<plural>thirds|fifths|sixths|octaves))"
+)
+
+
+def _number(text):
+    if text is None:
+        return None
+    text = text.strip()
+    return NUMBER_WORDS[text] if text in NUMBER_WORDS else int(text)
+
+
+def _ratio(value):
+    return round(value, 3)
+
+
+def _transpose(clause, info):
+    m = TRANSPOSE_RE.fullmatch(clause)
+    if m:
+        unit = m.group("unit")
+        n = _number(m.group("n"))
+        if unit in INTERVAL_SEMITONES:
+            semitones = INTERVAL_SEMITONES[unit] * (n or 1)
+        elif unit.startswith("octave"):
+            semitones = 12 * (n or 1)
+        elif unit.startswith(("whole", "tone", "step")):
+            semitones = 2 * (n or 1)
+        elif n is None:
+            return None  # "up some semitones"
+        else:
+            semitones = n
+
+        directions = {d for d in (m.group("verb"), m.group("d1"), m.group("d2")) if d}
+        up = directions & {"raise", "up", "higher", "above"}
+        down = directions & {"lower", "down", "below"}
+        sign = m.group("n")[0] if m.group("n") and m.group("n")[0] in "+-" else None
+        if up and down:
+            return None
+        if not up and not down:
+            # only an explicit sign ("transpose by -3 semitones") gives a direction without a word
+            if sign is None:
+                return None
+        elif sign is not None and sign != ("-" if down else "+"):
+            return None  # "up -3": the word and the sign disagree
+        else:
+            semitones = -abs(semitones) if down else abs(semitones)
+        return [[("transpose", {"semitones": semitones})]]
+
+    m = TRANSPOSE_TO_RE.fullmatch(clause)
+    if m:
+        current = (info().get("key") or "").split()
+        target = _pitch_class(m.group("tonic"))
+        if not current or target is None or _pitch_class(current[0].lower()) is None:
+            return None
+        diff = (target - _pitch_class(current[0].lower())) % 12
+        # the nearer direction; a tritone goes up
+        semitones = diff - 12 if diff > 6 else diff
+        return [[("transpose", {"semitones": semitones})]]
+    return None
+
+
+def _pitch_class(tonic):
+    if not tonic:
+        return None
+    tonic = tonic.replace(" sharp", "#").replace(" flat", "b")
+    pc = PITCH_CLASSES.get(tonic[0])
+    if pc is None:
+        return None
+    for acc in tonic[1:]:
+        pc += 1 if acc == "#" else -1 if acc in "b-" else 0
+    return pc % 12
+
+
+def _tempo(clause, info):
+    ratio = None
+    m = PERCENT_RE.fullmatch(clause)
+    if m:
+        faster = {"speed up", "faster", "quicker"}
+        slower = {"slow down", "slower"}
+        words = {w for w in (m.group("verb"), m.group("dir")) if w}
+        if not words or (words & faster and words & slower):
+            return None
+        pct = float(m.group("pct")) / 100
+        ratio = 1 + pct if words & faster else 1 - pct
+        if ratio <= 0:
+            return None
+    elif DOUBLE_RE.fullmatch(clause):
+        ratio = 2.0
+    elif HALF_RE.fullmatch(clause):
+        ratio = 0.5
+    else:
+        m = BPM_RE.fullmatch(clause)
+        if not m:
+            return None
+        bpm = float(m.group("bpm") or m.group("bpm2"))
+        current = info().get("tempo") or 120
+        if bpm <= 0:
+            return None
+        ratio = bpm / float(current)
+    # the same speed-up either as a new tempo mark or as shorter note values
+    return [
+        [("change_tempo", {"ratio": _ratio(ratio)})],
+        [("adjust_rhythm", {"scale": _ratio(1 / ratio)})],
+    ]
+
+
+def _dynamics(clause, info):
+    m = DYNAMICS_RE.fullmatch(clause)
+    if m:
+        sign = 1 if "loud" in m.group("dir") else -1
+        steps = _number(m.group("n")) or (2 if m.group("much") else 1)
+    else:
+        m = VOLUME_RE.fullmatch(clause)
+        if not m:
+            return None
+        sign = 1 if m.group("dir") in ("increase", "raise") else -1
+        steps = _number(m.group("n")) or 1
+    return [
+        [("modify_dynamics", {"dynamics_shift": sign * steps})],
+        [("modify_dynamics", {"dynamics_shift": sign * (steps + 1)})],
+    ]
+
+
+def _articulation(clause, info):
+    m = ARTICULATION_RE.fullmatch(clause)
+    if not m:
+        return None
+    style = "staccato" if m.group("style") == "staccato" else "accent"
+    return [[("add_articulation", {"style": style})]]
+
+
+def _mode(clause, info):
+    m = MODE_RE.fullmatch(clause)
+    if not m:
+        return None
+    mode = m.group("mode")
+    tonic = m.group("tonic")
+    current = (info().get("key") or "").split()
+    current_mode = current[-1].lower() if current else None
+    from_mode = current_mode if current_mode in ("major", "minor") else ("minor" if mode == "major" else "major")
+    to = f"{tonic.replace(' sharp', '#').replace(' flat', '-')} {mode}" if tonic else mode
+    return [[("change_mode", {"from": from_mode, "to": to})]]
+
+
+def _repeat(clause, info):
+    m = REPEAT_RE.fullmatch(clause)
+    if not m:
+        return None
+    if m.group("twice"):
+        times = 2 if m.group("twice") == "twice" else 3
+    else:
+        times = _number(m.group("n")) or 2
+    if times < 1:
+        return None
+    return [[("repeat_segment", {"times": times})]]
+
+
+def _chords(clause, info):
+    m = SEVENTH_RE.fullmatch(clause)
+    if m:
+        return [[("add_seventh_chords", {"chord_type": f"{m.group('type') or 'major'} seventh"})]]
+    m = CHORD_TONE_RE.fullmatch(clause)
+    if m:
+        tone = m.group("tone") or m.group("plural")[:-1]
+        return [[("add_chord_tone", {"interval": CHORD_TONES[tone]})]]
+    return None
+
+
+RULES = [_transpose, _tempo, _dynamics, _articulation, _mode, _repeat, _chords]
+
+
+def _extract_range(prompt):
+    """(prompt without its measure range, [start, end] or None); None for the prompt if it names several ranges"""
+    ranges = set()
+    for m in RANGE_RE.finditer(prompt):
+        start = int(m.group(1))
+        end = int(m.group(2)) if m.group(2) else start
+        ranges.add((min(start, end), max(start, end)))
+    if len(ranges) > 1:
+        return None, None
+    return RANGE_RE.sub(" ", prompt), (next(iter(ranges)) if ranges else None)
+
+
+def _clean(clause):
+    clause = FILLER_RE.sub(" ", clause)
+    return re.sub(r"\s+", " ", clause).strip(" .!")
+
+
+def parse_intent(prompt, info=lambda: {}):
+    """
+    Candidates (dicts in the LLM's format) for a mechanical instruction, or None if the prompt needs the model.
+    info() returns the score's global info ({"key": "C major", "tempo": 100, ...}); it is only called
+    by rules that need it.
+    """
+    text = re.sub(r"\s+", " ", prompt.lower()).strip()
+    text, measure_range = _extract_range(text)
+    if text is None:
+        return None
+
+    clauses = [_clean(c) for c in CLAUSE_SPLIT_RE.split(text)]
+    clauses = [c for c in clauses if c]
+    if not clauses:
+        return None
+
+    # per clause: its alternatives, each a list of (action, params)
+    parsed = []
+    for clause in clauses:
+        for rule in RULES:
+            alternatives = rule(clause, info)
+            if alternatives:
+                parsed.append(alternatives)
+                break
+        else:
+            return None
+
+    # v1 takes every clause's first reading; v2 swaps in the first clause that has a second one
+    plans = [[alt[0] for alt in parsed]]
+    for i, alternatives in enumerate(parsed):
+        if len(alternatives) > 1:
+            plans.append([alt[0] if j != i else alternatives[1] for j, alt in enumerate(parsed)])
+            break
+
+    target = {"measures": list(range(measure_range[0], measure_range[1] + 1))} if measure_range else {"measures": []}
+    candidates = []
+    for n, plan in enumerate(plans, start=1):
+        steps = [step for group in plan for step in group]
+        (action, params), rest = steps[0], steps[1:]
+        candidates.append({
+            "id": f"v{n}",
+            "target": dict(target),
+            "action": action,
+            "params": params,
+            "secondary_actions": [{"action": a, "params": p} for a, p in rest],
+            "error": None,
+        })
+    return candidates
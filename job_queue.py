@@ -0,0 +1,242 @@
+import glob
+import json
+import math
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+
+
+# -------------------------------
+# Background jobs
+# -------------------------------
+# POST /api/jobs puts a request on a bounded queue and returns at once; a fixed
+# set of worker threads takes jobs off it, so a burst of users waits in the
+# queue instead of piling up request threads. When the queue is full, submit
+# raises QueueFull with a Retry-After estimate. Finished jobs are kept for
+# JOB_TTL seconds so clients can poll for the result.
+#
+# A job runs in the process that accepted it. Processes that serve the same
+# clients (the pre-forked workers of serve.py) publish their jobs' state as
+# files in JOB_DIR, so a poll can be answered by any of them; one that doesn't
+# run the job waits for it by rereading the file every JOB_POLL_SECONDS.
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 8))
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", 32))
+JOB_TTL = float(os.environ.get("JOB_TTL", 600))
+JOB_DIR = os.environ.get("JOB_DIR") or None
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", 0.1))
+
+_JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"job queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class Job:
+    def __init__(self, payload):
+        self.id = uuid.uuid4().hex
+        self.payload = payload
+        self.status = "queued"  # queued -> running -> done | error
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.done = threading.Event()
+
+    def to_record(self):
+        """What another process needs to answer a poll for this job"""
+        return {"id": self.id, "status": self.status, "result": self.result, "error": self.error,
+                "created": self.created, "finished": self.finished}
+
+    @classmethod
+    def from_record(cls, record):
+        job = cls(None)
+        job.id, job.status, job.result, job.error = record["id"], record["status"], record["result"], record["error"]
+        job.created, job.finished = record["created"], record["finished"]
+        if job.finished is not None:
+            job.done.set()
+        return job
+
+    def to_dict(self):
+        body = {"id": self.id, "status": self.status}
+        if self.result is not None:
+            body.update(self.result)
+        if self.error is not None:
+            body["error"] = self.error
+        if self.finished is not None:
+            body["seconds"] = round(self.finished - self.created, 3)
+        return body
+
+
+class JobQueue:
+    """
+    Bounded FIFO of jobs served by a fixed number of worker threads.
+    handler(payload) -> (result dict, ok) runs each job; an exception marks the job as failed.
+    With a directory (or after share()) every job's state is also written there for other processes to read.
+    """
+
+    def __init__(self, handler, workers=JOB_WORKERS, max_queued=JOB_QUEUE_SIZE, ttl=JOB_TTL, directory=JOB_DIR):
+        self.handler = handler
+        self.workers = workers
+        self.ttl = ttl
+        self.directory = None
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._running = 0
+        self._avg_seconds = None  # moving average of job run time, for Retry-After
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        if directory is not None:
+            self.share(directory)
+
+    def share(self, directory):
+        """Publish every job's state in directory, and answer for the jobs other processes published there"""
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, job_id + ".json")
+
+    def _publish(self, job):
+        if self.directory is None:
+            return
+        path = self._path(job.id)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(job.to_record(), f)
+        os.replace(tmp, path)  # readers never see a half-written job
+
+    def _read(self, job_id):
+        """The job another process published, or None"""
+        if self.directory is None or not _JOB_ID.fullmatch(job_id):
+            return None
+        try:
+            with open(self._path(job_id), encoding="utf-8") as f:
+                return Job.from_record(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def _start(self):
+        # started on first use so a process that forks after import runs its own workers
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def retry_after(self):
+        """Seconds until a queue slot is likely to free up"""
+        with self._lock:
+            avg = self._avg_seconds or 1.0
+        return max(1, math.ceil(avg * (self._queue.qsize() + 1) / max(1, self.workers)))
+
+    def submit(self, payload):
+        self._start()
+        self._expire()
+        job = Job(payload)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._publish(job)  # before it is queued, so the file never overwrites a later state
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+                self.rejected += 1
+            self._remove(job.id)
+            raise QueueFull(self.retry_after())
+        return job
+
+    def get(self, job_id):
+        """The job, from this process or the shared directory, or None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job if job is not None else self._read(job_id)
+
+    def wait(self, job, timeout):
+        """Wait up to timeout seconds for job to finish; returns its latest state"""
+        with self._lock:
+            local = self._jobs.get(job.id) is job
+        if local or self.directory is None:
+            job.done.wait(timeout)
+            return job
+        deadline = time.monotonic() + timeout
+        while not job.done.is_set() and time.monotonic() < deadline:
+            time.sleep(min(JOB_POLL_SECONDS, max(0.0, deadline - time.monotonic())))
+            job = self._read(job.id) or job
+        return job
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                job.status = "running"
+                job.started = time.time()
+                self._running += 1
+            self._publish(job)
+            try:
+                result, ok = self.handler(job.payload)
+                job.result = result
+                job.status = "done" if ok else "error"
+            except Exception as e:
+                job.error = str(e)
+                job.status = "error"
+            with self._lock:
+                job.finished = time.time()
+                self._running -= 1
+                seconds = job.finished - job.started
+                self._avg_seconds = seconds if self._avg_seconds is None else 0.8 * self._avg_seconds + 0.2 * seconds
+                if job.status == "done":
+                    self.completed += 1
+                else:
+                    self.failed += 1
+            self._publish(job)
+            job.done.set()
+            self._queue.task_done()
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [i for i, j in self._jobs.items() if j.finished is not None and j.finished < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+        for job_id in expired:
+            self._remove(job_id)
+
+    def _remove(self, job_id):
+        if self.directory is not None:
+            try:
+                os.remove(self._path(job_id))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queued": self._queue.qsize(),
+                "max_queued": self._queue.maxsize,
+                "running": self._running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_seconds": round(self._avg_seconds, 3) if self._avg_seconds is not None else None,
+            }
+
+
+def clear_shared(directory):
+    """Remove the jobs a previous run left in a shared directory; the processes that ran them are gone"""
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        os.remove(path)
@@ -0,0 +1,199 @@
+import asyncio
+import os
+import random
+import threading
+import time
+
+import openai
+from openai import AsyncOpenAI, OpenAI
+
+try:
+    import httpx
+except ImportError:  # newer openai releases are built on httpx2
+    import httpx2 as httpx
+
+
+# -------------------------------
+# LLM client
+# -------------------------------
+# One long-lived OpenAI-compatible client per process instead of one per call:
+# the HTTP connection pool keeps connections to the backend alive between
+# requests, every call has a connect and a read timeout, and transient failures
+# (connection errors, timeouts, 429 and 5xx) are retried a bounded number of
+# times with jittered exponential backoff. The same object serves the Flask
+# handler (chat, stream_chat) and async code (achat, astream_chat).
+
+LLM_BASE_URL = os.environ.get("LLM_BASE_URL", "http://192.168.1.99:8000/v1")
+LLM_API_KEY = os.environ.get("LLM_API_KEY", "sk-local")
+LLM_MODEL = os.environ.get("LLM_MODEL", "llama3")
+LLM_CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", 5))
+LLM_READ_TIMEOUT = float(os.environ.get("LLM_READ_TIMEOUT", 120))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 2))
+LLM_BACKOFF = float(os.environ.get("LLM_BACKOFF", 0.5))
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", 32))
+
+RETRYABLE = (
+    openai.APIConnectionError,   # includes APITimeoutError
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+class LLMClient:
+    """Pooled sync/async client for one OpenAI-compatible chat backend"""
+
+    def __init__(self, base_url=None, api_key=None, model=None, connect_timeout=None, read_timeout=None,
+                 max_retries=None, backoff=None, max_connections=None):
+        self.base_url = base_url or LLM_BASE_URL
+        self.api_key = api_key or LLM_API_KEY
+        self.model = model or LLM_MODEL
+        self.connect_timeout = LLM_CONNECT_TIMEOUT if connect_timeout is None else connect_timeout
+        self.read_timeout = LLM_READ_TIMEOUT if read_timeout is None else read_timeout
+        self.max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = LLM_BACKOFF if backoff is None else backoff
+        self.max_connections = max_connections or LLM_MAX_CONNECTIONS
+        self._lock = threading.Lock()
+        self._sync = None
+        self._async = None
+
+    def _timeout(self):
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+
+    def _limits(self):
+        return httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+
+    @property
+    def sync_client(self):
+        # created on first use, so a process that forks before using it doesn't share sockets
+        if self._sync is None:
+            with self._lock:
+                if self._sync is None:
+                    self._sync = OpenAI(
+                        base_url=self.base_url, api_key=self.api_key, max_retries=0,
+                        http_client=httpx.Client(limits=self._limits(), timeout=self._timeout()),
+                    )
+        return self._sync
+
+    @property
+    def async_client(self):
+        # bound to the event loop that first uses it; an async server runs one loop
+        if self._async is None:
+            with self._lock:
+                if self._async is None:
+                    self._async = AsyncOpenAI(
+                        base_url=self.base_url, api_key=self.api_key, max_retries=0,
+                        http_client=httpx.AsyncClient(limits=self._limits(), timeout=self._timeout()),
+                    )
+        return self._async
+
+    def retry_delay(self, attempt):
+        """Full-jitter exponential backoff before retry number attempt (0-based)"""
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    def _request(self, messages, kwargs):
+        request = {"model": self.model, "messages": messages}
+        request.update(kwargs)
+        return request
+
+    def chat(self, messages, **kwargs):
+        """Send a chat completion and return the message content. Raises after the last retry fails."""
+        request = self._request(messages, kwargs)
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.sync_client.chat.completions.create(**request)
+                return response.choices[0].message.content
+            except RETRYABLE:
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self.retry_delay(attempt))
+
+    async def achat(self, messages, **kwargs):
+        """Async chat(); the connection pool is shared by every coroutine on the loop"""
+        request = self._request(messages, kwargs)
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self.async_client.chat.completions.create(**request)
+                return response.choices[0].message.content
+            except RETRYABLE:
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self.retry_delay(attempt))
+
+    def stream_chat(self, messages, **kwargs):
+        """
+        Yield a chat completion's content piece by piece as the backend generates it.
+        Only a call that fails before its first piece is retried; later failures are raised.
+        """
+        request = self._request(messages, kwargs)
+        request["stream"] = True
+        for attempt in range(self.max_retries + 1):
+            started = False
+            try:
+                stream = self.sync_client.chat.completions.create(**request)
+                try:
+                    for chunk in stream:
+                        piece = chunk.choices[0].delta.content if chunk.choices else None
+                        if piece:
+                            started = True
+                            yield piece
+                finally:
+                    stream.close()
+                return
+            except RETRYABLE:
+                if started or attempt == self.max_retries:
+                    raise
+                time.sleep(self.retry_delay(attempt))
+
+    async def astream_chat(self, messages, **kwargs):
+        """Async stream_chat()"""
+        request = self._request(messages, kwargs)
+        request["stream"] = True
+        for attempt in range(self.max_retries + 1):
+            started = False
+            try:
+                stream = await self.async_client.chat.completions.create(**request)
+                try:
+                    async for chunk in stream:
+                        piece = chunk.choices[0].delta.content if chunk.choices else None
+                        if piece:
+                            started = True
+                            yield piece
+                finally:
+                    await stream.close()
+                return
+            except RETRYABLE:
+                if started or attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self.retry_delay(attempt))
+
+    def close(self):
+        with self._lock:
+            if self._sync is not None:
+                self._sync.close()
+                self._sync = None
+
+    async def aclose(self):
+        if self._async is not None:
+            client, self._async = self._async, None
+            await client.close()
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_client():
+    """The process-wide client configured from the LLM_* environment variables"""
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = LLMClient()
+    return _default
+
+
+def set_default_client(client):
+    """Replace the process-wide client (e.g. with one pointed at a stub server)"""
+    global _default
+    with _default_lock:
+        _default = client
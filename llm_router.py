@@ -0,0 +1,337 @@
+import concurrent.futures
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import llm_client
+
+
+# -------------------------------
+# LLM router
+# -------------------------------
+# Spreads chat calls over several OpenAI-compatible Llama3 replicas. Each call
+# goes to the healthy backend with the fewest requests in flight (ties go to
+# the lower recent latency). A backend that fails LLM_BREAKER_FAILURES times in
+# a row is ejected (circuit open) for LLM_BREAKER_COOLDOWN seconds, then gets a
+# single trial request (half open) and only rejoins if that trial succeeds.
+# A failed call is retried on another backend. A non-streaming call still
+# running after the LLM_HEDGE_PERCENTILE latency of recent calls is also sent
+# to a second backend, and whichever answers first wins. A background thread
+# probes every backend's /models each LLM_HEALTH_INTERVAL seconds, so a replica
+# that goes down is ejected without waiting for user traffic; a probe never
+# closes a circuit, it can only move an ejected backend whose cooldown is over
+# to half open, where the trial request decides.
+#
+# The router has the same chat/stream_chat/close methods as LLMClient, so it
+# can be installed with llm_client.set_default_client.
+
+LLM_BASE_URLS = [u.strip() for u in os.environ.get("LLM_BASE_URLS", "").split(",") if u.strip()]
+LLM_BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", 3))
+LLM_BREAKER_COOLDOWN = float(os.environ.get("LLM_BREAKER_COOLDOWN", 10))
+LLM_HEDGE_PERCENTILE = float(os.environ.get("LLM_HEDGE_PERCENTILE", 95))  # 0 turns hedging off
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", 20))
+LLM_HEALTH_INTERVAL = float(os.environ.get("LLM_HEALTH_INTERVAL", 10))  # 0 turns health checks off
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class NoBackendAvailable(Exception):
+    """Every backend is ejected, or was already tried for this call"""
+
+
+class Backend:
+    """One replica: its client, load, recent latency and circuit-breaker state"""
+
+    def __init__(self, client):
+        self.client = client
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latencies = deque(maxlen=100)
+        self.ewma = None
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.trial_running = False
+
+    @property
+    def name(self):
+        return self.client.base_url
+
+    def stats(self) -> dict:
+        return {
+            "url": self.name,
+            "state": self.state,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ewma_ms": round(self.ewma * 1000, 1) if self.ewma is not None else None,
+        }
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+class LLMRouter:
+    """Least-outstanding-requests router over several LLMClient backends"""
+
+    def __init__(self, clients, max_retries=None, breaker_failures=LLM_BREAKER_FAILURES,
+                 breaker_cooldown=LLM_BREAKER_COOLDOWN, hedge_percentile=LLM_HEDGE_PERCENTILE,
+                 hedge_min_samples=LLM_HEDGE_MIN_SAMPLES, health_interval=LLM_HEALTH_INTERVAL):
+        self.backends = [Backend(c) for c in clients]
+        self.max_retries = llm_client.LLM_MAX_RETRIES if max_retries is None else max_retries
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.health_interval = health_interval
+        self.latencies = deque(maxlen=500)  # every backend's recent successful calls, for the hedge delay
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._health_thread = None
+        self._closed = threading.Event()
+
+    @classmethod
+    def from_urls(cls, base_urls, **kwargs):
+        # backends don't retry on their own; the router retries on a different replica
+        return cls([llm_client.LLMClient(base_url=url, max_retries=0) for url in base_urls], **kwargs)
+
+    # ---- backend selection and bookkeeping
+
+    def _available(self, b, now):
+        if b.state == CLOSED:
+            return True
+        if b.state == OPEN and now - b.opened_at >= self.breaker_cooldown:
+            b.state = HALF_OPEN
+        return b.state == HALF_OPEN and not b.trial_running
+
+    def _acquire(self, exclude=()):
+        """
+        (backend, trial) for the next call, counted as in flight; trial is True for the one call that tests a
+        half-open backend. Raises NoBackendAvailable.
+        """
+        self._start_health_checks()
+        with self._lock:
+            now = time.monotonic()
+            candidates = [b for b in self.backends if b not in exclude and self._available(b, now)]
+            if not candidates:
+                raise NoBackendAvailable("no LLM backend available")
+            best = min(candidates, key=lambda b: (b.outstanding, b.ewma or 0.0, random.random()))
+            trial = best.state == HALF_OPEN
+            if trial:
+                best.trial_running = True
+            best.outstanding += 1
+            best.requests += 1
+            return best, trial
+
+    def _release(self, b, trial=False, elapsed=None, error=False):
+        """
+        Finish a call. Only the trial call moves a half-open backend: back to open if it fails, closed if it
+        succeeds. Calls that started before the circuit opened don't count as the trial.
+        """
+        with self._lock:
+            b.outstanding -= 1
+            if trial:
+                b.trial_running = False
+            if error:
+                b.failures += 1
+                b.consecutive_failures += 1
+                if trial or (b.state == CLOSED and b.consecutive_failures >= self.breaker_failures):
+                    b.state = OPEN
+                    b.opened_at = time.monotonic()
+                return
+            b.consecutive_failures = 0
+            if trial:
+                b.state = CLOSED
+            if elapsed is not None:
+                b.latencies.append(elapsed)
+                b.ewma = elapsed if b.ewma is None else 0.8 * b.ewma + 0.2 * elapsed
+                self.latencies.append(elapsed)
+
+    def _call(self, b, trial, messages, kwargs):
+        t0 = time.perf_counter()
+        try:
+            content = b.client.chat(messages, **kwargs)
+        except llm_client.RETRYABLE:
+            self._release(b, trial, error=True)
+            raise
+        except Exception:
+            self._release(b, trial)  # the request was at fault, not the backend
+            raise
+        self._release(b, trial, time.perf_counter() - t0)
+        return content
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging a call, or None when hedging is off or there is too little history"""
+        if self.hedge_percentile <= 0 or len(self.backends) < 2:
+            return None
+        with self._lock:
+            if len(self.latencies) < self.hedge_min_samples:
+                return None
+            return percentile(self.latencies, self.hedge_percentile)
+
+    # ---- public API (same as LLMClient)
+
+    def chat(self, messages, **kwargs):
+        """Send a chat completion to the best backend, hedging and failing over as configured"""
+        tried = []
+        for attempt in range(self.max_retries + 1):
+            try:
+                b, trial = self._acquire(exclude=tried)
+            except NoBackendAvailable:
+                if not tried:
+                    raise
+                tried = []  # every replica failed once; start over on whichever are still healthy
+                b, trial = self._acquire()
+            tried.append(b)
+            delay = self.hedge_delay()
+            try:
+                if delay is None:
+                    return self._call(b, trial, messages, kwargs)
+                return self._hedged(b, trial, delay, tried, messages, kwargs)
+            except llm_client.RETRYABLE:
+                if attempt == self.max_retries:
+                    raise
+
+    def _hedged(self, primary, trial, delay, tried, messages, kwargs):
+        executor = self._get_executor()
+        futures = [executor.submit(self._call, primary, trial, messages, kwargs)]
+        done, _ = concurrent.futures.wait(futures, timeout=delay)
+        if not done:
+            try:
+                second, second_trial = self._acquire(exclude=tried)
+            except NoBackendAvailable:
+                second = None
+            if second is not None:
+                tried.append(second)
+                with self._lock:
+                    self.hedges += 1
+                futures.append(executor.submit(self._call, second, second_trial, messages, kwargs))
+
+        error = None
+        pending = set(futures)
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is None:
+                    if len(futures) > 1 and f is futures[1]:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    # the slower call finishes in the background and is only counted in the stats
+                    return f.result()
+                error = f.exception()
+        raise error
+
+    def stream_chat(self, messages, **kwargs):
+        """
+        Stream from the best backend. A call that fails before its first piece moves to another backend;
+        streams aren't hedged, since the first piece already tells the user the model is working.
+        """
+        tried = []
+        for attempt in range(self.max_retries + 1):
+            try:
+                b, trial = self._acquire(exclude=tried)
+            except NoBackendAvailable:
+                if not tried:
+                    raise
+                tried = []
+                b, trial = self._acquire()
+            tried.append(b)
+            started = False
+            t0 = time.perf_counter()
+            try:
+                for piece in b.client.stream_chat(messages, **kwargs):
+                    started = True
+                    yield piece
+            except llm_client.RETRYABLE:
+                self._release(b, trial, error=True)
+                if started or attempt == self.max_retries:
+                    raise
+                continue
+            except BaseException:
+                # includes GeneratorExit when the reader stops early
+                self._release(b, trial)
+                raise
+            self._release(b, trial, time.perf_counter() - t0)
+            return
+
+    # ---- health checks
+
+    def check_health(self):
+        """
+        Probe every backend's /models. A failing probe counts as a failure (and sends an ejected backend back
+        to the start of its cooldown); a passing one resets a closed backend's failure count and moves an open one whose cooldown is
+        over to half open. Only a trial call closes the circuit again.
+        """
+        for b in self.backends:
+            try:
+                b.client.sync_client.with_options(timeout=b.client.connect_timeout).models.list()
+            except Exception:
+                with self._lock:
+                    b.consecutive_failures += 1
+                    # an ejected backend that still fails its probe starts its cooldown over
+                    if ((b.state == CLOSED and b.consecutive_failures >= self.breaker_failures)
+                            or b.state == OPEN or (b.state == HALF_OPEN and not b.trial_running)):
+                        b.state = OPEN
+                        b.opened_at = time.monotonic()
+                continue
+            with self._lock:
+                if b.state == CLOSED:
+                    b.consecutive_failures = 0
+                else:
+                    self._available(b, time.monotonic())
+
+    def _health_loop(self):
+        while not self._closed.wait(self.health_interval):
+            self.check_health()
+
+    def _start_health_checks(self):
+        if self.health_interval <= 0 or self._health_thread is not None:
+            return
+        with self._lock:
+            if self._health_thread is None:
+                self._health_thread = threading.Thread(target=self._health_loop, name="llm-health", daemon=True)
+                self._health_thread.start()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=2 * llm_client.LLM_MAX_CONNECTIONS, thread_name_prefix="llm-hedge"
+                )
+            return self._executor
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backends": [b.stats() for b in self.backends],
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "hedge_delay_ms": (round(percentile(self.latencies, self.hedge_percentile) * 1000, 1)
+                                   if self.hedge_percentile > 0 and len(self.latencies) >= self.hedge_min_samples
+                                   else None),
+            }
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+        for b in self.backends:
+            b.client.close()
+
+
+def router_from_env():
+    """An LLMRouter over LLM_BASE_URLS, or None when fewer than two backends are configured"""
+    if len(LLM_BASE_URLS) < 2:
+        return None
+    return LLMRouter.from_urls(LLM_BASE_URLS)
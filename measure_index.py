@@ -0,0 +1,172 @@
+import copy
+
+from music21 import key, stream, tempo
+
+
+# -------------------------------
+# Measure index and target-scoped editing
+# -------------------------------
+# An action only needs to see the measures a candidate targets. MeasureIndex
+# looks measures up by number once per score, view() wraps the targeted range
+# in a small Score (sharing, not copying, the Measure objects) for the actions
+# to work on, and splice() puts the edited range back into the full score.
+# A tempo or key change made inside the range would carry on past it, so
+# context_after() notes the tempo and key in force right after the range before
+# the edit, and restore_context() puts them back there afterwards.
+
+# the scope of a target that names measures, none of which are in the score
+NO_MEASURES = ()
+
+
+def resolve_scope(numbers, measure_numbers):
+    """
+    Turn a candidate's target.measures into an inclusive (start, end) range of the existing measure
+    numbers (sorted). Returns None when the target covers the whole score (or names no measures), and
+    NO_MEASURES when it names measures none of which exist: that edit has nothing to change.
+    """
+    wanted = sorted({int(n) for n in measure_numbers or [] if str(n).lstrip("-").isdigit()})
+    if not wanted:
+        return None
+    present = [n for n in numbers if wanted[0] <= n <= wanted[-1]]
+    if not present:
+        return NO_MEASURES
+    if present[0] == numbers[0] and present[-1] == numbers[-1]:
+        return None
+    return present[0], present[-1]
+
+
+def _bpm(mark):
+    # marks read from a bare <sound tempo> are playback-only and carry numberSounding instead
+    return (mark.number or mark.numberSounding) if mark is not None else None
+
+
+def _sharps(signature):
+    return signature.sharps if signature is not None else None
+
+
+class MeasureIndex:
+    """Per-part lookup of Measure objects by measure number, built once per score"""
+
+    def __init__(self, score):
+        self.score = score
+        self._build()
+
+    def _build(self):
+        score = self.score
+        self.parts = list(score.parts)
+        # part position -> measure number -> [Measure] (numbers can repeat, e.g. "12a")
+        self.by_number = []
+        numbers = set()
+        for part in self.parts:
+            lookup = {}
+            for m in part.getElementsByClass(stream.Measure):
+                lookup.setdefault(m.number, []).append(m)
+            self.by_number.append(lookup)
+            numbers.update(lookup)
+        self.numbers = sorted(numbers)
+
+    def measures(self, part_idx, start, end):
+        """Measures of one part numbered start..end inclusive, in score order"""
+        lookup = self.by_number[part_idx]
+        found = []
+        for n in range(start, end + 1):
+            found.extend(lookup.get(n, []))
+        return found
+
+    def scope(self, measure_numbers):
+        """The (start, end) range of this score a candidate's target.measures asks for, or None"""
+        return resolve_scope(self.numbers, measure_numbers)
+
+    def view(self, start, end):
+        """
+        A Score holding only measures start..end of every part. The Measure objects are shared with the
+        full score, so in-place edits need no copying back.
+        """
+        view = stream.Score()
+        for part_idx, part in enumerate(self.parts):
+            view_part = stream.Part(id=part.id)
+            measures = self.measures(part_idx, start, end)
+            if measures:
+                first_offset = measures[0].getOffsetBySite(part)
+                for m in measures:
+                    view_part.insert(m.getOffsetBySite(part) - first_offset, m)
+            view.insert(0, view_part)
+        return view
+
+    def context_after(self, end):
+        """
+        [(measure, tempo mark, key signature)]: the first measure after measure `end` of every part that has
+        one, with the tempo and key in force at its start. The tempo is the score's (it is usually marked in
+        one part only).
+        """
+        found = []
+        for part_idx, lookup in enumerate(self.by_number):
+            later = [n for n in lookup if n is not None and n > end]
+            if later:
+                m = lookup[min(later)][0]
+                own = m.getElementsByOffset(0).getElementsByClass(tempo.MetronomeMark).first()
+                found.append((m, own or m.getContextByClass(tempo.MetronomeMark),
+                              m.keySignature or m.getContextByClass(key.KeySignature)))
+        mark = next((t for _, t, _ in found if t is not None), None)
+        return [(m, mark, signature) for m, _, signature in found]
+
+    def restore_context(self, context):
+        """
+        After an edit to the measures before them, put back the tempo and key each measure of context_after()
+        started with, where the edit changed them. The measures are tracked as objects, so this works after a
+        splice() that renumbered them.
+        """
+        for m, mark, signature in context:
+            now = m.getElementsByOffset(0).getElementsByClass(tempo.MetronomeMark).first()
+            if mark is not None and _bpm(now or m.getContextByClass(tempo.MetronomeMark)) != _bpm(mark):
+                m.insert(0, copy.deepcopy(mark))
+            now = m.keySignature or m.getContextByClass(key.KeySignature)
+            if signature is not None and (_sharps(now) != _sharps(signature) or
+                                          getattr(now, "mode", None) != getattr(signature, "mode", None)):
+                m.keySignature = copy.deepcopy(signature)
+
+    def splice(self, view, start, end):
+        """
+        Put the measures of an edited view back into the full score. Measures the actions edited in place
+        are already there; measures that were replaced (or added, e.g. by repeat_segment) take the place
+        of the old range and the following measures move and renumber to make room.
+        """
+        changed = False
+        for part_idx, (part, view_part) in enumerate(zip(self.parts, view.parts)):
+            old = self.measures(part_idx, start, end)
+            new = list(view_part.getElementsByClass(stream.Measure))
+            if not old:
+                continue
+            if len(new) == len(old) and all(a is b for a, b in zip(old, new)):
+                for m in old:
+                    m.activeSite = part
+                continue
+
+            changed = True
+            offsets = [m.getOffsetBySite(part) for m in old]
+            range_start = offsets[0]
+            range_end = offsets[-1] + old[-1].duration.quarterLength
+            for m in old:
+                part.remove(m)
+
+            if len(new) == len(old):
+                for m, offset, old_m in zip(new, offsets, old):
+                    m.number = old_m.number
+                    part.insert(offset, m)
+            else:
+                new_length = sum(m.duration.quarterLength for m in new)
+                shift = new_length - (range_end - range_start)
+                later = [m for m in part.getElementsByClass(stream.Measure)
+                         if m.getOffsetBySite(part) >= range_end]
+                if shift:
+                    part.shiftElements(shift, startOffset=range_end)
+                offset = range_start
+                for i, m in enumerate(new):
+                    m.number = old[0].number + i
+                    part.insert(offset, m)
+                    offset += m.duration.quarterLength
+                for m in later:
+                    m.number += len(new) - len(old)
+
+        if changed:
+            self._build()
@@ -0,0 +1,294 @@
+import bisect
+import contextlib
+import contextvars
+import glob
+import json
+import os
+import threading
+import time
+
+
+# -------------------------------
+# Metrics and timing spans
+# -------------------------------
+# Counters and histograms rendered in the Prometheus text format for /metrics,
+# without a client library. span("parse") times a block of work: the time goes
+# into the stage histogram and, if a trace is active for the current request,
+# into that request's list of spans, which the server can return as a
+# Server-Timing header. Candidate workers in other processes collect their spans
+# with collect() and hand them back to the request process with replay().
+#
+# Counts live in the process that made them. Under serve.py's pre-forked
+# workers a scrape of /metrics reaches one worker at random, so the workers
+# share their counts through a directory: each one writes its own file there
+# (at most METRICS_FLUSH_SECONDS old) and /metrics, whichever worker answers
+# it, renders the sum of every file, the files of workers that have exited
+# included, so counters never go down.
+
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", 1))
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _labels_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self, others=()):
+        """The text format lines; others are snapshot()s of the same counter in other processes, added in"""
+        with self._lock:
+            values = dict(self._values)
+        for snapshot in others:
+            for key, value in snapshot:
+                key = tuple(key)
+                values[key] = values.get(key, 0) + value
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels_text(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), list(series)] for key, series in self._series.items()]
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self, others=()):
+        """The text format lines; others are snapshot()s of the same histogram in other processes, added in"""
+        with self._lock:
+            merged = {key: list(series) for key, series in self._series.items()}
+        for snapshot in others:
+            for key, series in snapshot:
+                key = tuple(key)
+                if len(series) != len(self.buckets) + 2:
+                    continue  # written with other buckets
+                mine = merged.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+                merged[key] = [a + b for a, b in zip(mine, series)]
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(merged.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = _labels_text(self.labelnames, key, [("le", _number(bound))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels_text(self.labelnames, key, [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels_text(self.labelnames, key)} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{_labels_text(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.directory = None  # where processes share their counts, once share() is called
+        self._path = None
+        self._flusher = None
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def reset(self):
+        """Forget every count, e.g. in a forked worker, so the parent's warm-up isn't counted once per worker"""
+        for metric in self.metrics:
+            metric.reset()
+
+    def share(self, directory, interval=METRICS_FLUSH_SECONDS):
+        """Write this process's counts to directory every interval seconds and add the other processes' to render()"""
+        self.directory = directory
+        # pid and start time: a later process that gets the same pid must not overwrite an exited one's counts
+        self._path = os.path.join(directory, f"{os.getpid()}-{time.time_ns()}.json")
+        self.flush()
+        self._flusher = threading.Thread(target=self._flush_loop, args=(interval,), name="metrics-flush", daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def flush(self):
+        """Write this process's counts to its file in the shared directory"""
+        if self._path is None:
+            return
+        snapshot = {metric.name: metric.snapshot() for metric in self.metrics}
+        tmp = self._path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, self._path)  # readers never see a half-written file
+
+    def _shared(self):
+        """The snapshots the other processes sharing the directory wrote"""
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            if path == self._path:
+                continue
+            try:
+                with open(path, encoding="utf-8") as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self) -> str:
+        shared = self._shared() if self.directory else []
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render([s[metric.name] for s in shared if metric.name in s]))
+        return "\n".join(lines) + "\n"
+
+
+def clear_shared(directory):
+    """Remove the counts a previous run left in a shared directory"""
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        os.remove(path)
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "llama3_stage_seconds", "Time spent in each stage of a request", ["stage"])
+ACTION_SECONDS = REGISTRY.histogram(
+    "llama3_action_seconds", "Time spent applying each action (or fused pass of actions) of a plan", ["action"])
+REQUEST_SECONDS = REGISTRY.histogram(
+    "llama3_request_seconds", "Time from request to response, per endpoint and status", ["endpoint", "status"])
+RESPONSE_BYTES = REGISTRY.histogram(
+    "llama3_response_bytes", "Size of response bodies as sent, after compression (streams are not counted)", ["endpoint"], SIZE_BUCKETS)
+PROMPT_TOKENS = REGISTRY.histogram(
+    "llama3_prompt_tokens", "Estimated tokens (characters / 4) of each prompt sent to the LLM", [],
+    (256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072))
+PROMPT_CHARS_TOTAL = REGISTRY.counter(
+    "llama3_prompt_chars_total", "Characters of prompt sent to the LLM")
+LLM_RESPONSE_CHARS_TOTAL = REGISTRY.counter(
+    "llama3_llm_response_chars_total", "Characters of completion received from the LLM")
+LLM_CALLS_TOTAL = REGISTRY.counter(
+    "llama3_llm_calls_total", "LLM calls, by outcome", ["outcome"])
+
+
+_trace = contextvars.ContextVar("llama3_trace", default=None)
+
+
+def start_trace():
+    """Begin collecting the spans of the current request (in this thread / context); returns the list"""
+    spans = []
+    _trace.set(spans)
+    return spans
+
+
+def _record(kind, name, seconds):
+    if kind == "action":
+        ACTION_SECONDS.observe(seconds, action=name)
+    else:
+        STAGE_SECONDS.observe(seconds, stage=name)
+    spans = _trace.get()
+    if spans is not None:
+        spans.append((kind, name, seconds))
+
+
+@contextlib.contextmanager
+def span(stage):
+    """Time the enclosed block as one stage of the current request"""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record("stage", stage, time.perf_counter() - t0)
+
+
+def record_stage(stage, seconds):
+    """A stage timed elsewhere"""
+    _record("stage", stage, seconds)
+
+
+def record_action(label, seconds):
+    _record("action", label, seconds)
+
+
+@contextlib.contextmanager
+def collect():
+    """Collect the enclosed block's spans into a fresh list, e.g. in a worker process, to replay() elsewhere"""
+    token = _trace.set([])
+    try:
+        yield _trace.get()
+    finally:
+        _trace.reset(token)
+
+
+def replay(spans):
+    """Record spans collected in another process as if they had happened here"""
+    for kind, name, seconds in spans or ():
+        _record(kind, name, seconds)
+
+
+def server_timing(spans):
+    """A Server-Timing header value for a request's spans (milliseconds, in the order they happened)"""
+    entries = []
+    for kind, name, seconds in spans:
+        if kind == "action":
+            entries.append(f'action;desc="{name}";dur={seconds * 1000:.1f}')
+        else:
+            entries.append(f"{name};dur={seconds * 1000:.1f}")
+    return ", ".join(entries)
@@ -0,0 +1,22 @@
+from music21 import converter
+from music21.musicxml.m21ToXml import GeneralObjectExporter
+
+
+# -------------------------------
+# In-memory MusicXML parse / serialize
+# -------------------------------
+# Everything goes through memory buffers; nothing here touches the filesystem.
+
+def parse_musicxml_string(xml_str: str):
+    """Parse a MusicXML string into a music21 score"""
+    return converter.parseData(xml_str, format="musicxml")
+
+
+def score_to_musicxml_bytes(score) -> bytes:
+    """Serialize a music21 stream to MusicXML bytes, the same output as stream.write('musicxml')"""
+    return GeneralObjectExporter(score).parse()
+
+
+def score_to_musicxml(score) -> str:
+    """Serialize a music21 stream to a MusicXML string"""
+    return score_to_musicxml_bytes(score).decode("utf-8")
@@ -0,0 +1,209 @@
+import copy
+
+try:
+    import numpy as np
+except ImportError:  # the note-table engine is optional; the music21 actions work without it
+    np = None
+
+from music21 import chord, dynamics, interval, key, note, stream
+
+
+# -------------------------------
+# NumPy note-table engine
+# -------------------------------
+# Lowers a score to columnar arrays (one row per note/chord/rest and one row
+# per sounding pitch) so the pitch, duration and dynamics actions become array
+# operations. Transposition is computed once per distinct spelling/key
+# signature instead of once per note and written back with the same setters
+# Pitch.transpose uses, so the MusicXML that comes out is identical to the
+# per-note music21 path.
+
+DYNAMIC_LEVELS = ['pp', 'p', 'mp', 'mf', 'f', 'ff']
+
+
+def available():
+    return np is not None
+
+
+def _spelling(p):
+    """Everything about a pitch that decides how it transposes, or None if it needs the slow path"""
+    if p.fundamental is not None:
+        return None
+    acc = p.accidental
+    cents = p._microtone.cents if p._microtone is not None else None
+    return (p.step, acc.name if acc is not None else None, cents, p.octave, p.spellingIsInferred)
+
+
+class NoteTable:
+    """
+    Columnar view of every part of a score.
+
+    Element columns (one row per note, chord or rest): part, measure, voice, onset, quarter_length.
+    Pitch columns (one row per pitch, so a chord has several): midi, element, in_chord, spelling, key_sig;
+    left empty with with_pitches=False when only durations are needed.
+    """
+
+    def __init__(self, score, with_pitches=True):
+        self.elements = []
+        self.pitches = []
+        self.slow_notes = []          # notes/chords the table can't represent; handled per note
+        self.spellings = []           # spelling code -> representative Pitch
+        self.key_signatures = [None]  # key_sig code -> KeySignature context (code 0 = none)
+
+        part_col, measure_col, voice_col, onset_col, ql_col = [], [], [], [], []
+        midi_col, element_col, in_chord_col, spelling_col, ks_col = [], [], [], [], []
+        spelling_codes = {}
+        ks_codes = {None: 0}
+
+        for part_idx, part in enumerate(score.parts):
+            it = part.recurse()
+            measure_number = 0
+            # the key signature in force, tracked as we walk the part; None until the first note asks
+            current_ks = None
+            ks_known = False
+            for el in it:
+                if isinstance(el, stream.Measure):
+                    measure_number = el.number
+                    # a key at the start of the measure applies even to voices listed before it
+                    opening = [ks for ks in el.getElementsByClass(key.KeySignature) if ks.offset == 0]
+                    if opening:
+                        current_ks, ks_known = opening[-1], True
+                    continue
+                if isinstance(el, key.KeySignature):
+                    current_ks, ks_known = el, True
+                    continue
+                if not isinstance(el, note.GeneralNote):
+                    continue
+
+                element_idx = len(self.elements)
+                self.elements.append(el)
+                part_col.append(part_idx)
+                measure_col.append(measure_number)
+                site = el.activeSite
+                voice_col.append(int(site.id) if isinstance(site, stream.Voice) and str(site.id).isdigit() else 0)
+                onset_col.append(float(it.currentHierarchyOffset()))
+                ql_col.append(float(el.quarterLength))
+
+                if not with_pitches:
+                    continue
+                if isinstance(el, note.Note):
+                    members, in_chord = [el], False
+                elif isinstance(el, chord.Chord):
+                    members, in_chord = list(el.notes), True
+                else:
+                    continue
+                codes = [_spelling(n.pitch) for n in members]
+                if None in codes:
+                    self.slow_notes.append(el)
+                    continue
+
+                ks_code = 0
+                if not in_chord:
+                    # Note.transpose checks the key signature in force. Only the first note of a part pays
+                    # for a context search (the key may sit outside a scoped view); after that it's tracked.
+                    if not ks_known:
+                        current_ks, ks_known = el.getContextByClass(key.KeySignature), True
+                    ks = current_ks
+                    if ks is not None:
+                        ks_code = ks_codes.get(id(ks))
+                        if ks_code is None:
+                            ks_code = ks_codes[id(ks)] = len(self.key_signatures)
+                            self.key_signatures.append(ks)
+
+                for n, code_key in zip(members, codes):
+                    code = spelling_codes.get(code_key)
+                    if code is None:
+                        code = spelling_codes[code_key] = len(self.spellings)
+                        self.spellings.append(copy.deepcopy(n.pitch))
+                    self.pitches.append(n.pitch)
+                    midi_col.append(n.pitch.midi)
+                    element_col.append(element_idx)
+                    in_chord_col.append(in_chord)
+                    spelling_col.append(code)
+                    ks_col.append(ks_code)
+
+        self.part = np.array(part_col, dtype=np.int16)
+        self.measure = np.array(measure_col, dtype=np.int32)
+        self.voice = np.array(voice_col, dtype=np.int16)
+        self.onset = np.array(onset_col, dtype=np.float64)
+        self.quarter_length = np.array(ql_col, dtype=np.float64)
+
+        self.midi = np.array(midi_col, dtype=np.int16)
+        self.element = np.array(element_col, dtype=np.int64)
+        self.in_chord = np.array(in_chord_col, dtype=bool)
+        self.spelling = np.array(spelling_col, dtype=np.int64)
+        self.key_sig = np.array(ks_col, dtype=np.int64)
+
+    def transpose(self, semitones):
+        """Transpose every Note and Chord by semitones, exactly as n.transpose(semitones, inPlace=True) would"""
+        interval_obj = interval.Interval(semitones)
+
+        # Chord members are transposed with the Interval object (no key check), single notes with the int
+        # (key check), so the key signature code only matters for notes outside chords.
+        n_ks = len(self.key_signatures)
+        combo = self.spelling * (n_ks + 1) + np.where(self.in_chord, n_ks, self.key_sig)
+        uniques, inverse = np.unique(combo, return_inverse=True)
+
+        results = []
+        for c in uniques.tolist():
+            spelling_code, ks_slot = divmod(c, n_ks + 1)
+            p = copy.deepcopy(self.spellings[spelling_code])
+            p.transpose(interval_obj, inPlace=True)
+            ks = self.key_signatures[ks_slot] if ks_slot < n_ks else None
+            if p.accidental is not None and ks is not None:
+                for altered in ks.alteredPitches:
+                    if p.pitchClass == altered.pitchClass and p.accidental.alter != altered.accidental.alter:
+                        p.getEnharmonic(inPlace=True)
+            results.append(p)
+
+        for p, r in zip(self.pitches, (results[i] for i in inverse.tolist())):
+            p.name = r.name
+            if p.octave is not None:
+                p.octave = r.octave
+            p.accidental = copy.deepcopy(r.accidental)
+            p.fundamental = r.fundamental
+            p.spellingIsInferred = r.spellingIsInferred
+            if r._microtone is not None:
+                p._microtone = copy.deepcopy(r._microtone)
+        self.midi = self.midi + semitones
+
+        for n in self.slow_notes:
+            n.transpose(semitones, inPlace=True)
+
+    def scale_durations(self, scale):
+        """Multiply the quarterLength of every note, chord and rest by scale"""
+        self.quarter_length = self.quarter_length * scale
+        for el, ql in zip(self.elements, self.quarter_length.tolist()):
+            el.quarterLength = ql
+
+
+def transpose(score, semitones):
+    NoteTable(score).transpose(semitones)
+
+
+def scale_rhythm(score, scale):
+    NoteTable(score, with_pitches=False).scale_durations(scale)
+
+
+def shift_dynamics(score, change):
+    """Replace each measure's dynamics with its first dynamic (or mf) moved change steps along DYNAMIC_LEVELS"""
+    measures = []
+    found = []
+    base = []
+    for part in score.parts:
+        for m in part.getElementsByClass(stream.Measure):
+            dyns = list(m.recurse().getElementsByClass(dynamics.Dynamic))
+            measures.append(m)
+            found.append(dyns)
+            value = dyns[0].value if dyns else 'mf'
+            base.append(DYNAMIC_LEVELS.index(value) if value in DYNAMIC_LEVELS else -1)
+
+    base = np.array(base, dtype=np.int64)
+    shifted = np.clip(base + change, 0, len(DYNAMIC_LEVELS) - 1)
+    # unknown dynamics fall back to mf
+    levels = np.where(base < 0, DYNAMIC_LEVELS.index('mf'), shifted)
+
+    for m, dyns, level in zip(measures, found, levels.tolist()):
+        for d in dyns:
+            d.activeSite.remove(d)
+        m.insert(0, dynamics.Dynamic(DYNAMIC_LEVELS[level]))
@@ -0,0 +1,127 @@
+import time
+
+from music21 import stream
+
+
+# -------------------------------
+# Plan compiler
+# -------------------------------
+# A candidate is a main action plus secondary actions, and each action used to
+# walk every note with its own score.recurse(). The compiler groups the per-note
+# actions into fused passes (one walk applying every op to each note in plan
+# order) and runs the actions that can't be fused after the pass.
+#
+# Reordering is only done where it can't change the result:
+# - change_tempo, modify_dynamics and repeat_segment don't look at pitches or
+#   durations, so they are deferred past later per-note ops (except that a
+#   key inserted by change_mode after repeat_segment lands only once);
+# - add_chord_tone / add_seventh_chords turn notes into chords, which
+#   transpose and take articulations differently, so they keep their place;
+# - change_mode closes the pass it is in, since the key it inserts changes the
+#   key-signature context later transpositions respell against. When it has to
+#   analyze the key itself, the ops before it are flushed first so the
+#   analysis sees their result.
+
+FUSABLE = {"transpose", "adjust_rhythm", "add_articulation", "change_mode"}
+
+DEFERRABLE = {"change_tempo", "modify_dynamics", "repeat_segment"}
+
+# (deferred action, later fusable action) pairs that must still run in plan order
+_ORDERED = {("repeat_segment", "change_mode")}
+
+# ops that change what key analysis would see
+_ANALYSIS_INPUTS = {"transpose", "adjust_rhythm", "change_mode"}
+
+
+def _needs_analysis(action, params):
+    return action == "change_mode" and " " not in str(params.get("to", "major"))
+
+
+class Stage:
+    def __init__(self, kind, items):
+        self.kind = kind      # "fused" or "action"
+        self.items = items    # [(action, params)]
+
+    @property
+    def label(self):
+        names = "+".join(action for action, _ in self.items)
+        return f"fused[{names}]" if self.kind == "fused" else names
+
+
+class CompiledPlan:
+    """Stages to run for one candidate, plus the per-stage timings of the last run"""
+
+    def __init__(self, stages, compile_seconds=0.0):
+        self.stages = stages
+        self.timings = [("compile", compile_seconds)]
+
+    def run(self, score, note_ops, actions):
+        """
+        Run the plan on score. note_ops[action](score, params) -> (op, after) gives the per-note op (or None)
+        and a callable to run once the pass is done (or None); actions is the ordinary ACTIONS table.
+        Returns the resulting score (repeat_segment returns a new one).
+        """
+        for stage in self.stages:
+            t0 = time.perf_counter()
+            if stage.kind == "fused":
+                run_fused(score, [note_ops[action](score, params) for action, params in stage.items])
+            else:
+                action, params = stage.items[0]
+                result = actions[action](score, params)
+                if isinstance(result, stream.Score):
+                    score = result
+            self.timings.append((stage.label, time.perf_counter() - t0))
+        return score
+
+    def describe_timings(self):
+        return ", ".join(f"{label}={seconds * 1000:.1f}ms" for label, seconds in self.timings)
+
+
+def compile_plan(actions, known_actions):
+    """Compile (action, params) pairs into a CompiledPlan; unknown actions are dropped like before"""
+    t0 = time.perf_counter()
+    stages = []
+    current = []
+    deferred = []
+
+    def close_pass():
+        if current:
+            stages.append(Stage("fused", list(current)))
+            current.clear()
+
+    def flush():
+        close_pass()
+        stages.extend(deferred)
+        deferred.clear()
+
+    for action, params in actions:
+        if action not in known_actions:
+            continue
+        if action in FUSABLE:
+            if any((d.items[0][0], action) in _ORDERED for d in deferred):
+                flush()
+            if _needs_analysis(action, params) and any(a in _ANALYSIS_INPUTS for a, _ in current):
+                close_pass()
+            current.append((action, params))
+            if action == "change_mode":
+                close_pass()
+        elif action in DEFERRABLE:
+            deferred.append(Stage("action", [(action, params)]))
+        else:
+            flush()
+            stages.append(Stage("action", [(action, params)]))
+    flush()
+
+    return CompiledPlan(stages, time.perf_counter() - t0)
+
+
+def run_fused(score, op_pairs):
+    """One walk over every note, chord and rest applying each op in order, then each op's after-step"""
+    ops = [op for op, _ in op_pairs if op is not None]
+    if ops:
+        for n in score.recurse().notesAndRests:
+            for op in ops:
+                op(n)
+    for _, after in op_pairs:
+        if after is not None:
+            after()
@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+# -------------------------------
+# Result caches
+# -------------------------------
+# Two string caches sit in front of the expensive steps of a request:
+#   plan cache:   (cache version, engine flags, score hash, option number, canonical plan JSON) -> MusicXML
+#   prompt cache: (cache version, score hash, normalized prompt, section layout) -> the LLM's candidates JSON
+# Each is an LRU bounded by bytes in memory, optionally backed by a sqlite file
+# (RESULT_CACHE_DB) so results survive a restart. The sqlite tier is only read
+# on a memory miss and is bounded by entry count.
+
+RESULT_CACHE_MAX_MB = int(os.environ.get("RESULT_CACHE_MAX_MB", 64))
+PROMPT_CACHE_MAX_MB = int(os.environ.get("PROMPT_CACHE_MAX_MB", 8))
+RESULT_CACHE_DB = os.environ.get("RESULT_CACHE_DB") or None
+RESULT_CACHE_DISK_ENTRIES = int(os.environ.get("RESULT_CACHE_DISK_ENTRIES", 10000))
+
+# part of every plan key: bump it when an action's output changes, so the sqlite tier stops serving
+# MusicXML the old implementation made
+PLAN_CACHE_VERSION = 2
+# likewise part of every prompt key: bump it when what a key covers changes (version 2 added the sections)
+PROMPT_CACHE_VERSION = 2
+
+
+def canonical_plan(plan):
+    """
+    The parts of a candidate that decide its output, as stable JSON: action, params, secondary actions
+    and target measures (of each section, for a sectioned plan). Ids, explanations and key order don't matter.
+    """
+    def action_of(a):
+        return {"action": str(a.get("action", "")).replace(" ", ""), "params": a.get("params", {})}
+
+    def canonical_of(p):
+        target = p.get("target") if isinstance(p.get("target"), dict) else {}
+        measures = sorted({int(n) for n in target.get("measures") or [] if str(n).lstrip("-").isdigit()})
+        canonical = action_of(p)
+        canonical["secondary_actions"] = [action_of(a) for a in p.get("secondary_actions", []) if isinstance(a, dict)]
+        canonical["measures"] = measures
+        return canonical
+
+    if isinstance(plan.get("sections"), list):
+        # a long score's plan: one plan per section (score_sections)
+        canonical = {"sections": [canonical_of(p) for p in plan["sections"] if isinstance(p, dict)]}
+    else:
+        canonical = canonical_of(plan)
+    return json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+
+
+def normalize_prompt(prompt):
+    """Case, spacing and trailing punctuation don't change what a prompt asks for"""
+    return re.sub(r"\s+", " ", prompt).strip().rstrip(".!?").strip().lower()
+
+
+def plan_key(score_key, plan, option_number, engine=""):
+    """engine names the code that builds the output (action engine, fast path), which can give different XML"""
+    key = f"{PLAN_CACHE_VERSION}\n{engine}\n{score_key}\n{option_number}\n{canonical_plan(plan)}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def prompt_key(score_key, prompt, sections=None):
+    """sections is the layout a long score's prompt is sent in (score_sections.plan_sections), None for one prompt"""
+    layout = json.dumps([list(s) for s in sections or []], separators=(",", ":"))
+    key = f"{PROMPT_CACHE_VERSION}\n{score_key}\n{normalize_prompt(prompt)}\n{layout}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class SqliteTier:
+    """Persistent key -> text table, bounded by entry count (least recently used rows go first)"""
+
+    def __init__(self, path, table, max_entries=RESULT_CACHE_DISK_ENTRIES):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        # one connection per process; a forked worker opens its own
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, used REAL NOT NULL)"
+            )
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key):
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute(f"UPDATE {self.table} SET used = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            return row[0]
+
+    def put(self, key, value):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, used) VALUES (?, ?, ?)", (key, value, time.time())
+            )
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN "
+                f"(SELECT key FROM {self.table} ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            conn.commit()
+
+    def count(self):
+        with self._lock:
+            return self._connection().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(f"DELETE FROM {self.table}")
+            conn.commit()
+
+
+class ResultCache:
+    """LRU cache of strings bounded by their total size, with an optional SqliteTier behind it"""
+
+    def __init__(self, max_bytes, disk=None):
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+        value = self.disk.get(key) if self.disk is not None else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        if not value:
+            return
+        self._remember(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def _remember(self, key, value):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = value
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            stats = {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": ((self.hits + self.disk_hits) / lookups) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+        if self.disk is not None:
+            stats["disk_entries"] = self.disk.count()
+        return stats
+
+
+def plan_cache():
+    """The (score, plan) -> MusicXML cache configured from the environment"""
+    disk = SqliteTier(RESULT_CACHE_DB, "plan_results") if RESULT_CACHE_DB else None
+    return ResultCache(RESULT_CACHE_MAX_MB * 1024 * 1024, disk)
+
+
+def prompt_cache():
+    """The (score, prompt) -> candidates JSON cache configured from the environment"""
+    disk = SqliteTier(RESULT_CACHE_DB, "prompt_results") if RESULT_CACHE_DB else None
+    return ResultCache(PROMPT_CACHE_MAX_MB * 1024 * 1024, disk)
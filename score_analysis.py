@@ -0,0 +1,157 @@
+import bisect
+
+try:
+    import numpy as np
+except ImportError:  # optional, like the note-table engine; without it callers use score.analyze('key')
+    np = None
+
+from music21 import key, meter, note, pitch, stream, tempo
+from music21.analysis import discrete
+
+
+# -------------------------------
+# Global analysis: key, meter and tempo
+# -------------------------------
+# score.analyze('key') walks the whole score and builds a pitch-class histogram
+# every time it is called. ScoreAnalysis walks the score once, keeps one
+# duration-weighted pitch-class histogram per measure number (summed over the
+# parts) plus running totals, and answers "what key is measures 9-16 in" by
+# subtracting two rows of the running totals and correlating the result with
+# the 24 rotated key profiles in one matrix product. The profiles, the
+# correlation and the enharmonic choice are music21's own (the Aarden-Essen
+# weights analyze('key') uses), so the answer is the same Key. Time signatures
+# and tempo marks are indexed by measure during the same walk.
+#
+# The analysis holds only arrays and small lists, no music21 objects, so it is
+# built once per parsed score and kept with it in the score cache.
+
+DEFAULT_TEMPO = 120  # what music21 assumes before the first metronome mark
+
+_KEY_ANALYSIS = discrete.AardenEssen()
+
+
+def available():
+    return np is not None
+
+
+def _profiles():
+    """(24, 12) rotated key profiles, row i < 12 is major on tonic i, row 12 + i minor on tonic i"""
+    rows = []
+    for mode in ("major", "minor"):
+        weights = _KEY_ANALYSIS.getWeights(mode)
+        for tonic in range(12):
+            rows.append([weights[(pc - tonic) % 12] for pc in range(12)])
+    profiles = np.array(rows, dtype=np.float64)
+    return profiles - profiles.mean(axis=1, keepdims=True)
+
+
+_CENTERED_PROFILES = _profiles() if np is not None else None
+
+
+def correlate_keys(distribution):
+    """Pearson correlation of a pitch-class distribution with every key profile: (24,) array"""
+    centered = distribution - distribution.mean()
+    norm = np.sqrt((centered ** 2).sum() * (_CENTERED_PROFILES ** 2).sum(axis=1))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(norm == 0, 0.0, _CENTERED_PROFILES @ centered / norm)
+
+
+def key_from_distribution(distribution):
+    """The music21 Key analyze('key') gives for a pitch-class distribution, or None if it is empty"""
+    if not distribution.any():
+        return None
+    correlations = correlate_keys(distribution)
+    # analyze('key') sorts (coefficient, tonic pitch, mode) and takes the largest
+    best = max(range(24), key=lambda i: (correlations[i], i % 12, "minor" if i >= 12 else "major"))
+    mode = "minor" if best >= 12 else "major"
+    tonic = _KEY_ANALYSIS._bestKeyEnharmonic(pitch.Pitch(best % 12), mode)
+    k = key.Key(tonic=tonic, mode=mode)
+    k.correlationCoefficient = float(correlations[best])
+    return k
+
+
+class ScoreAnalysis:
+    """Per-measure pitch-class histograms, time signatures and tempo marks of a score, gathered in one walk"""
+
+    def __init__(self, score):
+        parts = list(score.parts) or [score]
+        numbers = set()
+        rows, pcs, lengths = [], [], []
+        time_signatures = {}  # measure number -> ratio string
+        first_time_signature = None
+        marks = []  # (offset in the score, order seen, bpm)
+        measure_offsets = {}  # measure number -> offset in the score
+
+        for part in parts:
+            for m in part.getElementsByClass(stream.Measure):
+                number = m.number
+                numbers.add(number)
+                offset = m.getOffsetBySite(part)
+                measure_offsets.setdefault(number, offset)
+                for el in m.recurse():
+                    if isinstance(el, note.NotRest):
+                        if isinstance(el, note.Unpitched):
+                            continue
+                        for p in el.pitches:
+                            rows.append(number)
+                            pcs.append(p.pitchClass)
+                            lengths.append(el.quarterLength)
+                    elif isinstance(el, meter.TimeSignature):
+                        time_signatures.setdefault(number, el.ratioString)
+                        if first_time_signature is None:
+                            first_time_signature = el.ratioString
+                    elif isinstance(el, tempo.MetronomeMark):
+                        marks.append((offset + el.getOffsetInHierarchy(m), len(marks), el.number))
+
+        self.numbers = sorted(numbers)
+        row_of = {n: i for i, n in enumerate(self.numbers)}
+        self.histograms = np.zeros((len(self.numbers), 12), dtype=np.float64)
+        if rows:
+            np.add.at(self.histograms,
+                      (np.array([row_of[n] for n in rows], dtype=np.int64), np.array(pcs, dtype=np.int64)),
+                      np.array(lengths, dtype=np.float64))
+        # running totals: the histogram of measures [a, b) is _totals[b] - _totals[a]
+        self._totals = np.vstack([np.zeros((1, 12)), np.cumsum(self.histograms, axis=0)])
+
+        self.first_time_signature = first_time_signature
+        self._ts_numbers = sorted(time_signatures)
+        self._ts_values = [time_signatures[n] for n in self._ts_numbers]
+        marks.sort()
+        self._tempo_offsets = [offset for offset, _, _ in marks]
+        self._tempo_values = [bpm for _, _, bpm in marks]
+        self._measure_offsets = measure_offsets
+
+    def _rows(self, start, end):
+        lo = 0 if start is None else bisect.bisect_left(self.numbers, start)
+        hi = len(self.numbers) if end is None else bisect.bisect_right(self.numbers, end)
+        return lo, max(lo, hi)
+
+    def pitch_classes(self, start=None, end=None):
+        """Duration-weighted pitch-class histogram (12,) of measures start..end inclusive (default: all)"""
+        lo, hi = self._rows(start, end)
+        return self._totals[hi] - self._totals[lo]
+
+    def key(self, start=None, end=None):
+        """The key of measures start..end inclusive (default: the whole score), or None if they hold no notes"""
+        return key_from_distribution(self.pitch_classes(start, end))
+
+    def time_signature(self, measure=None):
+        """Ratio string of the time signature in force at a measure (default: the first one), or None"""
+        if measure is None:
+            return self.first_time_signature
+        i = bisect.bisect_right(self._ts_numbers, measure) - 1
+        return self._ts_values[i] if i >= 0 else self.first_time_signature
+
+    def tempo(self, measure=None):
+        """Quarter-note BPM in force at the start of a measure (default: the start of the score)"""
+        offset = self._measure_offsets.get(measure, 0.0) if measure is not None else 0.0
+        i = bisect.bisect_right(self._tempo_offsets, offset) - 1
+        return self._tempo_values[i] if i >= 0 else DEFAULT_TEMPO
+
+    def global_info(self, start=None, end=None):
+        """{"key", "time_signature", "tempo"} as sent to the LLM, for the whole score or a measure window"""
+        return {
+            "key": str(self.key(start, end)),
+            "time_signature": self.time_signature(start),
+            "tempo": self.tempo(start),
+        }
@@ -0,0 +1,133 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from music21 import freezeThaw
+
+
+# -------------------------------
+# Parsed-score cache
+# -------------------------------
+# Parsed music21 streams are kept frozen (pickled) rather than as live objects:
+# thawing a frozen score is cheaper than deepcopy-ing a live one, every caller
+# gets its own independent copy, and the byte size of the frozen form gives us
+# an honest number to bound the cache by.
+
+DEFAULT_MAX_BYTES = int(os.environ.get("SCORE_CACHE_MAX_MB", 256)) * 1024 * 1024
+
+
+def normalize_xml(xml_str: str) -> str:
+    """Normalize line endings and surrounding whitespace so trivially different uploads share a key"""
+    return xml_str.replace("\r\n", "\n").replace("\r", "\n").strip()
+
+
+def score_hash(xml_str: str) -> str:
+    """Content hash of a MusicXML string, used as the cache key"""
+    return hashlib.sha256(normalize_xml(xml_str).encode("utf-8")).hexdigest()
+
+
+def freeze_score(score) -> bytes:
+    # fastButUnsafe skips the internal deepcopy; the passed score must not be used afterwards
+    return freezeThaw.StreamFreezer(score, fastButUnsafe=True).writeStr(fmt="pickle")
+
+
+def thaw_score(data: bytes):
+    thawer = freezeThaw.StreamThawer()
+    thawer.openStr(data)
+    return thawer.stream
+
+
+class CachedScore:
+    """A frozen parsed score plus anything derived from it that is worth keeping"""
+
+    def __init__(self, key, frozen):
+        self.key = key
+        self.frozen = frozen
+        self.derived = {}
+
+    @property
+    def size(self):
+        return len(self.frozen)
+
+    def copy(self):
+        """Return a fresh, independent music21 score"""
+        return thaw_score(self.frozen)
+
+
+class ScoreCache:
+    """
+    LRU cache of parsed music21 scores keyed by the hash of the normalized MusicXML.
+    Bounded by the total size of the frozen scores it holds.
+    """
+
+    def __init__(self, parse, max_bytes=DEFAULT_MAX_BYTES):
+        self._parse = parse
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, xml_str: str):
+        """
+        Return (CachedScore, score) for xml_str. The score is a private copy the caller may modify.
+        """
+        entry = self.entry(xml_str)
+        return entry, entry.copy()
+
+    def entry(self, xml_str: str):
+        """Return the CachedScore for xml_str, parsing it on a miss"""
+        key = score_hash(xml_str)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if entry is not None:
+            return entry
+
+        # parse outside the lock; a concurrent miss on the same key just parses twice
+        score = self._parse(normalize_xml(xml_str))
+        entry = CachedScore(key, freeze_score(score))
+        with self._lock:
+            self.misses += 1
+            existing = self._entries.get(key)
+            if existing is not None:
+                entry = existing
+                self._entries.move_to_end(key)
+            elif entry.size <= self.max_bytes:
+                self._entries[key] = entry
+                self._bytes += entry.size
+                self._evict()
+        return entry
+
+    def get_score(self, xml_str: str):
+        """Return a private parsed copy of xml_str"""
+        return self.get(xml_str)[1]
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            _, old = self._entries.popitem(last=False)
+            self._bytes -= old.size
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
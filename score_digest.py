@@ -0,0 +1,124 @@
+from fractions import Fraction
+
+from music21 import articulations, chord, dynamics, key, meter, note, stream, tempo
+
+
+# -------------------------------
+# Compact score digest for prompts
+# -------------------------------
+# MusicXML spends dozens of tokens on every note. The digest keeps what the
+# model needs to plan an edit (pitches, durations, key/time/tempo changes,
+# dynamics, ties and the common articulations) in an ABC-like line per measure
+# and part, typically 10-20x fewer tokens than the XML snippet.
+
+DIGEST_LEGEND = (
+    "Score digest format: a line per part (P<n> <name>), then one line per measure: m<number> followed by its "
+    "events in order. A note is pitch+octave (C#5; B-4 is B flat), z is a rest, [C4 E4 G4] a chord. /d is the "
+    "length in quarter notes (no suffix = one quarter), a trailing - ties into the next note, . is staccato and "
+    "> an accent. [M:3/4] is a time signature, [K:G major] a key (or [K:2#] / [K:3b] for a bare signature), "
+    "[Q:120] a tempo in quarter notes per minute and !mf! a dynamic. Voices in one measure are separated by "
+    "' | V<n>: '."
+)
+
+
+def _length(ql):
+    ql = Fraction(ql).limit_denominator(64)
+    if ql == 1:
+        return ""
+    if ql.denominator == 1:
+        return f"/{ql.numerator}"
+    if ql.denominator in (2, 4, 8, 16):
+        return "/" + f"{float(ql):g}".lstrip("0")
+    return f"/{ql.numerator}/{ql.denominator}"
+
+
+def _suffix(n):
+    text = ""
+    if n.tie is not None and n.tie.type in ("start", "continue"):
+        text += "-"
+    for a in n.articulations:
+        if isinstance(a, articulations.Staccato):
+            text += "."
+        elif isinstance(a, articulations.Accent):
+            text += ">"
+    return text
+
+
+def _event(el):
+    if isinstance(el, note.Note):
+        return el.pitch.nameWithOctave + _length(el.quarterLength) + _suffix(el)
+    if isinstance(el, chord.Chord):
+        pitches = " ".join(p.nameWithOctave for p in el.pitches)
+        return f"[{pitches}]" + _length(el.quarterLength) + _suffix(el)
+    if isinstance(el, note.Rest):
+        return "z" + _length(el.quarterLength)
+    if isinstance(el, dynamics.Dynamic):
+        return f"!{el.value}!"
+    if isinstance(el, tempo.MetronomeMark):
+        bpm = el.getQuarterBPM() or el.numberSounding
+        return f"[Q:{bpm:g}]" if bpm else None
+    if isinstance(el, meter.TimeSignature):
+        return f"[M:{el.ratioString}]"
+    if isinstance(el, key.Key):
+        return f"[K:{el.tonic.name} {el.mode}]"
+    if isinstance(el, key.KeySignature):
+        return f"[K:{abs(el.sharps)}{'#' if el.sharps >= 0 else 'b'}]"
+    return None
+
+
+def _events(container):
+    """Digest tokens of the elements directly in container, in offset order"""
+    tokens = []
+    for el in container.getElementsNotOfClass(stream.Stream):
+        if isinstance(el, note.GeneralNote) and el.duration.isGrace:
+            continue
+        token = _event(el)
+        if token:
+            tokens.append(token)
+    return tokens
+
+
+def _context(m):
+    """Key, time signature and tempo in force at m that m itself doesn't set"""
+    tokens = []
+    for cls in (meter.TimeSignature, key.KeySignature, tempo.MetronomeMark):
+        if not m.getElementsByClass(cls):
+            found = m.getContextByClass(cls)
+            token = _event(found) if found is not None else None
+            if token:
+                tokens.append(token)
+    return tokens
+
+
+def _measure_line(m, with_context=False):
+    tokens = (_context(m) if with_context else []) + _events(m)
+    voices = list(m.voices)
+    for i, v in enumerate(voices):
+        voice_tokens = _events(v)
+        if i == 0:
+            tokens += voice_tokens
+        else:
+            tokens += [f"| V{i + 1}:"] + voice_tokens
+    return f"m{m.number} " + " ".join(tokens)
+
+
+def score_digest(score, measure_range=None, index=None):
+    """
+    The digest of score (or of measures start..end when measure_range is given). index is an optional
+    measure_index.MeasureIndex of score, used to find the measures without scanning every part.
+    """
+    lines = []
+    parts = list(index.parts) if index is not None else list(score.parts)
+    for part_idx, part in enumerate(parts):
+        if measure_range is not None and index is not None:
+            measures = index.measures(part_idx, *measure_range)
+        else:
+            measures = [
+                m for m in part.getElementsByClass(stream.Measure)
+                if measure_range is None or measure_range[0] <= m.number <= measure_range[1]
+            ]
+        name = part.partName or part.id
+        lines.append(f"P{part_idx + 1} {name}")
+        # a range that starts mid-score opens with the key, time and tempo in force there
+        lines.extend(_measure_line(m, with_context=(i == 0)) for i, m in enumerate(measures))
+    return "\n".join(lines)
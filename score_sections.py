@@ -0,0 +1,127 @@
+import os
+
+from music21 import bar, stream
+
+
+# -------------------------------
+# Long scores in sections
+# -------------------------------
+# A prompt over a long score ("make it more joyful" on 400 measures) used to
+# put the whole score in one prompt: slow to prefill, often past the context
+# window, and the model answers with one vague plan for everything. In
+# sections mode the measures are cut into sections of about CHUNK_MEASURES,
+# ending at a double, final or repeat barline or before a key or time change
+# when one falls near the end of a section. Each section gets its own prompt
+# (the same instruction and global info, the section's measures plus
+# CHUNK_OVERLAP measures of context on each side) and the prompts go to the
+# model concurrently. Candidate i of every section, clipped to the measures that
+# section owns, makes up option i: a plan with "sections" instead of a single
+# action, which the usual action machinery applies section by section.
+
+# prompts over at least this many measures go in sections (0 turns sections off)
+CHUNK_MIN_MEASURES = int(os.environ.get("CHUNK_MIN_MEASURES", 64))
+CHUNK_MEASURES = int(os.environ.get("CHUNK_MEASURES", 16))
+CHUNK_OVERLAP = int(os.environ.get("CHUNK_OVERLAP", 2))
+# section prompts of one request in flight at a time (the global LLM_CONCURRENCY cap still applies)
+CHUNK_CONCURRENCY = int(os.environ.get("CHUNK_CONCURRENCY", 4))
+
+SECTION_BARLINES = {"double", "final", "heavy-light", "heavy-heavy"}
+
+
+def section_ends(score):
+    """Numbers of the measures that close a section of the first part: a double, final or repeat barline, or
+    the measure before a key or time change"""
+    parts = list(score.parts) or [score]
+    measures = list(parts[0].getElementsByClass(stream.Measure))
+    ends = set()
+    for m, following in zip(measures, measures[1:] + [None]):
+        right = m.rightBarline
+        if right is not None and (right.type in SECTION_BARLINES or isinstance(right, bar.Repeat)):
+            ends.add(m.number)
+        if following is not None and (following.timeSignature is not None or following.keySignature is not None):
+            ends.add(m.number)
+    return ends
+
+
+def plan_sections(numbers, size=CHUNK_MEASURES, overlap=CHUNK_OVERLAP, ends=()):
+    """
+    Cut the sorted measure numbers into sections of about `size` measures. A section ends early at a measure in
+    `ends` past two thirds of its length, and a short last section joins the one before it.
+    Returns [(first, last, context_first, context_last)]: the measures each section edits, and the wider range
+    its prompt shows.
+    """
+    size = max(1, size)
+    spans = []
+    i = 0
+    while i < len(numbers):
+        j = min(i + size, len(numbers)) - 1
+        if j < len(numbers) - 1:
+            for k in range(j, i + (2 * size) // 3 - 1, -1):
+                if numbers[k] in ends:
+                    j = k
+                    break
+        spans.append([i, j])
+        i = j + 1
+    if len(spans) > 1 and spans[-1][1] - spans[-1][0] + 1 < size // 3:
+        tail = spans.pop()
+        spans[-1][1] = tail[1]
+    last = len(numbers) - 1
+    return [
+        (numbers[i], numbers[j], numbers[max(0, i - overlap)], numbers[min(last, j + overlap)])
+        for i, j in spans
+    ]
+
+
+def section_instruction(prompt, section, count, first, last):
+    """The instruction for one section's prompt"""
+    return (f"{prompt.strip()} (this is section {section} of {count} of a longer score: change only measures "
+            f"{first}-{last}; the other measures in the snippet are context)")
+
+
+def _clip(candidate, first, last):
+    """The candidate restricted to measures first..last, or None if it only edits measures outside them"""
+    if not isinstance(candidate, dict) or "action" not in candidate:
+        return None
+    target = dict(candidate["target"]) if isinstance(candidate.get("target"), dict) else {}
+    asked = [int(n) for n in target.get("measures") or [] if str(n).lstrip("-").isdigit()]
+    kept = [n for n in asked if first <= n <= last]
+    if asked and not kept:
+        return None
+    target["measures"] = kept or list(range(first, last + 1))
+    return dict(candidate, target=target)
+
+
+def merge_sections(sections, results):
+    """
+    Full-score candidates from each section's candidates: results[k] is the list the model gave for
+    sections[k] (empty if its call failed). Candidate i takes every section's candidate i (its last one when it
+    gave fewer), clipped to the measures the section owns.
+    """
+    count = max((len(found) for found in results if found), default=0)
+    merged = []
+    for i in range(count):
+        plans = []
+        for (first, last, _, _), found in zip(sections, results):
+            if found:
+                plan = _clip(found[min(i, len(found) - 1)], first, last)
+                if plan is not None:
+                    plans.append(plan)
+        if plans:
+            merged.append({"id": f"v{i + 1}", "sections": plans})
+    return merged
+
+
+def section_plans(plan):
+    """The single-action plans of a candidate: its sections, last measures first, or the candidate itself"""
+    sections = plan.get("sections")
+    if not isinstance(sections, list):
+        return [plan]
+
+    def start(p):
+        target = p.get("target") if isinstance(p.get("target"), dict) else {}
+        measures = [int(n) for n in target.get("measures") or [] if str(n).lstrip("-").isdigit()]
+        return min(measures) if measures else 0
+
+    # applied from the end of the score back, so a section that adds measures (repeat_segment) doesn't
+    # renumber the ones still to come
+    return sorted((p for p in sections if isinstance(p, dict) and "action" in p), key=start, reverse=True)
@@ -0,0 +1,280 @@
+import time
+
+STARTED = time.perf_counter()
+
+import gc  # noqa: E402
+import logging  # noqa: E402
+import os  # noqa: E402
+import shutil  # noqa: E402
+import signal  # noqa: E402
+import socket  # noqa: E402
+import sys  # noqa: E402
+import tempfile  # noqa: E402
+
+from werkzeug.serving import make_server  # noqa: E402
+
+import edit_session  # noqa: E402
+import intent_parser  # noqa: E402
+import job_queue  # noqa: E402
+import llm_client  # noqa: E402
+import metrics  # noqa: E402
+import score_analysis  # noqa: E402
+import server  # noqa: E402
+import xml_rewriter  # noqa: E402
+from candidate_stream import CandidateStreamParser  # noqa: E402
+from measure_index import MeasureIndex  # noqa: E402
+from musicxml_io import parse_musicxml_string, score_to_musicxml  # noqa: E402
+from score_cache import freeze_score, thaw_score  # noqa: E402
+from score_delta import measure_digests, measure_divisions, score_delta  # noqa: E402
+from score_digest import score_digest  # noqa: E402
+
+IMPORTED = time.perf_counter()
+
+
+# -------------------------------
+# Production entry point (pre-forked, warmed workers)
+# -------------------------------
+# `python serve.py` imports the app and music21 once, runs every stage of a
+# request on a tiny score so the first-call costs (music21's lazily built
+# tables and parsers, the openai client's lazily imported resources, regex
+# compiles) are paid here, then forks SERVE_WORKERS processes that serve the
+# same listening socket. The workers share the warmed state copy-on-write;
+# gc.freeze() keeps the collector from touching (and so copying) the pages it
+# lives on. A worker that dies is replaced by a fresh fork of the warmed
+# parent, so a restart costs milliseconds rather than an import.
+#
+# Everything that holds threads, sockets or files (the candidate process pool,
+# LLM connections, job workers, health checks, SQLite) is created on first use,
+# so each worker gets its own. `python server.py` still runs the debug server.
+# Metrics are per process too; the workers share them through METRICS_DIR (a
+# temporary directory by default), so /metrics reports the sum of all workers
+# whichever one answers the scrape.
+#
+# The kernel hands each connection to whichever worker accepts it first, so
+# any state a client comes back to must not live in one worker's memory. Edit
+# sessions are kept as files in SESSION_DIR (also a temporary directory by
+# default, so sessions end with the server unless it is set): a session made
+# by one worker can be prompted, accepted and undone through any other. A job
+# runs in the worker that accepted it, which publishes its state in JOB_DIR
+# (likewise a temporary directory by default) for the others to answer polls.
+
+HOST = os.environ.get("HOST", "0.0.0.0")
+PORT = int(os.environ.get("PORT", 5000))
+SERVE_WORKERS = int(os.environ.get("SERVE_WORKERS", os.cpu_count() or 1))
+SERVE_BACKLOG = int(os.environ.get("SERVE_BACKLOG", 256))
+# start each worker's candidate process pool before it takes requests
+SERVE_WARM_POOL = os.environ.get("SERVE_WARM_POOL", "1") != "0"
+METRICS_DIR = os.environ.get("METRICS_DIR") or None
+
+WARM_UP_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<score-partwise version="3.1">
+  <work><work-title>Warm-up</work-title></work>
+  <part-list><score-part id="P1"><part-name>Piano</part-name></score-part></part-list>
+  <part id="P1">
+    <measure number="1">
+      <attributes>
+        <divisions>2</divisions>
+        <key><fifths>-1</fifths></key>
+        <time><beats>4</beats><beat-type>4</beat-type></time>
+        <clef><sign>G</sign><line>2</line></clef>
+      </attributes>
+      <direction placement="above">
+        <direction-type><metronome><beat-unit>quarter</beat-unit><per-minute>96</per-minute></metronome></direction-type>
+        <sound tempo="96"/>
+      </direction>
+      <direction placement="below"><direction-type><dynamics><mf/></dynamics></direction-type></direction>
+      <note><pitch><step>F</step><octave>4</octave></pitch><duration>2</duration><type>quarter</type></note>
+      <note><pitch><step>Bb</step><octave>4</octave></pitch><duration>2</duration><type>quarter</type></note>
+      <note><pitch><step>A</step><octave>4</octave></pitch><duration>1</duration><type>eighth</type></note>
+      <note><pitch><step>G</step><octave>4</octave></pitch><duration>1</duration><type>eighth</type></note>
+      <note><rest/><duration>2</duration><type>quarter</type></note>
+    </measure>
+    <measure number="2">
+      <note><pitch><step>C</step><octave>4</octave></pitch><duration>4</duration><type>half</type></note>
+      <note><chord/><pitch><step>E</step><octave>4</octave></pitch><duration>4</duration><type>half</type></note>
+      <note><pitch><step>F</step><octave>4</octave></pitch><duration>4</duration><type>half</type></note>
+    </measure>
+  </part>
+</score-partwise>
+'''
+
+WARM_UP_PARAMS = {
+    "transpose": {"semitones": 2},
+    "change_tempo": {"ratio": 1.2},
+    "adjust_rhythm": {"scale": 0.5},
+    "modify_dynamics": {"dynamics_shift": 1},
+    "add_articulation": {"style": "staccato"},
+    "change_mode": {"from": "major", "to": "minor"},
+    "add_chord_tone": {"interval": "M3"},
+    "repeat_segment": {"times": 2},
+    "add_seventh_chords": {"chord_type": "dominant seventh"},
+}
+
+WARM_UP_CANDIDATES = (
+    '{"candidates": [{"id": "v1", "target": {"measures": [1, 2]}, "action": "transpose", '
+    '"params": {"semitones": 2}, "secondary_actions": []}]}'
+)
+
+
+def _warm_llm_client():
+    # the openai package imports its resources and builds its response models on first use; no request is sent
+    from openai import OpenAI
+    from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+    client = OpenAI(base_url="http://127.0.0.1:9/v1", api_key="warm-up")
+    client.chat.completions  # noqa: B018
+    ChatCompletion.model_validate({
+        "id": "warm-up", "object": "chat.completion", "created": 0, "model": "llama3",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": WARM_UP_CANDIDATES},
+                     "finish_reason": "stop"}],
+    })
+    ChatCompletionChunk.model_validate({
+        "id": "warm-up", "object": "chat.completion.chunk", "created": 0, "model": "llama3",
+        "choices": [{"index": 0, "delta": {"content": "{"}, "finish_reason": None}],
+    })
+    client.close()
+
+
+def warm_up():
+    """Run every stage of a request once on a tiny score; returns {stage: seconds}"""
+    timings = {}
+
+    def stage(name, fn, *args):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args)
+        except Exception:
+            logging.exception("warm-up stage %s failed", name)
+        finally:
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - t0
+
+    xml = stage("fix_steps", server.fix_steps, WARM_UP_XML)
+    score = stage("parse", parse_musicxml_string, xml)
+    index = stage("index", MeasureIndex, score)
+    if score_analysis.available():
+        info = stage("analyze_key", lambda: score_analysis.ScoreAnalysis(score).global_info())
+    else:
+        info = stage("analyze_key", server.analyze_global_info, score)
+    stage("intent", intent_parser.parse_intent, "transpose measures 1-2 up 2 semitones", lambda: info)
+    snippet = stage("snippet", lambda: score_to_musicxml(score.measures(1, 2)))
+    stage("digest", score_digest, score, (1, 2), index)
+    stage("build_prompt", server.build_prompt, "make measures 1-2 more joyful", info, snippet)
+    stage("llm_client", _warm_llm_client)
+    parser = CandidateStreamParser()
+    stage("candidate_stream", parser.feed, WARM_UP_CANDIDATES)
+    rewritten = stage("rewrite", xml_rewriter.rewrite_musicxml, xml,
+                      [(name, WARM_UP_PARAMS[name]) for name in sorted(xml_rewriter.FAST_PATH_ACTIONS)])
+    written = stage("export", score_to_musicxml, score)
+    frozen = stage("freeze", freeze_score, score)
+    for name, fn in server.ACTIONS.items():
+        stage("actions", lambda: fn(thaw_score(frozen), WARM_UP_PARAMS.get(name, {})))
+    stage("delta", lambda: score_delta(rewritten, [measure_digests(xml), measure_digests(written)],
+                                       measure_divisions(xml)))
+    return timings
+
+
+def _serve_worker(sock, number, metrics_dir):
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    # the parent's warm-up isn't traffic; count from zero and share with the other workers
+    metrics.REGISTRY.reset()
+    metrics.REGISTRY.share(metrics_dir)
+    if SERVE_WARM_POOL:
+        server.candidate_pool.warm()
+    # the LLM client (and its TLS context) is per process; build it now, it connects on first use
+    llm_client.default_client().sync_client
+    http = make_server(HOST, PORT, server.app, threaded=True, fd=sock.fileno())
+    print(f"worker {number} (pid {os.getpid()}) ready", flush=True)
+    try:
+        http.serve_forever()
+    finally:
+        metrics.REGISTRY.flush()
+        server.candidate_pool.shutdown()
+
+
+def _spawn(sock, number, metrics_dir):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            _serve_worker(sock, number, metrics_dir)
+        except SystemExit as e:
+            code = e.code or 0
+        except BaseException:
+            logging.exception("worker %d crashed", number)
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def main():
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    timings = warm_up()
+    warmed = time.perf_counter()
+    print(f"imported in {IMPORTED - STARTED:.2f}s, warmed up in {warmed - IMPORTED:.2f}s ("
+          + ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in timings.items()) + ")", flush=True)
+
+    sock = socket.socket(socket.AF_INET6 if ":" in HOST else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((HOST, PORT))
+    sock.listen(SERVE_BACKLOG)
+    sock.set_inheritable(True)
+
+    metrics_dir = METRICS_DIR or tempfile.mkdtemp(prefix="lyric-mind-metrics-")
+    os.makedirs(metrics_dir, exist_ok=True)
+    metrics.clear_shared(metrics_dir)
+    # a SESSION_DIR that is set keeps its sessions across restarts, until they expire
+    session_dir = server.sessions.directory or tempfile.mkdtemp(prefix="lyric-mind-sessions-")
+    server.sessions.share(session_dir)
+    job_dir = server.jobs.directory or tempfile.mkdtemp(prefix="lyric-mind-jobs-")
+    job_queue.clear_shared(job_dir)
+    server.jobs.share(job_dir)
+
+    # everything allocated so far is shared with the workers; keep the collector off those pages
+    gc.collect()
+    gc.freeze()
+
+    workers = {_spawn(sock, i, metrics_dir): (i, time.monotonic()) for i in range(SERVE_WORKERS)}
+    print(f"{SERVE_WORKERS} workers listening on http://{HOST}:{PORT}", flush=True)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        number, started = workers.pop(pid, (None, None))
+        if number is None or stopping:
+            continue
+        logging.error("worker %d (pid %d) exited with status %d; starting a new one",
+                      number, pid, os.waitstatus_to_exitcode(status))
+        if time.monotonic() - started < 1:
+            time.sleep(1)  # don't spin on a worker that dies at startup
+        workers[_spawn(sock, number, metrics_dir)] = (number, time.monotonic())
+    sock.close()
+    if METRICS_DIR is None:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+    if edit_session.SESSION_DIR is None:
+        shutil.rmtree(session_dir, ignore_errors=True)
+    if job_queue.JOB_DIR is None:
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
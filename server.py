@@ -1,15 +1,40 @@
 import os
+import copy
+import concurrent.futures
+import contextvars
+import math
+import threading
+import time
 import xml.etree.ElementTree as ET
  
-import tempfile
 import json
 import re
+import gzip
+import zlib
 import logging, traceback
-from music21 import converter, meter, tempo, dynamics, articulations, key, interval, chord, note, stream,metadata, volume
-from io import StringIO
-from flask import Flask, request, jsonify
+from music21 import meter, tempo, dynamics, articulations, key, interval, chord, note, stream,metadata
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-from openai import OpenAI
+import llm_client
+import llm_router
+import metrics
+import job_queue
+from score_cache import ScoreCache, normalize_xml, score_hash
+from musicxml_io import parse_musicxml_string, score_to_musicxml
+from candidate_pool import CandidatePool
+from measure_index import NO_MEASURES, MeasureIndex
+import note_table
+import plan_compiler
+import xml_rewriter
+import result_cache
+import intent_parser
+from single_flight import SingleFlight
+from score_digest import DIGEST_LEGEND, score_digest
+from score_delta import measure_digests, measure_divisions, score_delta
+import score_analysis
+import score_sections
+import edit_session
+from candidate_stream import CandidateStreamParser
 
 # initialize Flask
 logging.basicConfig(level=logging.ERROR)
@@ -17,91 +42,889 @@ app = Flask(__name__)
 CORS(app)  
 
 
+# every request collects timing spans; the breakdown is sent back as a Server-Timing header when
+# TIMING_HEADER=1, or when the request has ?timing=1 or an "X-Timing: 1" header
+@app.before_request
+def start_request_trace():
+    g.started = time.perf_counter()
+    g.spans = metrics.start_trace()
+
+
+@app.after_request
+def finish_request_trace(response):
+    started = g.get("started")
+    if started is None:
+        return response
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unknown"
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, status=response.status_code)
+    if not response.is_streamed:
+        metrics.RESPONSE_BYTES.observe(response.calculate_content_length() or 0, endpoint=endpoint)
+    if TIMING_HEADER or request.args.get("timing") == "1" or request.headers.get("X-Timing") == "1":
+        response.headers["Server-Timing"] = metrics.server_timing(g.spans)
+    return response
+
+
+# JSON bodies of COMPRESS_MIN_BYTES or more go out gzip- or deflate-encoded when the client accepts it
+@app.after_request
+def compress_response(response):
+    if (COMPRESS_MIN_BYTES <= 0 or response.is_streamed or response.status_code < 200
+            or "Content-Encoding" in response.headers):
+        return response
+    response.headers.add("Vary", "Accept-Encoding")
+    encodings = request.accept_encodings
+    encoding = "gzip" if encodings["gzip"] else "deflate" if encodings["deflate"] else None
+    body = response.get_data()
+    if encoding is None or len(body) < COMPRESS_MIN_BYTES:
+        return response
+    with metrics.span("compress"):
+        if encoding == "gzip":
+            body = gzip.compress(body, COMPRESS_LEVEL)
+        else:
+            body = zlib.compress(body, COMPRESS_LEVEL)
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+@app.errorhandler(edit_session.SessionNotFound)
+def unknown_session(e):
+    return jsonify({"error": "unknown or expired session"}), 404
+
+
+@app.errorhandler(edit_session.VersionConflict)
+def session_version_conflict(e):
+    return jsonify({"error": str(e), "version": e.version}), 409
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
 # prompt: user prompt from front end, xml: whole score from front end, 
 # full_prompt: prompt sent to llama3,snippet_xml: part of score needed to modify，score: full musicxml's score
 @app.route("/api/llama3", methods=["POST"])
 def llama3_handler():
-   
+    print("🔥 Flask endpoint /api/llama3 called!") 
+    body, status = run_llama3(request.get_json())
+    return jsonify(body), status
+
+
+def run_llama3(data):
+    """
+    Answer one /api/llama3 request body; returns (response body, HTTP status). Identical requests (same score
+    and prompt) that arrive while one is being answered wait for it and share its response. A body with
+    "session" in place of "xml" edits that session's current score.
+    """
+    session = find_session(data)
+    if data.get("fresh") or not COALESCE_REQUESTS:
+        return llama3_response(data, session)
+    # every other field that changes the answer: the ones a batch passes down to its items
+    options = [response_format(data) if k == "response" else str(data.get(k)) for k in BATCH_DEFAULTS]
+    key = "\n".join([
+        result_cache.prompt_key(session.key if session else score_hash(data.get("xml", "")), data.get("prompt", "")),
+        session.id if session else "",
+    ] + options)
+    with metrics.span("single_flight"):
+        response, _ = in_flight.do(key, lambda: llama3_response(data, session))
+    return response
+
+
+def find_session(data):
+    """The edit session a request body names, or None; raises SessionNotFound or VersionConflict"""
+    if not data.get("session"):
+        return None
+    session = sessions.get(str(data["session"]))
+    session.check(data.get("version"))
+    return session
+
+
+def llama3_response(data, session=None, batch_score=None):
     try:
-        print("🔥 Flask endpoint /api/llama3 called!") 
-        data = request.get_json()
         prompt = data.get("prompt", "")  
-        xml = data.get("xml", "")  
-        xml = fix_steps(xml)
+        # "fresh": true asks the model for something new instead of reusing the rules or its last answer
+        if session is not None:
+            with cpu_slots, metrics.span("session"):
+                xml, base, version, entry = session.current()
+                req = Llama3Request(prompt, xml, fresh=bool(data.get("fresh")),
+                                    snippet_format=data.get("snippet_format"), score_entry=entry,
+                                    sections=data.get("sections"))
+            sent_xml = xml
+        elif batch_score is not None:
+            # fixed up and parsed once for every item of the batch that shares the score
+            with cpu_slots:
+                xml, entry = batch_score.parsed()
+                req = Llama3Request(prompt, xml, fresh=bool(data.get("fresh")),
+                                    snippet_format=data.get("snippet_format"), score_entry=entry,
+                                    sections=data.get("sections"))
+            sent_xml, base = batch_score.xml, batch_score.key
+        else:
+            sent_xml, base = data.get("xml", ""), None
+            with metrics.span("fix_steps"):
+                xml = fix_steps(sent_xml)
+            with cpu_slots:
+                req = Llama3Request(prompt, xml, fresh=bool(data.get("fresh")), snippet_format=data.get("snippet_format"),
+                                    sections=data.get("sections"))
+
+        candidates, source, failed_sections = resolve_candidates(req)
+        if not candidates:
+            return {"error": "No candidates returned by the model", "source": source}, 500
+
+        for i, c in enumerate(candidates):
+            print(f"candidate {i}:", c)
+            target_candidate(c, req.prompt_range)
+            resolve_mode_tonic(c, req)
+
+        # each candidate edits only its target measures and returns the full score
+        with cpu_slots:
+            options = materialize_candidates(xml, req.score_entry, candidates)
+        # the editor expects at least two slots
+        options += [""] * (2 - len(options))
+
+        # source: "rules" (intent parser), "cache" (same prompt seen before) or "llm"
+        if response_format(data) == "delta":
+            with cpu_slots, metrics.span("delta"):
+                deltas = option_deltas(sent_xml, xml, req.score_entry, options)
+            body = {"base": base or score_hash(sent_xml), "deltas": deltas, "source": source}
+        else:
+            body = {"options": options, "source": source}
+        if failed_sections:
+            # a long score's sections the model didn't answer: the options leave those measures as they were
+            body["failed_sections"] = failed_sections
+        if session is not None:
+            session.offer(version, options)
+            body.update(session=session.id, version=version)
+        return body, 200
 
-        #print("User prompt:", prompt)
-        #print("prompt userinput:", prompt)
-        match = re.search(r"measures?\s+(\d+)[-–](\d+)", prompt)
-        if match:
-            start_measure = int(match.group(1))
-            end_measure = int(match.group(2))
+    except Exception as e:
+        print("Error:", e)
+        logging.error("Failed to parse XML:\n%s", traceback.format_exc())
+        return {"error": str(e)}, 500
+
+
+def response_format(data):
+    fmt = data.get("response")
+    return fmt if fmt in RESPONSE_FORMATS else RESPONSE_FORMAT
+
+
+def option_deltas(sent_xml, xml, score_entry, options):
+    """
+    The changed measures of each option, against the score as sent and as music21 exports it, written in the
+    divisions of the score as sent so they can be patched into it
+    """
+    bases = score_entry.derived.get("measure_digests")
+    if bases is None:
+        bases = ([measure_digests(sent_xml), measure_digests(musicxml_to_string(score_entry.copy()))],
+                 measure_divisions(sent_xml))
+        score_entry.derived["measure_digests"] = bases
+    digests, divisions = bases
+    deltas = []
+    for option in options:
+        try:
+            deltas.append(score_delta(option, digests, divisions) if option else None)
+        except (ValueError, ET.ParseError) as e:
+            print(f"Error diffing option: {e}")
+            deltas.append({"full": option})
+    return deltas
+
+
+# Edit sessions: the score stays on the server between prompts, so follow-ups don't upload and parse it again.
+#   POST   /api/sessions {"xml"}                       -> 201 {"session", "version": 0, "undo": 0}
+#   GET    /api/sessions/<id>?xml=1                    -> {"session", "version", "undo", "xml"}
+#   POST   /api/sessions/<id>/accept {"option": 2}     -> {"session", "version", "undo"}: option 2 of the last
+#          prompt becomes the current score ({"xml": ...} instead commits a score edited in the editor)
+#   POST   /api/sessions/<id>/undo                     -> {"session", "version", "undo", "xml"}, 409 if there is
+#          nothing to undo
+#   DELETE /api/sessions/<id>                          -> 204
+#   GET    /api/sessions                               -> store stats
+# /api/llama3, /api/llama3/stream and /api/jobs take {"session": id} in place of "xml". Every change makes a
+# new version; a request with "version" is refused with 409 unless that is still the current one.
+@app.route("/api/sessions", methods=["POST"])
+def create_session():
+    data = request.get_json()
+    if not data or not data.get("xml"):
+        return jsonify({"error": "xml is required"}), 400
+    xml = normalize_xml(fix_steps(data["xml"]))
+    session = sessions.create(xml, score_hash(xml))
+    warm_session(session)
+    return jsonify(session.to_dict()), 201
+
+
+@app.route("/api/sessions/<session_id>", methods=["GET"])
+def get_session(session_id):
+    return jsonify(sessions.get(session_id).to_dict(with_xml=request.args.get("xml") == "1"))
+
+
+@app.route("/api/sessions/<session_id>", methods=["DELETE"])
+def delete_session(session_id):
+    if not sessions.delete(session_id):
+        raise edit_session.SessionNotFound(session_id)
+    return "", 204
+
+
+@app.route("/api/sessions/<session_id>/accept", methods=["POST"])
+def accept_option(session_id):
+    data = request.get_json() or {}
+    session = sessions.get(session_id)
+    version = data.get("version")
+    if data.get("xml"):
+        xml = normalize_xml(fix_steps(data["xml"]))
+    else:
+        try:
+            offered = session.option(int(data.get("option", 0)))
+        except (TypeError, ValueError):
+            offered = None
+        if offered is None:
+            return jsonify({"error": "no such option for the current version", "version": session.version}), 409
+        xml, offered_version = offered
+        # the option was built on offered_version: commit it on that one or not at all
+        if version is not None and int(version) != offered_version:
+            raise edit_session.VersionConflict(session.version)
+        version = offered_version
+        xml = normalize_xml(xml)
+    with metrics.span("session"):
+        session.commit(xml, score_hash(xml), version)
+    sessions.trim()
+    warm_session(session)
+    return jsonify(session.to_dict())
+
+
+@app.route("/api/sessions/<session_id>/undo", methods=["POST"])
+def undo_session(session_id):
+    data = request.get_json(silent=True) or {}
+    session = sessions.get(session_id)
+    if session.undo(score_hash, data.get("version")) is None:
+        return jsonify({"error": "nothing to undo", "version": session.version}), 409
+    warm_session(session)
+    return jsonify(session.to_dict(with_xml=True))
+
+
+@app.route("/api/sessions", methods=["GET"])
+def session_stats():
+    return jsonify(sessions.stats())
+
+
+def warm_session(session):
+    """Parse the session's new score in the background, so the next prompt finds it ready"""
+    def warm():
+        with cpu_slots:
+            session.score_entry()
+    threading.Thread(target=warm, name="session-warm", daemon=True).start()
+
+
+def run_job(data):
+    body, status = run_llama3(data)
+    return body, status == 200
+
+
+# Job API: the same request as /api/llama3, run in the background.
+#   POST /api/jobs            -> 202 {"id": ..., "status": "queued"}, or 429 with Retry-After when the queue is full
+#   GET  /api/jobs/<id>       -> {"id", "status": queued|running|done|error, "options", "source", "error"}
+#   GET  /api/jobs/<id>?wait=10  waits up to 10 seconds for the job to finish before answering
+#   GET  /api/jobs            -> queue stats (of the process that answers)
+@app.route("/api/jobs", methods=["POST"])
+def submit_job():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not (data.get("xml") or data.get("session")):
+        return jsonify({"error": "expected a JSON body with \"xml\" or \"session\""}), 400
+    find_session(data)  # an unknown session or stale version is refused now, not when the job runs
+    try:
+        job = jobs.submit(data)
+    except job_queue.QueueFull as e:
+        response = jsonify({"error": str(e), "retry_after": e.retry_after})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 429
+    response = jsonify(job.to_dict())
+    response.headers["Location"] = f"/api/jobs/{job.id}"
+    return response, 202
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    try:
+        wait = float(request.args.get("wait", 0) or 0)
+    except ValueError:
+        wait = math.nan
+    if math.isnan(wait):
+        return jsonify({"error": "wait must be a number of seconds"}), 400
+    wait = min(wait, JOB_MAX_WAIT)
+    if wait > 0:
+        job = jobs.wait(job, wait)
+    return jsonify(job.to_dict())
+
+
+@app.route("/api/jobs", methods=["GET"])
+def job_stats():
+    return jsonify(jobs.stats())
+
+
+# Same request as /api/llama3, answered as a stream of events (NDJSON lines, or SSE
+# with "Accept: text/event-stream" or ?format=sse):
+#   {"type": "meta", "source": "llm"}              where the candidates come from (rules, cache or llm), plus
+#                                                  "session" and "version" for a session's score
+#   {"type": "option", "index": 0, "xml": "..."}   one per candidate, as soon as it is built
+#   {"type": "error", "error": "..."}
+#   {"type": "done", "count": 2}                  plus "failed_sections": [[17, 32]] when some sections of a
+#                                                  long score got no answer from the model
+@app.route("/api/llama3/stream", methods=["POST"])
+def llama3_stream_handler():
+    data = request.get_json()
+    prompt = data.get("prompt", "")
+    session = find_session(data)
+    sse = request.args.get("format") == "sse" or "text/event-stream" in request.headers.get("Accept", "")
+
+    try:
+        if session is not None:
+            xml, _, version, entry = session.current()
+            req = Llama3Request(prompt, xml, fresh=bool(data.get("fresh")),
+                                snippet_format=data.get("snippet_format"), score_entry=entry,
+                                sections=data.get("sections"))
         else:
-            start_measure =1 
-            end_measure = 8
-         
-        # get snippet xml
-        with tempfile.NamedTemporaryFile(mode="w+", suffix=".xml", delete=False, encoding="utf-8") as f:
-            f.write(xml)
-            f.flush()
-            score = converter.parse(f.name)
-       
-        all_measures = []
-        for p in score.parts:
-            all_measures.extend(p.getElementsByClass('Measure'))
+            with metrics.span("fix_steps"):
+                xml = fix_steps(data.get("xml", ""))
+            req = Llama3Request(prompt, xml, fresh=bool(data.get("fresh")), snippet_format=data.get("snippet_format"),
+                                sections=data.get("sections"))
+    except Exception as e:
+        logging.error("Failed to parse XML:\n%s", traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+
+    def encode(event):
+        if sse:
+            return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        return json.dumps(event) + "\n"
+
+    def events():
+        options = {}
+        for event in stream_options(req):
+            if session is not None:
+                if event["type"] == "meta":
+                    event.update(session=session.id, version=version)
+                elif event["type"] == "option":
+                    options[event["index"]] = event["xml"]
+            yield encode(event)
+        if options:
+            session.offer(version, [options.get(i, "") for i in range(max(options) + 1)])
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Batch: many /api/llama3 requests in one call, for offline pipelines.
+#   {"items": [{"id": "a", "xml": "...", "prompt": "..."}, {"score": "s1", "prompt": "..."}, ...],
+#    "scores": {"s1": "<score-partwise>..."}}
+#   or one score with many prompts: {"xml": "...", "prompts": ["...", "..."]}
+# Other top-level fields (snippet_format, response, fresh, sections) are defaults for every item; an item can
+# also name a "session". Each distinct score is parsed once, identical items are answered once, and up to
+# BATCH_CONCURRENCY items are in progress at a time (LLM_CONCURRENCY and CPU_CONCURRENCY still apply).
+# The answer is NDJSON in completion order:
+#   {"type": "result", "index": 0, "id": "a", "options": [...], "source": "llm"}   (or "base" and "deltas")
+#   {"type": "error", "index": 1, "id": null, "status": 404, "error": "..."}       one bad item fails alone
+#   {"type": "done", "count": 2, "errors": 1, "seconds": 3.2}
+@app.route("/api/llama3/batch", methods=["POST"])
+def llama3_batch_handler():
+    data = request.get_json(silent=True)
+    items = batch_items(data) if isinstance(data, dict) else None
+    if not items:
+        return jsonify({"error": "expected \"items\", or \"xml\" with \"prompts\""}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"at most {BATCH_MAX_ITEMS} items per batch"}), 413
+
+    def events():
+        for event in run_batch(items):
+            yield json.dumps(event) + "\n"
+
+    return Response(stream_with_context(events()), mimetype="application/x-ndjson",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+BATCH_DEFAULTS = ("snippet_format", "response", "fresh", "sections")
+
+
+def batch_items(data):
+    """The item bodies of a batch request, each with the batch-wide defaults filled in"""
+    defaults = {k: data[k] for k in BATCH_DEFAULTS if k in data}
+    if isinstance(data.get("prompts"), list):
+        return [dict(defaults, xml=data.get("xml", ""), prompt=p) for p in data["prompts"]]
+    if not isinstance(data.get("items"), list):
+        return None
+    scores = data.get("scores") if isinstance(data.get("scores"), dict) else {}
+    items = []
+    for item in data["items"]:
+        item = dict(defaults, **item) if isinstance(item, dict) else {}
+        if item.get("score") is not None and "xml" not in item:
+            item["xml"] = scores.get(item["score"])
+        items.append(item)
+    return items
+
+
+class BatchScore:
+    """One distinct score of a batch: fixed up and parsed on first use, once for all the items that share it"""
+
+    def __init__(self, xml, key):
+        self.xml = xml
+        self.key = key
+        self._parsed = None
+        self._error = None
+        self._lock = threading.Lock()
+
+    def parsed(self):
+        """(fixed-up XML, CachedScore); raises the parse error for every item if the score doesn't parse"""
+        with self._lock:
+            if self._parsed is None and self._error is None:
+                try:
+                    xml = fix_steps(self.xml)
+                    with metrics.span("parse"):
+                        self._parsed = (xml, score_cache.entry(xml))
+                except Exception as e:
+                    self._error = e
+            if self._error is not None:
+                raise self._error
+            return self._parsed
+
+
+def run_batch(items):
+    """Events for a batch: one per item, in the order they finish, then a summary"""
+    started = time.perf_counter()
+    scores = {}  # score hash -> BatchScore
+    named = {}  # id() of a score string -> its hash: items naming a score (or sharing "xml") hash it once
+    work = {}  # identical items (same score, prompt and options) -> Future
+    waiting = {}  # Future -> [(item index, id)]
+    errors = 0
+    workers = max(1, min(BATCH_CONCURRENCY, len(items)))
+    pool = concurrent.futures.ThreadPoolExecutor(workers, "batch")
+    try:
+        for index, item in enumerate(items):
+            try:
+                if item.get("session"):
+                    session, batch_score = find_session(item), None
+                    same = ("session", session.id, session.version)
+                else:
+                    xml = item.get("xml")
+                    if not isinstance(xml, str) or not xml:
+                        raise ValueError("unknown score" if item.get("score") else "xml is required")
+                    key = named.get(id(xml)) or score_hash(xml)
+                    named[id(xml)] = key
+                    session, batch_score = None, scores.setdefault(key, BatchScore(xml, key))
+                    same = ("score", key)
+                if not item.get("prompt"):
+                    raise ValueError("prompt is required")
+            except edit_session.SessionNotFound:
+                errors += 1
+                yield {"type": "error", "index": index, "id": item.get("id"), "status": 404,
+                       "error": "unknown or expired session"}
+                continue
+            except (edit_session.VersionConflict, ValueError, TypeError) as e:
+                errors += 1
+                status = 409 if isinstance(e, edit_session.VersionConflict) else 400
+                yield {"type": "error", "index": index, "id": item.get("id"), "status": status, "error": str(e)}
+                continue
+            same += tuple(str(item.get(k)) for k in ("prompt",) + BATCH_DEFAULTS)
+            future = work.get(same)
+            if future is None or item.get("fresh"):
+                future = pool.submit(contextvars.copy_context().run, llama3_response, item, session, batch_score)
+                work[same] = future
+            waiting.setdefault(future, []).append((index, item.get("id")))
+
+        for future in concurrent.futures.as_completed(list(waiting)):
+            try:
+                body, status = future.result()
+            except Exception as e:
+                body, status = {"error": str(e)}, 500
+            for index, item_id in waiting[future]:
+                if status == 200:
+                    yield dict(body, type="result", index=index, id=item_id)
+                else:
+                    errors += 1
+                    yield {"type": "error", "index": index, "id": item_id, "status": status,
+                           "error": body.get("error", "failed")}
+    finally:
+        # a client that goes away stops the items not yet started
+        pool.shutdown(wait=False, cancel_futures=True)
+    yield {"type": "done", "count": len(items), "errors": errors,
+           "seconds": round(time.perf_counter() - started, 3)}
+
+
+class Llama3Request:
+    """
+    One /api/llama3 request: the cached score and the measure range the prompt names. The global info and
+    the LLM prompt are only worked out if something asks for them.
+    """
+
+    def __init__(self, prompt, xml, fresh=False, snippet_format=None, score_entry=None, sections=None):
+        self.prompt = prompt
+        self.xml = xml
+        self.fresh = fresh
+        # True / False asks for / against splitting a long prompt into sections; None leaves it to the length
+        self.use_sections = sections
+        self.snippet_format = snippet_format if snippet_format in SNIPPET_FORMATS else SNIPPET_FORMAT
+        with metrics.span("parse"):
+            if score_entry is not None:
+                # an edit session's score, already parsed
+                self.score_entry, self.score = score_entry, score_entry.copy()
+            else:
+                self.score_entry, self.score = score_cache.get(xml)
+        with metrics.span("index"):
+            self.index = MeasureIndex(self.score)
 
-        end_measure = len(all_measures)
-        snippet = score.measures(start_measure, end_measure)
-        snippet_xml = musicxml_to_string(snippet) 
+        match = re.search(r"measures?\s+(\d+)[-–](\d+)", prompt)
+        # the (start, end) measures the prompt names, or None
+        self.prompt_range = (int(match.group(1)), int(match.group(2))) if match else None
+        self._global_info = None
+
+    @property
+    def global_info(self):
+        if self._global_info is None:
+            with metrics.span("analyze_key"):
+                analysis = self.analysis
+                if analysis is not None:
+                    self._global_info = analysis.global_info()
+                else:
+                    self._global_info = analyze_global_info(self.score)
+            print(self._global_info)
+        return self._global_info
+
+    @property
+    def analysis(self):
+        """Key, meter and tempo index of the score, built once per cached score; None without numpy"""
+        return cached_analysis(self.score_entry, self.score)
+
+    def full_prompt(self):
+        """The prompt sent to Llama3"""
+        # get snippet xml
+        if self.prompt_range:
+            start_measure, end_measure = self.prompt_range
+        else:
+            # no range given: the whole score is the snippet
+            start_measure = self.index.numbers[0] if self.index.numbers else 1
+            end_measure = self.index.numbers[-1] if self.index.numbers else 1
         print("start_measure:", start_measure)
         print("end_measure:", end_measure)
-      
-        #generate global_info
-        k = score.analyze('key')
-        t = score.recurse().getElementsByClass(meter.TimeSignature)[0]
-        bpm = score.metronomeMarkBoundaries()[0][2].number if score.metronomeMarkBoundaries() else None
-
-        global_info = {
-            "key": str(k),
-            "time_signature": str(t.ratioString),
-            "tempo": bpm
-        }
-
-        print(global_info)
-  
-        full_prompt = build_prompt(prompt, global_info, snippet_xml)
-        #print("full prompt:", full_prompt)  # send this string to LLaMA
-        
-        raw_json = call_llama3_with_prompt(full_prompt)
-        print("raw_json",raw_json)
-        candidates = extract_candidates(raw_json)
-        
-        print("candidate 0:", candidates[0])
-        if len(candidates) == 2:
-            print("candidate 1:", candidates[1]) 
-
-        option1 = apply_llama_plan_to_musicxml(candidates[0],snippet_xml,"1")
-        if len(candidates) == 2:
-            option2 = apply_llama_plan_to_musicxml(candidates[1],snippet_xml,"2")
-        else: option2 = ""
-
-        return jsonify({"options": [option1, option2]})
 
+        global_info = self.global_info
+        with metrics.span("snippet"):
+            if self.snippet_format == "digest":
+                snippet = score_digest(self.score, self.prompt_range, self.index)
+            elif self.prompt_range:
+                snippet = musicxml_to_string(self.score.measures(start_measure, end_measure))
+            else:
+                snippet = self.xml
+        with metrics.span("build_prompt"):
+            return build_prompt(self.prompt, global_info, snippet, self.snippet_format)
+
+    def sections(self):
+        """The sections (score_sections.plan_sections) a long prompt is sent in, or None for one prompt"""
+        numbers = self.index.numbers
+        if self.prompt_range:
+            start, end = self.prompt_range
+            numbers = [n for n in numbers if start <= n <= end]
+        if self.use_sections is None:
+            wanted = 0 < score_sections.CHUNK_MIN_MEASURES <= len(numbers)
+        else:
+            wanted = bool(self.use_sections)
+        if not wanted or len(numbers) <= score_sections.CHUNK_MEASURES:
+            return None
+        return score_sections.plan_sections(numbers, ends=score_sections.section_ends(self.score))
+
+    def section_prompt(self, number, sections):
+        """The prompt for sections[number]: the instruction, global info and the section's measures in context"""
+        first, last, context_first, context_last = sections[number]
+        global_info = self.global_info
+        analysis = self.analysis
+        if analysis is not None:
+            global_info = dict(global_info, section_key=str(analysis.key(first, last)))
+        with metrics.span("snippet"):
+            if self.snippet_format == "digest":
+                snippet = score_digest(self.score, (context_first, context_last), self.index)
+            else:
+                snippet = musicxml_to_string(self.score.measures(context_first, context_last))
+        instruction = score_sections.section_instruction(self.prompt, number + 1, len(sections), first, last)
+        with metrics.span("build_prompt"):
+            return build_prompt(instruction, global_info, snippet, self.snippet_format)
+
+
+def call_sections(req, sections):
+    """
+    Send every section's prompt to the model, at most CHUNK_CONCURRENCY at a time, and merge the answers
+    into full-score candidates; returns their JSON (None if no section got an answer) and the [first, last]
+    measures of the sections that got none. Prompts are built here one after another (music21 is not shared
+    between threads) while earlier sections are with the model.
+    """
+    workers = max(1, min(score_sections.CHUNK_CONCURRENCY, len(sections)))
+    with metrics.span("sections"), concurrent.futures.ThreadPoolExecutor(workers, "section") as pool:
+        futures = [
+            # in the request's context, so the section's spans go into its trace
+            pool.submit(contextvars.copy_context().run, call_llama3_with_prompt, req.section_prompt(i, sections),
+                        snippet_format=req.snippet_format)
+            for i in range(len(sections))
+        ]
+        results = [extract_candidates(f.result()) for f in futures]
+    failed = [[first, last] for (first, last, _, _), r in zip(sections, results) if not r]
+    print(f"sections: {len(sections)}, answered: {len(sections) - len(failed)}")
+    merged = score_sections.merge_sections(sections, results)
+    return (json.dumps({"candidates": merged}) if merged else None), failed
+
+
+def rule_candidates(req):
+    """Candidates from the intent parser for mechanical prompts, else None"""
+    if not INTENT_RULES or req.fresh:
+        return None
+    return intent_parser.parse_intent(req.prompt, lambda: req.global_info)
+
+
+def resolve_candidates(req):
+    """
+    The request's candidates, where they came from (rules, cache or llm) and the [first, last] measures of
+    the sections the model didn't answer. An answer with a missing section is not cached.
+    """
+    with metrics.span("rules"):
+        candidates = rule_candidates(req)
+    if candidates:
+        return candidates, "rules", []
+
+    # a sectioned answer is cached apart from a whole-score one, and from one cut into other sections
+    sections = req.sections()
+    key = result_cache.prompt_key(req.score_entry.key, req.prompt, sections)
+    raw_json = None if req.fresh else prompt_results.get(key)
+    source, failed = "cache", []
+    if raw_json is None:
+        if sections:
+            raw_json, failed = call_sections(req, sections)
+        else:
+            raw_json = call_llama3_with_prompt(req.full_prompt(), snippet_format=req.snippet_format)
+        source = "llm"
+        if extract_candidates(raw_json) and not failed:
+            prompt_results.put(key, raw_json)
+    print("raw_json",raw_json)
+    return extract_candidates(raw_json), source, failed
+
+
+def cached_analysis(score_entry, score):
+    if not score_analysis.available():
+        return None
+    analysis = score_entry.derived.get("analysis")
+    if analysis is None:
+        analysis = score_analysis.ScoreAnalysis(score)
+        score_entry.derived["analysis"] = analysis
+    return analysis
+
+
+def analyze_global_info(score):
+    """Global info straight from music21, when the analysis index is unavailable"""
+    k = score.analyze('key')
+    t = score.recurse().getElementsByClass(meter.TimeSignature)[0]
+    bpm = score.metronomeMarkBoundaries()[0][2].number if score.metronomeMarkBoundaries() else None
+    return {
+        "key": str(k),
+        "time_signature": str(t.ratioString),
+        "tempo": bpm
+    }
+
+
+def resolve_mode_tonic(candidate, req):
+    """
+    A change_mode plan that names only the mode ("to": "minor") keeps the key of its target measures; work that
+    key out here from the cached analysis so the worker doesn't analyze the measures again
+    """
+    if not isinstance(candidate, dict):
+        return
+    for plan in score_sections.section_plans(candidate):
+        if str(plan.get("action", "")).replace(" ", "") != "change_mode":
+            continue
+        params = plan.get("params")
+        if not isinstance(params, dict) or " " in str(params.get("to", "major")).strip():
+            continue
+        analysis = req.analysis
+        if analysis is None:
+            return
+        target = plan.get("target") if isinstance(plan.get("target"), dict) else {}
+        scope = req.index.scope(target.get("measures"))
+        if scope == NO_MEASURES:
+            continue
+        found = analysis.key(*scope) if scope else analysis.key()
+        if found is not None:
+            params["to"] = f"{found.tonic.name} {str(params.get('to', 'major')).strip().lower()}"
+
+
+def target_candidate(candidate, prompt_range):
+    """Candidates without their own target edit the measures named in the prompt"""
+    if (prompt_range and isinstance(candidate, dict) and "sections" not in candidate
+            and not (candidate.get("target") or {}).get("measures")):
+        start_measure, end_measure = prompt_range
+        candidate["target"] = dict(candidate.get("target") or {}, measures=list(range(start_measure, end_measure + 1)))
+
+
+def stream_options(req):
+    """
+    Events for the streaming endpoint. Candidates are parsed out of the LLM stream as they complete and
+    materialized right away (fast path inline, otherwise in the candidate pool), so option 1 can be ready
+    before the model has finished writing option 2.
+    """
+    parser = CandidateStreamParser()
+    pending = {}  # Future -> (candidate index, candidate)
+    failed = False
+    failed_sections = []
+
+    def done_event(f):
+        i, c = pending.pop(f)
+        option = candidate_pool.result(f, 0, f"Candidate {i + 1}")
+        remember_option(score_entry, c, str(i + 1), option)
+        return {"type": "option", "index": i, "xml": option}
+
+    xml, score_entry, prompt_range = req.xml, req.score_entry, req.prompt_range
+    with metrics.span("rules"):
+        rules = rule_candidates(req)
+    sections = None if rules else req.sections()
+    key = result_cache.prompt_key(score_entry.key, req.prompt, sections)
+    cached = None if rules or req.fresh else prompt_results.get(key)
+    if rules:
+        source, pieces = "rules", [json.dumps({"candidates": rules})]
+    elif cached is not None:
+        source, pieces = "cache", [cached]
+    else:
+        source, pieces = "llm", None
+    yield {"type": "meta", "source": source}
+
+    try:
+        if pieces is None:
+            if sections:
+                # the section answers are merged before any candidate is complete, so they arrive together
+                raw_json, failed_sections = call_sections(req, sections)
+                pieces = [raw_json or ""]
+            else:
+                pieces = stream_llama3_with_prompt(req.full_prompt(), snippet_format=req.snippet_format)
+        for piece in pieces:
+            found = parser.feed(piece)
+            for i, c in enumerate(found, parser.count - len(found)):
+                target_candidate(c, prompt_range)
+                resolve_mode_tonic(c, req)
+                option = cached_option(score_entry, c, str(i + 1))
+                if option is None:
+                    option = rewrite_candidate(c, xml, str(i + 1))
+                    remember_option(score_entry, c, str(i + 1), option)
+                if option is not None:
+                    yield {"type": "option", "index": i, "xml": option}
+                else:
+                    pending[candidate_pool.submit(apply_llama_plan_to_score, score_entry, c, str(i + 1))] = (i, c)
+            for f in [f for f in pending if f.done()]:
+                yield done_event(f)
     except Exception as e:
-        print("Error:", e)
-        logging.error("Failed to parse XML:\n%s", traceback.format_exc())
-        return jsonify({"error": str(e)}), 500
+        print(" Errors happened:", e)
+        logging.error("LLM stream failed:\n%s", traceback.format_exc())
+        yield {"type": "error", "error": str(e)}
+        failed = True
+
+    if parser.count == 0 and not failed:
+        print("output:", parser.text)
+        yield {"type": "error", "error": "No candidates returned by the model"}
+    elif parser.count and not failed and not failed_sections and source == "llm":
+        prompt_results.put(key, parser.text)
+
+    try:
+        for f in concurrent.futures.as_completed(list(pending), timeout=candidate_pool.timeout):
+            yield done_event(f)
+    except concurrent.futures.TimeoutError:
+        for f, (i, _) in pending.items():
+            logging.error("Candidate %d timed out", i + 1)
+            candidate_pool.abandon(f)
+            yield {"type": "option", "index": i, "xml": ""}
+
+    done = {"type": "done", "count": parser.count}
+    if failed_sections:
+        done["failed_sections"] = failed_sections
+    yield done
 
 
 @app.route("/", methods=["GET"])
 def home():
     return "Flask backend with Llama3 is running."
 
+@app.route("/api/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify({
+        "scores": score_cache.stats(),
+        "results": plan_results.stats(),
+        "prompts": prompt_results.stats(),
+        "in_flight": in_flight.stats(),
+        "sessions": sessions.stats(),
+    })
+
+@app.route("/api/llm/stats", methods=["GET"])
+def llm_stats():
+    client = llm_client.default_client()
+    if isinstance(client, llm_router.LLMRouter):
+        return jsonify(client.stats())
+    return jsonify({"backends": [{"url": client.base_url}]})
+
+# "music21" applies actions note by note; "numpy" uses the note-table engine where it has one
+ACTION_ENGINE = os.environ.get("ACTION_ENGINE", "music21")
+
+def use_note_table():
+    return ACTION_ENGINE == "numpy" and note_table.available()
+
+# mechanical prompts ("transpose up 2 semitones") are turned into plans without asking the model
+INTENT_RULES = os.environ.get("INTENT_RULES", "1") != "0"
+
+# how the score goes into the LLM prompt: "xml" (MusicXML snippet) or "digest" (score_digest);
+# a request can pick one with "snippet_format"
+SNIPPET_FORMATS = ("xml", "digest")
+SNIPPET_FORMAT = os.environ.get("SNIPPET_FORMAT", "xml")
+
+# plans made only of pitch/tempo/articulation/dynamics edits are rewritten straight in the XML
+XML_FAST_PATH = os.environ.get("XML_FAST_PATH", "1") != "0"
+
+# parsed scores, shared by the request handler and every candidate pipeline
+score_cache = ScoreCache(parse_musicxml_string)
+# edit sessions hold their current score (and its parse, through the score cache) between prompts
+sessions = edit_session.SessionStore(score_cache.entry)
+# worker processes that apply candidate plans in parallel
+candidate_pool = CandidatePool()
+# (score, plan) -> MusicXML and (score, prompt) -> candidates JSON, for repeated requests
+plan_results = result_cache.plan_cache()
+prompt_results = result_cache.prompt_cache()
+
+# with several replicas in LLM_BASE_URLS, LLM calls go through the least-loaded healthy one
+llm_backends = llm_router.router_from_env()
+if llm_backends is not None:
+    llm_client.set_default_client(llm_backends)
+
+# send every response's stage timings back in a Server-Timing header
+TIMING_HEADER = os.environ.get("TIMING_HEADER", "0") == "1"
+
+# "full": every option as a whole MusicXML document; "delta": only the measures each option changes,
+# keyed by part id and measure number and written in the divisions of the XML that was sent (so they patch
+# straight into it), plus "base", that XML's score_hash. A request can pick one with "response"
+RESPONSE_FORMATS = ("full", "delta")
+RESPONSE_FORMAT = os.environ.get("RESPONSE_FORMAT", "full")
+
+# responses at least this big are compressed (0 turns compression off)
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", 1024))
+COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", 6))
+
+# identical /api/llama3 requests in flight at the same time share one computation
+COALESCE_REQUESTS = os.environ.get("COALESCE_REQUESTS", "1") != "0"
+in_flight = SingleFlight()
+
+# separate caps on requests waiting for the model and on in-process music21 work (parsing, materializing)
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", 8))
+CPU_CONCURRENCY = int(os.environ.get("CPU_CONCURRENCY", os.cpu_count() or 1))
+llm_slots = threading.BoundedSemaphore(LLM_CONCURRENCY)
+cpu_slots = threading.BoundedSemaphore(CPU_CONCURRENCY)
+# items of one /api/llama3/batch request in progress at a time, and the most items a batch may have
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", LLM_CONCURRENCY))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 1000))
+# background /api/jobs requests; GET ?wait= is capped so a poll can't hold a thread forever
+jobs = job_queue.JobQueue(run_job)
+JOB_MAX_WAIT = float(os.environ.get("JOB_MAX_WAIT", 30))
+
 def musicxml_to_string(score):
     """Export music21's score object as a MusicXML string"""
-    with tempfile.NamedTemporaryFile(mode="r+", suffix=".xml", delete=False, encoding="utf-8") as tmp:
-        score.write('musicxml', fp=tmp.name)
-        tmp.seek(0)
-        return tmp.read()
+    return score_to_musicxml(score)
 
 def fix_steps(xml_str):
     xml_str = re.sub(r"<step>([A-G])b</step>", r"<step>\1</step><alter>-1</alter>", xml_str)
@@ -119,17 +942,12 @@ def generateGlobalInfo(musicXml: str, prompt: str) -> str:
         str: The updated MusicXML string.
     """
     try:
-        score = converter.parse(StringIO(musicXml), format='musicxml')
-
-        k = score.analyze('key')
-        t = score.recurse().getElementsByClass(meter.TimeSignature)[0]
-        bpm = score.metronomeMarkBoundaries()[0][2].number if score.metronomeMarkBoundaries() else None
+        score = parse_musicxml_string(musicXml)
 
-        global_info = {
-            "key": str(k),
-            "time_signature": str(t.ratioString),
-            "tempo": bpm
-        }
+        if score_analysis.available():
+            global_info = score_analysis.ScoreAnalysis(score).global_info()
+        else:
+            global_info = analyze_global_info(score)
 
        
     except Exception as e:
@@ -141,29 +959,32 @@ def generateGlobalInfo(musicXml: str, prompt: str) -> str:
 # -------------------------------
 def transpose_notes(score, params):
     semitones = int(params.get("semitones", 2))
-    for n in score.recurse().notes:
-        if isinstance(n, (note.Note, chord.Chord)):
-            n.transpose(semitones, inPlace=True)
+    if use_note_table():
+        note_table.transpose(score, semitones)
+        return
+    plan_compiler.run_fused(score, [transpose_op(score, params)])
 
 def change_tempo(score, params):
-    from music21 import tempo
     ratio = float(params.get("ratio", 1.0))
 
-    for t in score.recurse().getElementsByClass(tempo.MetronomeMark):
-        t.activeSite.remove(t)
+    # scale the first tempo of the edited range, else the one in force before it
+    marks = list(score.recurse().getElementsByClass(tempo.MetronomeMark))
+    if marks:
+        base_mark = marks[0]
+    else:
+        first = score.recurse().getElementsByClass(stream.Measure).first()
+        base_mark = first.getContextByClass(tempo.MetronomeMark) if first is not None else None
+    # marks read from a bare <sound tempo> are playback-only and carry numberSounding instead
+    base_bpm = (base_mark.number or base_mark.numberSounding or 120) if base_mark is not None else 120
 
-    base_bpm = 120
-    if hasattr(score, 'metronomeMarkBoundaries'):
-        try:
-            base_bpm = list(score.metronomeMarkBoundaries()[0][2].number)
-        except:
-            pass
+    for t in marks:
+        t.activeSite.remove(t)
     new_bpm = int(base_bpm * ratio)
 
     mm = tempo.MetronomeMark(number=new_bpm)
 
     for part in score.parts:
-        m1 = part.measure(1)
+        m1 = part.getElementsByClass(stream.Measure).first()
         if m1 is not None:
             m1.insert(0, mm)
         else:
@@ -175,12 +996,17 @@ def change_tempo(score, params):
 
 def adjust_rhythm(score, params):
     scale = float(params.get("scale", 1.0))
-    for n in score.recurse().notesAndRests:
-        n.quarterLength *= scale
+    if use_note_table():
+        note_table.scale_rhythm(score, scale)
+        return
+    plan_compiler.run_fused(score, [adjust_rhythm_op(score, params)])
 
 def modify_dynamics(score, params):
     change = int(params.get("dynamics_shift", 0))  # -1, -2, +1 等
     dynamic_levels = ['pp', 'p', 'mp', 'mf', 'f', 'ff']
+    if use_note_table():
+        note_table.shift_dynamics(score, change)
+        return
 
     for part in score.parts:
         measures = list(part.getElementsByClass(stream.Measure))
@@ -201,15 +1027,10 @@ def modify_dynamics(score, params):
             m.insert(0, dynamics.Dynamic(new_dyn))
 
 def add_articulation(score, params):
-    from music21 import articulations
-    style = params.get("style", "staccato")
-    for n in score.recurse().notes:
-        if style == "staccato":
-            n.articulations.append(articulations.Staccato())
-        elif style == "accent":
-            n.articulations.append(articulations.Accent())
+    plan_compiler.run_fused(score, [add_articulation_op(score, params)])
 
-def change_mode(score, params):
+def resolve_mode_change(score, params):
+    """The Key a change_mode switches to and the semitone shift it applies to the notes"""
     from_mode = params.get("from", "major").lower()
     to_mode_str = params.get("to", "major").lower()
 
@@ -219,7 +1040,10 @@ def change_mode(score, params):
         mode = mode_str.lower()
     else:
         mode = to_mode_str
-        original_key = score.analyze('key')
+        if score_analysis.available():
+            original_key = score_analysis.ScoreAnalysis(score).key()
+        else:
+            original_key = score.analyze('key')
         tonic = original_key.tonic.name.upper() if original_key else "C"
 
     if mode not in ['major','minor']:
@@ -232,50 +1056,46 @@ def change_mode(score, params):
         semitone_shift = -3
     elif from_mode == "minor" and mode == "major":
         semitone_shift = 3
+    return to_key, semitone_shift
 
-    if semitone_shift != 0:
-        for n in score.recurse().notes:
-            if isinstance(n, note.Note):
-                n.transpose(semitone_shift, inPlace=True)
-                n.accidental = n.pitch.accidental
-            elif isinstance(n, chord.Chord):
-                n.transpose(semitone_shift, inPlace=True)
-                for nn in n.notes:
-                    nn.accidental = nn.pitch.accidental
-
+def insert_key(score, to_key):
     for part in score.parts:
-        m1 = part.measure(1)
+        m1 = part.getElementsByClass(stream.Measure).first()
         if m1:
             m1.insert(0, to_key)
 
+def change_mode(score, params):
+    if use_note_table():
+        to_key, semitone_shift = resolve_mode_change(score, params)
+        if semitone_shift != 0:
+            note_table.transpose(score, semitone_shift)
+        insert_key(score, to_key)
+        return
+    plan_compiler.run_fused(score, [change_mode_op(score, params)])
+
 def add_chord_tone(score, params):
-    from music21 import interval
     interval_str = params.get("interval", "M3")
     i = interval.Interval(interval_str)
-    for part in score.parts:
-        new_part = stream.Part()
-        for n in part.notesAndRests:
-            if isinstance(n, note.Note):
-                new_note = i.transposeNote(n)
-                new_part.append(chord.Chord([n, new_note]))
-            else:
-                new_part.append(n)
-        score.replace(part, new_part)
+    # replace each note inside its own measure so the measure structure survives
+    for n in list(score.recurse().getElementsByClass(note.Note)):
+        site = n.activeSite
+        new_note = i.transposeNote(n)
+        site.replace(n, chord.Chord([n, new_note], quarterLength=n.quarterLength))
 
 def repeat_segment(score, params):
     times = int(params.get("times", 2))
     new_score = stream.Score()
     for part in score.parts:
         measures = list(part.getElementsByClass(stream.Measure))
-        repeated = measures * times
-        new_part = stream.Part()
-        for m in repeated:
-            new_part.append(m)
-        new_score.append(new_part)
+        new_part = stream.Part(id=part.id)
+        for i in range(times):
+            # a stream can hold an object only once, so repeats are copies
+            for m in measures:
+                new_part.append(m if i == 0 else copy.deepcopy(m))
+        new_score.insert(0, new_part)
     return new_score
 
 def add_seventh_chords(score, params):
-    from music21 import interval
     chord_type = params.get("chord_type", "major seventh")
     chord_intervals = {
         "major seventh": ["P1", "M3", "P5", "M7"],
@@ -285,19 +1105,64 @@ def add_seventh_chords(score, params):
         "diminished seventh": ["P1", "m3", "d5", "d7"],
     }
     intervals = chord_intervals.get(chord_type, ["P1","M3","P5","M7"])
-    for part in score.parts:
-        new_part = stream.Part()
-        for n in part.notes:
-            if isinstance(n, note.Note):
-                notes_for_chord = []
-                root = n
-                for iv in intervals:
-                    new_note = interval.Interval(iv).transposeNote(root)
-                    notes_for_chord.append(new_note)
-                new_part.append(chord.Chord(notes_for_chord, quarterLength=n.quarterLength))
-            else:
-                new_part.append(n)
-        score.replace(part, new_part)
+    # replace each note inside its own measure so the measure structure survives
+    for n in list(score.recurse().getElementsByClass(note.Note)):
+        site = n.activeSite
+        notes_for_chord = []
+        root = n
+        for iv in intervals:
+            new_note = interval.Interval(iv).transposeNote(root)
+            notes_for_chord.append(new_note)
+        site.replace(n, chord.Chord(notes_for_chord, quarterLength=n.quarterLength))
+
+# -------------------------------
+# Per-note operations
+# -------------------------------
+# Each returns (op, after): op(n) edits one note, chord or rest (None if there is
+# nothing to do per note) and after() runs once the pass is over (or None).
+# plan_compiler fuses the ops of several actions into one walk over the notes.
+def transpose_op(score, params):
+    semitones = int(params.get("semitones", 2))
+    def op(n):
+        if isinstance(n, (note.Note, chord.Chord)):
+            n.transpose(semitones, inPlace=True)
+    return op, None
+
+def adjust_rhythm_op(score, params):
+    scale = float(params.get("scale", 1.0))
+    def op(n):
+        n.quarterLength *= scale
+    return op, None
+
+def add_articulation_op(score, params):
+    style = params.get("style", "staccato")
+    if style not in ("staccato", "accent"):
+        return None, None
+    mark = articulations.Staccato if style == "staccato" else articulations.Accent
+    def op(n):
+        if isinstance(n, note.NotRest):
+            n.articulations.append(mark())
+    return op, None
+
+def change_mode_op(score, params):
+    to_key, semitone_shift = resolve_mode_change(score, params)
+    def op(n):
+        # transpose, then make the accidentals explicit
+        if isinstance(n, note.Note):
+            n.transpose(semitone_shift, inPlace=True)
+            n.accidental = n.pitch.accidental
+        elif isinstance(n, chord.Chord):
+            n.transpose(semitone_shift, inPlace=True)
+            for nn in n.notes:
+                nn.accidental = nn.pitch.accidental
+    return (op if semitone_shift != 0 else None), (lambda: insert_key(score, to_key))
+
+NOTE_OPS = {
+    "transpose": transpose_op,
+    "adjust_rhythm": adjust_rhythm_op,
+    "add_articulation": add_articulation_op,
+    "change_mode": change_mode_op,
+}
 
 # -------------------------------
 # Dispatcher
@@ -317,42 +1182,94 @@ ACTIONS = {
 # ------------------------------------------------------------------------------------
 # Call music21 API to apply actions to the original musicxml and generate new musicxml
 # ------------------------------------------------------------------------------------
+def plan_actions(plan):
+    """(action, params) pairs of a candidate: the main action, then the secondary actions"""
+    yield plan["action"].replace(" ",""), plan.get("params", {})
+    for sec in plan.get("secondary_actions", []):
+        yield sec.get("action"), sec.get("params", {})
+
+def rewrite_candidate(llama_json, input_musicxml_str, option_number="0"):
+    """Fast path: apply a simple plan directly to the MusicXML. Returns None when music21 is needed."""
+    if not XML_FAST_PATH:
+        return None
+    try:
+        plan = json.loads(llama_json) if isinstance(llama_json, str) else llama_json
+        if not isinstance(plan, dict) or ("action" not in plan and "sections" not in plan):
+            return None
+        sections = [
+            (list(plan_actions(p)), (p.get("target") if isinstance(p.get("target"), dict) else {}).get("measures"))
+            for p in score_sections.section_plans(plan)
+        ]
+        with metrics.span("rewrite"):
+            return xml_rewriter.rewrite_sections(
+                input_musicxml_str, sections, title=f"Modified Melody - Option {option_number}"
+            )
+    except Exception:
+        logging.error("XML fast path failed, falling back to music21:\n%s", traceback.format_exc())
+        return None
+
+def cached_option(score_entry, candidate, option_number):
+    """MusicXML this score and plan produced before, or None"""
+    if not isinstance(candidate, dict):
+        return None
+    return plan_results.get(result_cache.plan_key(score_entry.key, candidate, option_number, engine_flags()))
+
+def remember_option(score_entry, candidate, option_number, option):
+    if option and isinstance(candidate, dict):
+        plan_results.put(result_cache.plan_key(score_entry.key, candidate, option_number, engine_flags()), option)
+
+def engine_flags():
+    """The settings that decide how a plan is turned into MusicXML, for the plan cache key"""
+    return f"engine={'numpy' if use_note_table() else 'music21'},fast_path={int(XML_FAST_PATH)}"
+
+def materialize_candidates(input_musicxml_str, score_entry, candidates):
+    """
+    MusicXML for every candidate: plans seen before come from the result cache, simple plans are rewritten
+    directly, the rest are built in the process pool
+    """
+    options = [cached_option(score_entry, c, str(i + 1)) for i, c in enumerate(candidates)]
+    for i, c in enumerate(candidates):
+        if options[i] is None:
+            options[i] = rewrite_candidate(c, input_musicxml_str, str(i + 1))
+            remember_option(score_entry, c, str(i + 1), options[i])
+    slow = [i for i, o in enumerate(options) if o is None]
+    if slow:
+        with metrics.span("materialize"):
+            results = candidate_pool.materialize(
+                apply_llama_plan_to_score, score_entry, [candidates[i] for i in slow],
+                option_numbers=[str(i + 1) for i in slow],
+            )
+        for i, result in zip(slow, results):
+            options[i] = result
+            remember_option(score_entry, candidates[i], str(i + 1), result)
+    return options
+
 def apply_llama_plan_to_musicxml(llama_json, input_musicxml_str, option_number="0"):
+    fast = rewrite_candidate(llama_json, input_musicxml_str, option_number)
+    if fast is not None:
+        return fast
+    try:
+        score = score_cache.get_score(input_musicxml_str)
+    except Exception as e:
+        print(f"Error applying plan: {e}")
+        logging.error("Error applying plan:\n%s", traceback.format_exc())
+        return ""
+    return apply_llama_plan_to_score(llama_json, score, option_number)
+
+def apply_llama_plan_to_score(llama_json, score, option_number="0"):
+    """Apply a candidate plan to a parsed score (modified in place) and return the MusicXML string"""
     try:
         plan = json.loads(llama_json) if isinstance(llama_json, str) else llama_json
-        if not isinstance(plan, dict) or "action" not in plan:
+        if not isinstance(plan, dict) or ("action" not in plan and "sections" not in plan):
             print("Invalid candidate JSON")
             return ""
-        
-        with tempfile.NamedTemporaryFile(mode="w+", suffix=".xml", delete=False, encoding="utf-8") as in_tmp:
-            in_tmp.write(input_musicxml_str)
-            in_tmp.flush()
-            in_tmp_path = in_tmp.name
-
-        score = converter.parse(in_tmp_path)
-        score.metadata = metadata.Metadata(title=f"Modified Melody - Option {option_number}")
-
-        # Apply main action
-        main_action = plan["action"].replace(" ","")
-        main_params = plan.get("params", {})
-        if main_action in ACTIONS:
-            ACTIONS[main_action](score, main_params)
-
-        # Apply secondary actions
-        for sec in plan.get("secondary_actions", []):
-            sec_action = sec.get("action")
-            sec_params = sec.get("params", {})
-            if sec_action in ACTIONS:
-                result = ACTIONS[sec_action](score, sec_params)
-                if isinstance(result, stream.Score):
-                    score = result  
 
-        with tempfile.NamedTemporaryFile(mode="r+", suffix=".xml", delete=False, encoding="utf-8") as out_tmp:
-            score.write("musicxml", fp=out_tmp.name)
-            out_tmp.seek(0)
-            modified_xml = out_tmp.read()
+        for section in score_sections.section_plans(plan):
+            score = apply_plan(score, section, option_number)
 
-        return modified_xml
+        score.metadata = metadata.Metadata(title=f"Modified Melody - Option {option_number}")
+        with metrics.span("export"):
+            return musicxml_to_string(score)
 
     except Exception as e:
         print(f"Error applying plan: {e}")
@@ -360,6 +1277,49 @@ def apply_llama_plan_to_musicxml(llama_json, input_musicxml_str, option_number="
         return ""
 
 
+def apply_plan(score, plan, option_number="0"):
+    """Apply one single-action plan (action, params, secondary actions, target) to a score; returns the score"""
+    # Only the target measures are handed to the actions
+    index = MeasureIndex(score)
+    target = plan.get("target") if isinstance(plan.get("target"), dict) else {}
+    scope = index.scope(target.get("measures"))
+    if scope == NO_MEASURES:
+        logging.warning("Option %s: target measures %s are not in the score; skipped", option_number,
+                        target.get("measures"))
+        return score
+    # a tempo or key change inside the range mustn't carry on past it
+    context = (index.context_after(scope[1])
+               if scope and any(a in ("change_tempo", "change_mode") for a, _ in plan_actions(plan)) else None)
+    working = index.view(*scope) if scope else score
+
+    if use_note_table():
+        # the note-table engine works a whole action at a time
+        for action, params in plan_actions(plan):
+            if action in ACTIONS:
+                t0 = time.perf_counter()
+                result = ACTIONS[action](working, params)
+                metrics.record_action(action, time.perf_counter() - t0)
+                if isinstance(result, stream.Score):
+                    working = result
+    else:
+        # per-note actions share one walk over the notes, the rest follow
+        compiled = plan_compiler.compile_plan(plan_actions(plan), ACTIONS)
+        working = compiled.run(working, NOTE_OPS, ACTIONS)
+        logging.info("Option %s stages: %s", option_number, compiled.describe_timings())
+        (_, compile_seconds), *stages = compiled.timings
+        metrics.record_stage("compile", compile_seconds)
+        for label, seconds in stages:
+            metrics.record_action(label, seconds)
+
+    # Put the edited range back into the untouched full score
+    if scope:
+        index.splice(working, *scope)
+        if context:
+            index.restore_context(context)
+        return score
+    return working
+
+
 ACTIONS_LIST = [
     "transpose",
     "change_tempo",
@@ -373,16 +1333,16 @@ ACTIONS_LIST = [
 ]
 
 
-def build_prompt(user_instruction: str, global_info: dict, musicxml_snippet: str) -> str:
-    """
-    Build a single prompt string to send to LLaMA.
+# -------------------------------
+# Prompt
+# -------------------------------
+# The instructions and few-shot examples never change, so they are built once
+# here and sent as the system message. Every request then starts with the same
+# bytes, which lets a vLLM-style server reuse the cached prefix (KV cache) and
+# only prefill the per-request user message: instruction, global info, snippet.
 
-    user_instruction: e.g. "Make measures 1–4 more joyful"
-    global_info: e.g. {"key":"C major","time":"4/4","tempo":100}
-    musicxml_snippet: a valid <score-partwise>...</score-partwise> snippet (string)
-    """
-    # NOTE: be careful with quoting MusicXML when sending; we put it verbatim.
-    few_shot_examples = r'''
+# NOTE: be careful with quoting MusicXML when sending; we put it verbatim.
+FEW_SHOT_EXAMPLES = r'''
 # FEW-SHOT EXAMPLES (do NOT output these examples in final response; they are examples for the model)
 # Example 1: Deterministic transpose
 Instruction: "Transpose measures 5-8 up 2 semitones"
@@ -546,9 +1506,8 @@ Expected JSON (clarify):
 END FEW-SHOT
 '''
 
-    # The main system+instruction part
-    system_instructions = f'''
-You are an expert MusicXML editor and arranger. You will receive THREE pieces of input concatenated below:
+SYSTEM_INSTRUCTIONS = f'''
+You are an expert MusicXML editor and arranger. You will receive THREE pieces of input in the user message:
 1) A single-line Instruction describing the user's intent (e.g. "Make measures 1–4 more joyful").
 2) Global info in the format key=..., time=..., tempo=... (useful metadata).
 3) A MusicXML snippet (a valid <score-partwise>...</score-partwise>) representing the relevant score fragment.
@@ -594,23 +1553,46 @@ If the instruction is inherently ambiguous about which measures or what scope to
 RETURN the clarify JSON (only that) and stop.
 
 Below are several FEW-SHOT examples to follow exactly (do not output examples).
-{few_shot_examples}
+{FEW_SHOT_EXAMPLES}
+'''
 
+CLOSING_INSTRUCTIONS = '''
 Now produce the response for the following inputs.You must apply all of the following modifications to the piece. 
 Do not skip any:
 
 '''
 
+# one byte-stable system message per snippet format; they share everything up to the closing lines,
+# the digest one adds the legend before them
+SYSTEM_MESSAGES = {
+    "xml": SYSTEM_INSTRUCTIONS + CLOSING_INSTRUCTIONS,
+    "digest": SYSTEM_INSTRUCTIONS + "\n" + DIGEST_LEGEND + "\n" + CLOSING_INSTRUCTIONS,
+}
+
+
+def snippet_label(snippet_format):
+    if snippet_format == "digest":
+        return "\nScore digest (in place of the MusicXML snippet):\n"
+    return "\nMusicXML snippet:\n"
+
+def build_prompt(user_instruction: str, global_info: dict, musicxml_snippet: str, snippet_format: str = "xml") -> str:
+    """
+    Build the user message sent to LLaMA after the static system message (see llama3_messages).
+
+    user_instruction: e.g. "Make measures 1–4 more joyful"
+    global_info: e.g. {"key":"C major","time":"4/4","tempo":100}
+    musicxml_snippet: a valid <score-partwise>...</score-partwise> snippet (string), or a score digest
+    snippet_format: "xml" for a MusicXML snippet, "digest" for score_digest output
+    """
     # assemble the final prompt by appending the concrete user-supplied inputs
     gi_items = ", ".join([f"{k}={v}" for k, v in global_info.items()])
 
     final_prompt = (
-        system_instructions
-        + "\nInstruction: " + user_instruction.strip()
+        "Instruction: " + user_instruction.strip()
         + "Each modification must be included in your output. Partial modifications are not allowed." 
         + "Make sure the resulting piece reflects all from the Instruction."
         + "\nGlobal info: " + gi_items
-        + "\nMusicXML snippet:\n" + musicxml_snippet.strip()
+        + snippet_label(snippet_format) + musicxml_snippet.strip()
         + "Reminder: every \"action\" value — including those inside \"secondary_actions\""
         + " — must be strictly one of the nine allowed strings. Output will be rejected otherwise."
         + "Each candidate must have exactly three actions."
@@ -620,38 +1602,55 @@ Do not skip any:
     return final_prompt
 
 
-from openai import OpenAI
-import json
+def llama3_messages(full_prompt: str, snippet_format: str = "xml"):
+    return [
+        {"role": "system", "content": SYSTEM_MESSAGES.get(snippet_format, SYSTEM_MESSAGES["xml"])},
+        {"role": "user", "content": full_prompt}
+    ]
+
+def count_prompt(messages):
+    chars = sum(len(m["content"]) for m in messages)
+    metrics.PROMPT_CHARS_TOTAL.inc(chars)
+    metrics.PROMPT_TOKENS.observe(chars / 4)
 
-def call_llama3_with_prompt(full_prompt: str, base_url="http://192.168.1.99:8000/v1", api_key="sk-local", model="llama3"):
+def call_llama3_with_prompt(full_prompt: str, client=None, snippet_format: str = "xml"):
     """
     Calls a Llama3 model, returning a raw JSON string.
     Output: Json
     """
-    client = OpenAI(base_url=base_url, api_key=api_key)
-
-    messages = [
-        {
-            "role": "system",
-            "content": (
-                ""
-            )
-        },
-        {"role": "user", "content": full_prompt}
-    ]
+    client = client or llm_client.default_client()
 
+    messages = llama3_messages(full_prompt, snippet_format)
+    count_prompt(messages)
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            response_format={"type": "json_object"}  
-        )
-        raw_json = response.choices[0].message.content.strip()
-        return raw_json
+        with llm_slots, metrics.span("llm"):
+            raw_json = client.chat(messages, response_format={"type": "json_object"})
+        metrics.LLM_CALLS_TOTAL.inc(outcome="ok")
+        metrics.LLM_RESPONSE_CHARS_TOTAL.inc(len(raw_json or ""))
+        return raw_json.strip() if raw_json else None
     except Exception as e:
         print(" Errors happened:", e)
+        metrics.LLM_CALLS_TOTAL.inc(outcome="error")
         return None
 
+def stream_llama3_with_prompt(full_prompt: str, client=None, snippet_format: str = "xml"):
+    """
+    Like call_llama3_with_prompt, but yields the raw JSON piece by piece as the model writes it.
+    Errors are raised to the caller.
+    """
+    client = client or llm_client.default_client()
+    messages = llama3_messages(full_prompt, snippet_format)
+    count_prompt(messages)
+    outcome = "error"
+    try:
+        with llm_slots, metrics.span("llm"):  # the slot is held until the stream is read to the end or closed
+            for piece in client.stream_chat(messages, response_format={"type": "json_object"}):
+                metrics.LLM_RESPONSE_CHARS_TOTAL.inc(len(piece))
+                yield piece
+        outcome = "ok"
+    finally:
+        metrics.LLM_CALLS_TOTAL.inc(outcome=outcome)
+
 
 def extract_candidates(raw_json_str: str):
     if not raw_json_str:
@@ -675,6 +1674,8 @@ def extract_candidates(raw_json_str: str):
         return []
 
 
+# development server; production runs `python serve.py` (pre-forked, warmed workers)
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
+    candidate_pool.warm()
     app.run(host="0.0.0.0", port=port, debug=True)
@@ -0,0 +1,70 @@
+import threading
+
+
+# -------------------------------
+# Single-flight request coalescing
+# -------------------------------
+# When several identical requests arrive together (a class opening the same
+# score and clicking the same suggestion), the first one computes the answer
+# and the others wait for it instead of repeating the parse, the LLM call and
+# the music21 work. Only requests in flight at the same time are shared; the
+# result caches cover repeats that come later.
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """
+        fn() for the first caller with key; callers with the same key that arrive while it runs get its result
+        (or its exception) instead of calling fn themselves. Returns (result, shared).
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.leaders + self.coalesced
+            return {
+                "computed": self.leaders,
+                "coalesced": self.coalesced,
+                "coalesced_rate": (self.coalesced / total) if total else 0.0,
+                "in_flight": len(self._calls),
+            }
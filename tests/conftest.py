@@ -0,0 +1,97 @@
+import os
+import sys
+import warnings
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the modules live at the top of the repo; the stub LLM server is shared with the benchmarks
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from music21.musicxml.xmlObjects import MusicXMLWarning  # noqa: E402
+
+warnings.simplefilter("ignore", MusicXMLWarning)
+
+STEPS = ["C", "D", "E", "F", "G", "A", "B"]
+
+
+def make_score_xml(measures=8, parts=1, bpm=None, dynamic=None, fifths=0):
+    """
+    A small MusicXML document written the way the editor writes it (divisions 1, four quarter notes a
+    measure): every measure of every part climbs C D E F, G A B C, ... An optional metronome mark and
+    dynamic go in measure 1.
+    """
+    part_list = "".join(
+        f'<score-part id="P{p}"><part-name>Part {p}</part-name></score-part>' for p in range(1, parts + 1)
+    )
+    body = []
+    for p in range(1, parts + 1):
+        body.append(f'<part id="P{p}">')
+        for number in range(1, measures + 1):
+            body.append(f'<measure number="{number}">')
+            if number == 1:
+                body.append(
+                    f"<attributes><divisions>1</divisions><key><fifths>{fifths}</fifths></key>"
+                    "<time><beats>4</beats><beat-type>4</beat-type></time>"
+                    "<clef><sign>G</sign><line>2</line></clef></attributes>"
+                )
+                if bpm is not None and p == 1:
+                    body.append(
+                        '<direction placement="above"><direction-type><metronome><beat-unit>quarter</beat-unit>'
+                        f"<per-minute>{bpm}</per-minute></metronome></direction-type>"
+                        f'<sound tempo="{bpm}"/></direction>'
+                    )
+                if dynamic is not None:
+                    body.append(
+                        f'<direction placement="below"><direction-type><dynamics><{dynamic}/></dynamics>'
+                        "</direction-type></direction>"
+                    )
+            for beat in range(4):
+                step = (4 * (number - 1) + beat) % 7
+                octave = 4 + (4 * (number - 1) + beat) // 7 % 2
+                body.append(
+                    f"<note><pitch><step>{STEPS[step]}</step><octave>{octave}</octave></pitch>"
+                    "<duration>1</duration><type>quarter</type></note>"
+                )
+            body.append("</measure>")
+        body.append("</part>")
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?><score-partwise version="3.1">'
+        f"<part-list>{part_list}</part-list>{''.join(body)}</score-partwise>"
+    )
+
+
+@pytest.fixture
+def score_xml():
+    return make_score_xml
+
+
+@pytest.fixture
+def llm_stub(monkeypatch):
+    """
+    start(**options) runs a stub_llm_server and points the server's LLM calls at it; returns the stub's state.
+    The server's result caches start empty and candidates are built inline.
+    """
+    import llm_client
+    import server
+    from candidate_pool import CandidatePool
+    from stub_llm_server import start_stub
+
+    stubs = []
+    previous = llm_client.default_client()
+    monkeypatch.setattr(server, "candidate_pool", CandidatePool(workers=0))
+    server.plan_results.clear()
+    server.prompt_results.clear()
+
+    def start(**options):
+        stub, url = start_stub(**options)
+        stubs.append(stub)
+        llm_client.set_default_client(llm_client.LLMClient(base_url=url, backoff=0))
+        return stub.state
+
+    yield start
+    llm_client.set_default_client(previous)
+    for stub in stubs:
+        stub.shutdown()
+        stub.server_close()
@@ -0,0 +1,55 @@
+from music21 import key, stream, tempo
+
+import server
+from musicxml_io import parse_musicxml_string
+
+
+def pitches(score, part=0):
+    return [n.nameWithOctave for n in score.parts[part].recurse().notes]
+
+
+def test_target_outside_the_score_edits_nothing(score_xml):
+    score = parse_musicxml_string(score_xml(8))
+    before = pitches(score)
+    plan = {"action": "transpose", "params": {"semitones": 2}, "target": {"measures": [200, 210]}}
+    assert pitches(server.apply_plan(score, plan)) == before
+
+
+def test_target_edits_only_its_measures(score_xml):
+    score = parse_musicxml_string(score_xml(4))
+    before = pitches(score)
+    plan = {"action": "transpose", "params": {"semitones": 12}, "target": {"measures": [2, 3]}}
+    after = pitches(server.apply_plan(score, plan))
+    assert after[:4] == before[:4] and after[12:] == before[12:]
+    assert after[4] == "G5" and before[4] == "G4"
+
+
+def test_scoped_tempo_change_ends_with_the_range(score_xml):
+    score = parse_musicxml_string(score_xml(8, parts=2, bpm=100))
+    plan = {"action": "change_tempo", "params": {"ratio": 1.5}, "target": {"measures": [3, 4]}}
+    score = server.apply_plan(score, plan)
+    part = score.parts[0]
+    assert part.measure(2).getContextByClass(tempo.MetronomeMark).number == 100
+    assert part.measure(3).getElementsByClass(tempo.MetronomeMark).first().number == 150
+    assert part.measure(5).getElementsByClass(tempo.MetronomeMark).first().number == 100
+    assert part.measure(8).getContextByClass(tempo.MetronomeMark).number == 100
+
+
+def test_scoped_mode_change_ends_with_the_range(score_xml):
+    score = parse_musicxml_string(score_xml(8))
+    plan = {"action": "change_mode", "params": {"from": "major", "to": "c minor"}, "target": {"measures": [3, 4]}}
+    score = server.apply_plan(score, plan)
+    part = score.parts[0]
+    assert isinstance(part.measure(3).keySignature, key.Key) and part.measure(3).keySignature.mode == "minor"
+    assert part.measure(5).keySignature.sharps == 0
+    assert part.measure(7).getContextByClass(key.KeySignature).sharps == 0
+
+
+def test_repeat_segment_in_a_range_renumbers_what_follows(score_xml):
+    score = parse_musicxml_string(score_xml(4))
+    last = pitches(score)[-4:]
+    plan = {"action": "repeat_segment", "params": {"times": 2}, "target": {"measures": [2, 2]}}
+    score = server.apply_plan(score, plan)
+    measures = list(score.parts[0].getElementsByClass(stream.Measure))
+    assert [m.number for m in measures] == [1, 2, 3, 4, 5]
+    assert pitches(score)[-4:] == last
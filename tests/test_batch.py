@@ -0,0 +1,131 @@
+import json
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def client():
+    server.sessions.clear()
+    return server.app.test_client()
+
+
+def events(response):
+    assert response.status_code == 200 and response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[-1]["type"] == "done"
+    return sorted(lines[:-1], key=lambda e: e["index"]), lines[-1]
+
+
+def test_one_score_many_prompts(client, llm_stub, score_xml):
+    stub = llm_stub()
+    response = client.post("/api/llama3/batch", json={
+        "xml": score_xml(4), "prompts": ["brighten it", "darken it", "brighten it"], "response": "delta",
+    })
+    results, done = events(response)
+    assert [e["type"] for e in results] == ["result"] * 3
+    assert all("deltas" in e and "base" in e for e in results)
+    assert (done["count"], done["errors"]) == (3, 0)
+    assert stub.requests == 2  # the repeated prompt is answered once
+    assert results[0]["deltas"] == results[2]["deltas"]
+
+
+def test_items_name_shared_scores(client, llm_stub, score_xml, monkeypatch):
+    llm_stub()
+    parsed = []
+    entry = server.score_cache.entry
+    monkeypatch.setattr(server.score_cache, "entry", lambda xml: parsed.append(xml) or entry(xml))
+    response = client.post("/api/llama3/batch", json={
+        "scores": {"s1": score_xml(4), "s2": score_xml(6)},
+        "items": [
+            {"id": "a", "score": "s1", "prompt": "brighten it"},
+            {"id": "b", "score": "s1", "prompt": "darken it"},
+            {"id": "c", "score": "s2", "prompt": "brighten it"},
+        ],
+    })
+    results, done = events(response)
+    assert [(e["id"], e["type"]) for e in results] == [("a", "result"), ("b", "result"), ("c", "result")]
+    assert all(len(e["options"]) == 2 for e in results)
+    assert len(parsed) == 2  # once per distinct score
+
+
+def test_identical_items_are_answered_once_unless_fresh(client, llm_stub, score_xml):
+    stub = llm_stub()
+    xml = score_xml(4)
+    item = {"xml": xml, "prompt": "brighten it"}
+    results, _ = events(client.post("/api/llama3/batch", json={"items": [item, dict(item), dict(item, id="x")]}))
+    assert len(results) == 3 and stub.requests == 1
+    assert results[2]["id"] == "x"
+
+    server.prompt_results.clear()
+    server.plan_results.clear()
+    fresh = dict(item, fresh=True)
+    results, _ = events(client.post("/api/llama3/batch", json={"items": [fresh, dict(fresh)]}))
+    assert len(results) == 2 and stub.requests == 3
+
+
+def test_items_that_differ_in_an_option_are_not_shared(client, llm_stub, score_xml):
+    llm_stub()
+    xml = score_xml(4)
+    results, _ = events(client.post("/api/llama3/batch", json={"items": [
+        {"xml": xml, "prompt": "brighten it"},
+        {"xml": xml, "prompt": "brighten it", "response": "delta"},
+    ]}))
+    assert "options" in results[0] and "deltas" in results[1]
+
+
+def test_a_bad_item_fails_alone(client, llm_stub, score_xml):
+    llm_stub()
+    response = client.post("/api/llama3/batch", json={
+        "scores": {"s1": score_xml(4)},
+        "items": [
+            {"id": "ok", "score": "s1", "prompt": "brighten it"},
+            {"id": "no-score", "score": "missing", "prompt": "brighten it"},
+            {"id": "no-xml", "prompt": "brighten it"},
+            {"id": "no-prompt", "score": "s1"},
+            {"id": "no-session", "session": "missing", "prompt": "brighten it"},
+            {"id": "bad-xml", "xml": "<score-partwise><part", "prompt": "brighten it"},
+            "not an object",
+        ],
+    })
+    results, done = events(response)
+    by_id = {e["id"]: e for e in results}
+    assert by_id["ok"]["type"] == "result"
+    assert [by_id[i]["status"] for i in ("no-score", "no-xml", "no-prompt", "no-session", "bad-xml")] == [
+        400, 400, 400, 404, 500]
+    assert by_id["no-score"]["error"] == "unknown score"
+    assert results[-1]["type"] == "error" and results[-1]["id"] is None
+    assert (done["count"], done["errors"]) == (7, 6)
+
+
+def test_a_failed_model_call_fails_only_its_items(client, llm_stub, score_xml):
+    llm_stub(fail_rate=1.0)
+    results, done = events(client.post("/api/llama3/batch", json={
+        "xml": score_xml(4), "prompts": ["brighten it", "make it louder"],
+    }))
+    # "make it louder" is answered by the intent rules without the model
+    assert [e["type"] for e in results] == ["error", "result"]
+    assert results[0]["status"] == 500 and done["errors"] == 1
+
+
+def test_session_items_are_checked_against_the_current_version(client, llm_stub, score_xml):
+    llm_stub()
+    sid = client.post("/api/sessions", json={"xml": score_xml(4)}).get_json()["session"]
+    results, _ = events(client.post("/api/llama3/batch", json={"items": [
+        {"session": sid, "version": 0, "prompt": "brighten it"},
+        {"session": sid, "version": 3, "prompt": "brighten it"},
+    ]}))
+    assert results[0]["type"] == "result" and results[0]["session"] == sid
+    assert results[1]["status"] == 409
+
+
+@pytest.mark.parametrize("body", [None, {}, {"items": []}, {"items": "a"}, {"xml": "<a/>"}])
+def test_a_batch_without_items_is_refused(client, body):
+    assert client.post("/api/llama3/batch", json=body).status_code == 400
+
+
+def test_a_batch_over_the_limit_is_refused(client, monkeypatch):
+    monkeypatch.setattr(server, "BATCH_MAX_ITEMS", 2)
+    response = client.post("/api/llama3/batch", json={"xml": "<a/>", "prompts": ["a", "b", "c"]})
+    assert response.status_code == 413
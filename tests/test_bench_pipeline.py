@@ -0,0 +1,81 @@
+import pytest
+from music21 import chord, dynamics, key, meter, note, stream, tempo
+
+import bench_pipeline
+import llm_client
+import server
+from musicxml_io import parse_musicxml_string, score_to_musicxml
+from stub_llm_server import start_stub
+
+
+def signature(score):
+    return [(type(el).__name__, el.measureNumber, el.offset, getattr(el, "fullName", None))
+            for el in score.recurse().notesAndRests]
+
+
+def test_generated_scores_are_deterministic():
+    assert signature(bench_pipeline.generate_score(40, 2)) == signature(bench_pipeline.generate_score(40, 2))
+    assert signature(bench_pipeline.generate_score(40, 2)) != signature(bench_pipeline.generate_score(40, 2, seed=1))
+
+
+def test_generated_score_has_everything_the_suite_measures():
+    score = bench_pipeline.generate_score(64, 3)
+    parts = list(score.parts)
+    assert len(parts) == 3
+    for part in parts:
+        measures = list(part.getElementsByClass(stream.Measure))
+        assert [m.number for m in measures] == list(range(1, 65))
+        for m in measures:
+            beats = 3 if (m.number - 1) // 32 % 2 else 4  # 4/4 and 3/4 alternate every 32 measures
+            assert sum(el.quarterLength for el in m.notesAndRests) == beats
+    flat = score.recurse()
+    assert {ts.ratioString for ts in flat.getElementsByClass(meter.TimeSignature)} == {"4/4", "3/4"}
+    assert len(flat.getElementsByClass(key.KeySignature)) > len(parts)
+    assert len(flat.getElementsByClass(dynamics.Dynamic)) == 16 * len(parts)
+    assert len(parts[0].recurse().getElementsByClass(tempo.MetronomeMark)) == 4
+    assert not parts[1].recurse().getElementsByClass(tempo.MetronomeMark)
+    for cls in (note.Note, note.Rest, chord.Chord):
+        assert flat.getElementsByClass(cls)
+
+
+def test_generated_score_survives_export():
+    score = bench_pipeline.generate_score(16, 2)
+    parsed = parse_musicxml_string(score_to_musicxml(score))
+    assert len(parsed.recurse().notes) == len(score.recurse().notes)
+
+
+def test_timed_reports_every_run():
+    calls = []
+    t = bench_pipeline.timed(lambda: calls.append(1), 3)
+    assert len(calls) == 3 and len(t["runs"]) == 3
+    assert t["min"] <= t["median"] <= max(t["runs"])
+
+
+@pytest.fixture
+def client():
+    stub, url = start_stub()
+    client = llm_client.LLMClient(base_url=url)
+    yield client
+    client.close()
+    stub.shutdown()
+    stub.server_close()
+
+
+def test_bench_case_times_every_stage(client):
+    case = bench_pipeline.bench_case(8, 1, 1, client)
+    assert (case["measures"], case["parts"]) == (8, 1)
+    assert case["notes"] > 0 and case["xml_bytes"] > 0
+    expected = {"fix_steps", "parse", "analyze_key", "snippet", "build_prompt", "llm", "serialize"}
+    expected |= {f"action:{name}" for name in server.ACTIONS}
+    assert set(case["stages"]) == expected
+    assert all(len(t["runs"]) == 1 and t["median"] >= 0 for t in case["stages"].values())
+
+
+def test_print_case_compares_with_a_baseline(client, capsys):
+    case = bench_pipeline.bench_case(8, 1, 1, client)
+    baseline = {"stages": {name: {"median": t["median"] * 2} for name, t in case["stages"].items()}}
+    bench_pipeline.print_case(case, baseline)
+    out = capsys.readouterr().out
+    assert "8 measures x 1 parts" in out
+    assert out.count("before") == len(case["stages"])
+    assert "x 0.50" in out
@@ -0,0 +1,122 @@
+import multiprocessing
+import time
+
+import pytest
+
+from candidate_pool import CandidatePool
+from musicxml_io import parse_musicxml_string
+from score_cache import ScoreCache
+
+
+def count_notes(plan, score, option_number):
+    return f"{option_number}:{len(score.recurse().notes)}"
+
+
+def transpose_first(plan, score, option_number):
+    score.recurse().notes.first().transpose(plan, inPlace=True)
+    return score.recurse().notes.first().nameWithOctave
+
+
+def sleep_for(plan, score, option_number):
+    time.sleep(plan)
+    return "woke up"
+
+
+def fail(plan, score, option_number):
+    raise RuntimeError("bad plan")
+
+
+@pytest.fixture
+def entry(score_xml):
+    return ScoreCache(parse_musicxml_string).entry(score_xml(2))
+
+
+@pytest.fixture
+def pool():
+    pool = CandidatePool(workers=2, timeout=5)
+    yield pool
+    pool.shutdown()
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_each_candidate_gets_its_own_copy(entry, workers):
+    pool = CandidatePool(workers=workers)
+    try:
+        assert pool.materialize(transpose_first, entry, [2, 4]) == ["D4", "E4"]
+        assert pool.materialize(count_notes, entry, [None], option_numbers=["7"]) == ["7:8"]
+    finally:
+        pool.shutdown()
+
+
+def test_a_failed_candidate_gives_an_empty_option(entry, pool):
+    assert pool.materialize(fail, entry, [None]) == [""]
+
+
+def test_a_hung_candidate_does_not_keep_its_worker(entry):
+    pool = CandidatePool(workers=1, timeout=1)
+    try:
+        before = set(multiprocessing.active_children())
+        pool.warm()
+        workers = set(multiprocessing.active_children()) - before
+        hung = pool.submit(sleep_for, entry, 60, "1")
+        time.sleep(0.2)  # let it start, so it can't just be cancelled
+        assert pool.result(hung, 0.2) == ""
+        assert pool.recycled == 1
+        # the next candidate runs in a fresh pool instead of queueing behind the hung one
+        t0 = time.monotonic()
+        assert pool.materialize(count_notes, entry, [None], timeout=5) == ["1:8"]
+        assert time.monotonic() - t0 < 5
+        # the stuck worker is killed once the grace period is over
+        deadline = time.monotonic() + 5
+        while any(p.is_alive() for p in workers) and time.monotonic() < deadline:
+            time.sleep(0.1)
+        assert workers and not any(p.is_alive() for p in workers)
+        assert hung.done()
+    finally:
+        pool.shutdown()
+
+
+def test_a_queued_candidate_that_times_out_is_just_cancelled(entry):
+    pool = CandidatePool(workers=1, timeout=5)
+    try:
+        # one running, up to two more handed to the worker's call queue, the last one still waiting
+        futures = [pool.submit(sleep_for, entry, 0.3, str(i)) for i in range(5)]
+        assert pool.result(futures[-1], 0) == ""
+        assert futures[-1].cancelled()
+        assert pool.recycled == 0
+        assert [pool.result(f, 5) for f in futures[:-1]] == ["woke up"] * 4
+    finally:
+        pool.shutdown()
+
+
+def test_a_broken_retired_pool_leaves_the_current_one_alone(entry):
+    pool = CandidatePool(workers=1, timeout=5)
+    try:
+        hung = pool.submit(sleep_for, entry, 60, "1")
+        time.sleep(0.5)
+        pool.abandon(hung)
+        fresh = pool.submit(sleep_for, entry, 0.5, "2")
+        current = pool._executor
+        pool._kill_retired()  # the grace timer firing early
+        # the hung candidate's pool is broken now; reading it mustn't touch the new pool
+        assert pool.result(hung, 5) == ""
+        assert hung.done()
+        assert pool._executor is current
+        assert pool.result(fresh, 5) == "woke up"
+    finally:
+        pool.shutdown()
+
+
+def test_a_broken_current_pool_is_replaced(entry):
+    pool = CandidatePool(workers=1, timeout=5)
+    try:
+        before = set(multiprocessing.active_children())
+        hung = pool.submit(sleep_for, entry, 60, "1")
+        time.sleep(0.5)
+        for process in set(multiprocessing.active_children()) - before:
+            process.kill()
+        assert pool.result(hung, 5) == ""
+        assert pool._executor is None
+        assert pool.materialize(count_notes, entry, [None]) == ["1:8"]
+    finally:
+        pool.shutdown()
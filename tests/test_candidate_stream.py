@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+import server
+from candidate_stream import CandidateStreamParser
+
+ANSWER = json.dumps({
+    "note": "braces } and \"quotes\" [ in strings don't count",
+    "other": [{"action": "not a candidate"}],
+    "candidates": [
+        {"id": "v1", "action": "transpose", "params": {"semitones": 2}, "target": {"measures": [1, 2]}},
+        {"id": "v2", "action": "change_tempo", "params": {"ratio": 1.5}, "error": "a \\\"quoted\\\" }"},
+    ],
+    "after": {"candidates": [{"id": "nested"}]},
+}, indent=1)
+
+
+def feed_all(pieces):
+    parser = CandidateStreamParser()
+    seen = []
+    for piece in pieces:
+        seen.append([c["id"] for c in parser.feed(piece)])
+    return parser, seen
+
+
+def test_whole_answer_at_once():
+    parser, seen = feed_all([ANSWER])
+    assert seen == [["v1", "v2"]]
+    assert parser.count == 2
+    assert parser.text == ANSWER
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 16])
+def test_any_split_gives_the_same_candidates(size):
+    pieces = [ANSWER[i:i + size] for i in range(0, len(ANSWER), size)]
+    parser, seen = feed_all(pieces)
+    assert [c for found in seen for c in found] == ["v1", "v2"]
+    assert parser.text == ANSWER
+
+
+def test_a_candidate_comes_out_as_soon_as_it_closes():
+    first_end = ANSWER.index("}\n  },") + len("}\n  }")
+    parser = CandidateStreamParser()
+    assert parser.feed(ANSWER[:first_end - 1]) == []
+    found = parser.feed(ANSWER[first_end - 1:first_end])
+    assert [c["id"] for c in found] == ["v1"]
+    assert found[0]["params"] == {"semitones": 2}
+
+
+def test_broken_candidates_are_skipped():
+    parser, seen = feed_all(['{"candidates": [{"id": "v1", "x": 1,}, ', '{"id": "v2"}]}'])
+    assert seen == [[], ["v2"]]
+
+
+def test_clarify_answer_has_no_candidates():
+    parser, seen = feed_all(['{"clarify": "which measures?"}'])
+    assert parser.count == 0 and seen == [[]]
+
+
+def events(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines() if line]
+
+
+def test_stream_endpoint_sends_each_option(llm_stub, score_xml):
+    llm_stub(token_chars=8)
+    client = server.app.test_client()
+    response = client.post("/api/llama3/stream", json={"xml": score_xml(4), "prompt": "make it brighter"})
+    assert response.mimetype == "application/x-ndjson"
+    got = events(response)
+    assert got[0] == {"type": "meta", "source": "llm"}
+    options = [e for e in got[1:-1] if e["type"] == "option"]
+    assert sorted(e["index"] for e in options) == [0, 1]
+    assert all("<score-partwise" in e["xml"] for e in options)
+    assert got[-1] == {"type": "done", "count": 2}
+    # the answer was kept, so asking again doesn't go to the model
+    again = events(client.post("/api/llama3/stream", json={"xml": score_xml(4), "prompt": "make it brighter"}))
+    assert again[0]["source"] == "cache"
+
+
+def test_stream_endpoint_as_sse(llm_stub, score_xml):
+    llm_stub()
+    response = server.app.test_client().post(
+        "/api/llama3/stream?format=sse", json={"xml": score_xml(2), "prompt": "make it brighter"})
+    assert response.mimetype == "text/event-stream"
+    body = response.get_data(as_text=True)
+    assert body.startswith("event: meta\ndata: ")
+    assert body.rstrip().endswith('"type": "done", "count": 2}')
+
+
+def test_stream_endpoint_reports_a_dead_model(llm_stub, score_xml):
+    llm_stub(fail_rate=1.0)
+    got = events(server.app.test_client().post(
+        "/api/llama3/stream", json={"xml": score_xml(2), "prompt": "make it brighter"}))
+    assert [e["type"] for e in got] == ["meta", "error", "done"]
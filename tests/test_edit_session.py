@@ -0,0 +1,265 @@
+import threading
+import time
+
+import pytest
+
+import edit_session
+import server
+from edit_session import EditSession, SessionNotFound, SessionStore, VersionConflict, apply_patch, xml_patch
+
+
+class Entry:
+    size = 100
+
+
+def load(xml):
+    return Entry()
+
+
+def edited(xml, measure, step="A"):
+    """xml with the first note of one measure changed"""
+    head, sep, tail = xml.partition(f'<measure number="{measure}">')
+    i = tail.find("<step>") + len("<step>")
+    return head + sep + tail[:i] + step + tail[i + 1:]
+
+
+@pytest.mark.parametrize("change", [
+    lambda x: x,
+    lambda x: edited(x, 3),
+    lambda x: edited(edited(x, 1), 8, "B"),
+    lambda x: x.replace('<measure number="4">', '<measure number="4"><barline/>'),
+    lambda x: x.replace("</part>", '<measure number="9"><note><rest/><duration>4</duration></note></measure></part>'),
+    lambda x: x[:x.find('<measure number="5">')] + x[x.find("</part>"):],
+    lambda x: "<score-partwise/>",
+])
+def test_patch_round_trip(score_xml, change):
+    old = score_xml(8, parts=2)
+    new = change(old)
+    assert apply_patch(new, xml_patch(new, old)) == old
+    assert apply_patch(old, xml_patch(old, new)) == new
+
+
+def test_patch_keeps_only_the_changed_measures(score_xml):
+    old = score_xml(400)
+    patch = xml_patch(edited(old, 200), old)
+    assert len(patch) < 300 < len(old) / 100
+
+
+def test_commit_and_undo_step_through_versions(score_xml):
+    original = score_xml(4)
+    session = EditSession(original, "k0", load)
+    assert session.commit(edited(original, 1), "k1") == 1
+    assert session.commit(edited(original, 2), "k2", version=1) == 2
+    assert session.undo_depth == 2
+    assert session.undo(lambda xml: "undone", version=2) == 3
+    assert session.xml == edited(original, 1) and session.key == "undone"
+    assert session.undo(lambda xml: "undone") == 4
+    assert session.xml == original
+    assert session.undo(lambda xml: "undone") is None
+    assert session.version == 4
+
+
+def test_stale_version_is_refused(score_xml):
+    session = EditSession(score_xml(4), "k0", load)
+    session.commit(edited(session.xml, 1), "k1", version=0)
+    with pytest.raises(VersionConflict) as conflict:
+        session.commit(edited(session.xml, 2), "k2", version=0)
+    assert conflict.value.version == 1
+    with pytest.raises(VersionConflict):
+        session.undo(lambda xml: "k", version=0)
+    session.check(None)
+    session.check("1")
+
+
+def test_commit_that_loses_a_race_is_refused(score_xml, monkeypatch):
+    session = EditSession(score_xml(4), "k0", load)
+    real_patch = edit_session.xml_patch
+
+    def patch(new, old):
+        if new.endswith("slow"):
+            time.sleep(0.2)  # the other commit lands while this one diffs
+        return real_patch(new, old)
+
+    monkeypatch.setattr(edit_session, "xml_patch", patch)
+    results = {}
+
+    def commit(name, xml):
+        try:
+            results[name] = session.commit(xml, name, version=0)
+        except VersionConflict as e:
+            results[name] = e
+
+    slow = threading.Thread(target=commit, args=("slow", session.xml + "slow"))
+    slow.start()
+    time.sleep(0.05)
+    commit("fast", session.xml + "fast")
+    slow.join()
+    assert results["fast"] == 1 and isinstance(results["slow"], VersionConflict)
+    assert session.undo_depth == 1
+
+
+def test_undo_depth_is_bounded(score_xml, monkeypatch):
+    monkeypatch.setattr(edit_session, "SESSION_MAX_UNDO", 3)
+    xml = score_xml(4)
+    session = EditSession(xml, "k", load)
+    for i in range(5):
+        session.commit(xml + str(i), "k")
+    assert session.undo_depth == 3
+    while session.undo(lambda x: "k") is not None:
+        pass
+    assert session.xml == xml + "1"
+
+
+def test_options_are_only_offered_for_their_version(score_xml):
+    session = EditSession(score_xml(4), "k0", load)
+    session.offer(0, ["<a/>", ""])
+    assert session.option(1) == ("<a/>", 0)
+    assert session.option(2) is None and session.option(3) is None and session.option(0) is None
+    session.offer(5, ["<stale/>"])
+    assert session.option(1) == ("<a/>", 0)
+    session.commit("<a/>", "k1")
+    assert session.option(1) is None
+
+
+def test_score_is_loaded_once_per_version(score_xml):
+    loads = []
+    session = EditSession(score_xml(4), "k0", lambda xml: loads.append(xml) or Entry())
+    session.current()
+    session.current()
+    session.commit(edited(session.xml, 1), "k1")
+    session.score_entry()
+    assert len(loads) == 2
+
+
+def test_store_expires_and_evicts(score_xml):
+    store = SessionStore(load, ttl=0.2, max_bytes=10 ** 9)
+    first = store.create(score_xml(2), "a")
+    time.sleep(0.3)
+    with pytest.raises(SessionNotFound):
+        store.get(first.id)
+    assert store.stats()["expired"] == 1
+
+    xml = score_xml(4)
+    store = SessionStore(load, max_bytes=2 * len(xml) + 10)
+    ids = [store.create(xml, str(i)).id for i in range(3)]
+    with pytest.raises(SessionNotFound):
+        store.get(ids[0])
+    store.get(ids[1])
+    store.create(xml, "3")
+    store.get(ids[1])  # used more recently than ids[2], so it stays
+    with pytest.raises(SessionNotFound):
+        store.get(ids[2])
+    assert store.stats()["evicted"] == 2
+
+
+def test_shared_store_is_seen_by_every_process(score_xml, tmp_path):
+    # two stores on one directory stand in for two serve.py workers
+    loads = []
+    first = SessionStore(lambda xml: loads.append(xml) or Entry(), directory=str(tmp_path))
+    second = SessionStore(load, directory=str(tmp_path))
+    original = score_xml(4)
+    session = first.create(original, "k0")
+    other = second.get(session.id)
+    assert (other.xml, other.key, other.version) == (original, "k0", 0)
+
+    session.offer(0, ["<a/>", "<b/>"])
+    assert second.get(session.id).option(2) == ("<b/>", 0)
+    assert other.commit(edited(original, 1), "k1", version=0) == 1
+    with pytest.raises(VersionConflict):
+        session.commit(edited(original, 2), "k2", version=0)
+    assert first.get(session.id).xml == edited(original, 1) and session.undo_depth == 1
+    assert session.undo(lambda xml: "undone") == 2
+    assert second.get(session.id).xml == original
+    assert session.current()[0] == original and loads == [original]
+
+    assert second.delete(session.id)
+    with pytest.raises(SessionNotFound):
+        first.get(session.id)
+    with pytest.raises(SessionNotFound):
+        first.get("../" + session.id)
+
+
+def test_shared_store_expires_and_evicts(score_xml, tmp_path):
+    store = SessionStore(load, ttl=0.2, directory=str(tmp_path))
+    first = store.create(score_xml(2), "a")
+    time.sleep(0.3)
+    with pytest.raises(SessionNotFound):
+        store.get(first.id)
+    assert store.stats()["sessions"] == 0 and store.stats()["expired"] == 1
+
+    xml = score_xml(4)
+    store = SessionStore(load, max_bytes=2 * len(xml) + 1000, directory=str(tmp_path))
+    ids = [store.create(xml, str(i)).id for i in range(3)]
+    with pytest.raises(SessionNotFound):
+        store.get(ids[0])
+    assert store.stats()["sessions"] == 2 and store.stats()["evicted"] == 1
+
+
+@pytest.fixture
+def client():
+    server.sessions.clear()
+    return server.app.test_client()
+
+
+def test_session_routes(client, llm_stub, score_xml):
+    llm_stub()
+    sent = score_xml(4)
+    created = client.post("/api/sessions", json={"xml": sent})
+    assert created.status_code == 201
+    session = created.get_json()
+    sid = session["session"]
+    assert (session["version"], session["undo"]) == (0, 0)
+    original = client.get(f"/api/sessions/{sid}?xml=1").get_json()["xml"]
+
+    answer = client.post("/api/llama3", json={"session": sid, "version": 0, "prompt": "brighten it"})
+    assert answer.status_code == 200
+    body = answer.get_json()
+    assert body["version"] == 0 and body["session"] == sid and len(body["options"]) == 2
+
+    accepted = client.post(f"/api/sessions/{sid}/accept", json={"option": 1, "version": 0}).get_json()
+    assert (accepted["version"], accepted["undo"]) == (1, 1)
+    now = client.get(f"/api/sessions/{sid}?xml=1").get_json()["xml"]
+    assert now == server.normalize_xml(body["options"][0])
+
+    stale = client.post("/api/llama3", json={"session": sid, "version": 0, "prompt": "brighten it"})
+    assert stale.status_code == 409 and stale.get_json()["version"] == 1
+    gone = client.post(f"/api/sessions/{sid}/accept", json={"option": 2})
+    assert gone.status_code == 409  # the options belonged to version 0
+
+    undone = client.post(f"/api/sessions/{sid}/undo", json={"version": 1}).get_json()
+    assert undone["version"] == 2 and undone["xml"] == original
+    assert client.post(f"/api/sessions/{sid}/undo").status_code == 409
+
+    assert client.delete(f"/api/sessions/{sid}").status_code == 204
+    assert client.get(f"/api/sessions/{sid}").status_code == 404
+    assert client.post("/api/llama3", json={"session": sid, "prompt": "x"}).status_code == 404
+
+
+def test_accept_commits_on_the_version_the_option_was_offered_on(client, llm_stub, score_xml, monkeypatch):
+    llm_stub()
+    sid = client.post("/api/sessions", json={"xml": score_xml(4)}).get_json()["session"]
+    client.post("/api/llama3", json={"session": sid, "prompt": "brighten it"})
+    session = server.sessions.get(sid)
+    option = session.option
+
+    def racing_option(number):
+        found = option(number)
+        session.commit(score_xml(5), "edited meanwhile")  # another tab commits between option() and commit()
+        return found
+
+    monkeypatch.setattr(session, "option", racing_option)
+    raced = client.post(f"/api/sessions/{sid}/accept", json={"option": 1})
+    assert raced.status_code == 409 and raced.get_json()["version"] == 1
+    assert server.sessions.get(sid).key == "edited meanwhile"
+
+
+def test_accept_refuses_a_version_other_than_the_options(client, llm_stub, score_xml):
+    llm_stub()
+    sid = client.post("/api/sessions", json={"xml": score_xml(4)}).get_json()["session"]
+    client.post("/api/llama3", json={"session": sid, "prompt": "brighten it"})
+    assert client.post(f"/api/sessions/{sid}/accept", json={"option": 1, "version": 1}).status_code == 409
+    assert client.post(f"/api/sessions/{sid}/accept", json={"option": 1, "version": 0}).status_code == 200
+
+
+def test_create_needs_xml(client):
+    assert client.post("/api/sessions", json={}).status_code == 400
@@ -0,0 +1,118 @@
+import threading
+
+import pytest
+
+import job_queue
+import server
+
+
+def blocked_queue(release, **options):
+    def handler(payload):
+        release.wait(5)
+        return {"options": ["<score-partwise/>"], "source": "rules"}, True
+    return job_queue.JobQueue(handler, **options)
+
+
+def test_a_full_queue_refuses_with_a_retry_estimate():
+    release = threading.Event()
+    jobs = blocked_queue(release, workers=1, max_queued=1)
+    try:
+        running = jobs.submit({})
+        while running.status != "running":
+            running.done.wait(0.01)
+        queued = jobs.submit({})
+        with pytest.raises(job_queue.QueueFull) as e:
+            jobs.submit({})
+        assert e.value.retry_after >= 1
+        assert jobs.stats()["rejected"] == 1
+    finally:
+        release.set()
+    assert queued.done.wait(5) and queued.status == "done"
+    assert queued.to_dict()["options"] == ["<score-partwise/>"]
+
+
+def test_a_failing_handler_marks_the_job():
+    def handler(payload):
+        raise RuntimeError("boom")
+    jobs = job_queue.JobQueue(handler, workers=1)
+    job = jobs.submit({})
+    assert job.done.wait(5)
+    assert job.to_dict()["status"] == "error" and job.to_dict()["error"] == "boom"
+
+
+def test_a_shared_job_can_be_polled_from_another_process(tmp_path):
+    # two queues on one directory stand in for two serve.py workers
+    release = threading.Event()
+    owner = blocked_queue(release, workers=1, directory=str(tmp_path))
+    other = job_queue.JobQueue(lambda payload: ({}, True), directory=str(tmp_path))
+    job = owner.submit({})
+    polled = other.get(job.id)
+    assert polled is not job and polled.status in ("queued", "running")
+    assert other.wait(polled, 0.05).status != "done"
+    release.set()
+    done = other.wait(polled, 5)
+    assert done.to_dict()["status"] == "done" and done.to_dict()["options"] == ["<score-partwise/>"]
+    assert other.get("0" * 32) is None and other.get("../" + job.id) is None
+
+
+def test_expired_shared_jobs_are_removed(tmp_path):
+    jobs = job_queue.JobQueue(lambda payload: ({}, True), workers=1, ttl=0, directory=str(tmp_path))
+    job = jobs.submit({})
+    assert job.done.wait(5)
+    jobs.submit({}).done.wait(5)
+    assert jobs.get(job.id) is None and not (tmp_path / f"{job.id}.json").exists()
+
+
+@pytest.fixture
+def client():
+    return server.app.test_client()
+
+
+def test_submit_answers_429_with_retry_after_when_full(client, monkeypatch, score_xml):
+    release = threading.Event()
+    monkeypatch.setattr(server, "jobs", blocked_queue(release, workers=1, max_queued=1))
+    body = {"xml": score_xml(1), "prompt": "transpose up 2 semitones"}
+    try:
+        assert client.post("/api/jobs", json=body).status_code == 202
+        while server.jobs.stats()["running"] == 0:
+            release.wait(0.01)
+        assert client.post("/api/jobs", json=body).status_code == 202
+        refused = client.post("/api/jobs", json=body)
+        assert refused.status_code == 429
+        assert int(refused.headers["Retry-After"]) == refused.get_json()["retry_after"] >= 1
+    finally:
+        release.set()
+
+
+@pytest.mark.parametrize("kwargs", [
+    {},
+    {"data": "not json", "content_type": "application/json"},
+    {"data": "xml=1", "content_type": "application/x-www-form-urlencoded"},
+    {"json": ["a list"]},
+    {"json": {"prompt": "no score"}},
+])
+def test_submit_refuses_a_bad_body(client, kwargs):
+    response = client.post("/api/jobs", **kwargs)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_a_job_runs_and_can_be_waited_for(client, llm_stub, score_xml):
+    llm_stub()
+    submitted = client.post("/api/jobs", json={"xml": score_xml(2), "prompt": "make it brighter"})
+    assert submitted.status_code == 202
+    assert submitted.headers["Location"] == f"/api/jobs/{submitted.get_json()['id']}"
+    job = client.get(submitted.headers["Location"] + "?wait=10").get_json()
+    assert job["status"] == "done" and job["source"] == "llm" and len(job["options"]) == 2
+
+
+@pytest.mark.parametrize("wait", ["soon", "nan"])
+def test_get_refuses_a_bad_wait(client, monkeypatch, wait):
+    monkeypatch.setattr(server, "jobs", job_queue.JobQueue(lambda payload: ({}, True), workers=1))
+    job_id = client.post("/api/jobs", json={"xml": "<score-partwise/>"}).get_json()["id"]
+    assert client.get(f"/api/jobs/{job_id}?wait={wait}").status_code == 400
+    assert client.get(f"/api/jobs/{job_id}?wait=1").status_code == 200
+
+
+def test_unknown_job(client):
+    assert client.get("/api/jobs/nope").status_code == 404
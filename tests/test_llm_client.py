@@ -0,0 +1,123 @@
+import asyncio
+import json
+import time
+
+import openai
+import pytest
+
+import llm_client
+from stub_llm_server import DEFAULT_CANDIDATES, start_stub
+
+MESSAGES = [{"role": "user", "content": "transpose up 2 semitones"}]
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(**options):
+        server, url = start_stub(**options)
+        servers.append(server)
+        return server.state, url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def client_for(url, **options):
+    options.setdefault("backoff", 0)
+    return llm_client.LLMClient(base_url=url, **options)
+
+
+def test_calls_reuse_one_connection(stub):
+    state, url = stub()
+    client = client_for(url)
+    try:
+        for _ in range(5):
+            assert json.loads(client.chat(MESSAGES)) == DEFAULT_CANDIDATES
+    finally:
+        client.close()
+    assert state.requests == 5
+    assert state.connections == 1
+
+
+def test_async_calls_share_the_pool(stub):
+    state, url = stub(latency=0.1)
+    client = client_for(url)
+
+    async def run():
+        try:
+            return await asyncio.gather(*[client.achat(MESSAGES) for _ in range(4)])
+        finally:
+            await client.aclose()
+
+    assert len(asyncio.run(run())) == 4
+    assert state.requests == 4
+    assert state.connections <= 4
+
+
+def test_a_slow_backend_times_out(stub):
+    state, url = stub(latency=3)
+    client = client_for(url, read_timeout=0.3, max_retries=0)
+    try:
+        t0 = time.monotonic()
+        with pytest.raises(openai.APITimeoutError):
+            client.chat(MESSAGES)
+        assert time.monotonic() - t0 < 2
+    finally:
+        client.close()
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_transient_failures_are_retried(stub, status):
+    state, url = stub(fail_first=2, fail_status=status)
+    client = client_for(url, max_retries=2)
+    try:
+        assert client.chat(MESSAGES)
+    finally:
+        client.close()
+    assert state.requests == 3
+
+
+@pytest.mark.parametrize("status, error", [(429, openai.RateLimitError), (503, openai.InternalServerError)])
+def test_the_last_failure_is_raised(stub, status, error):
+    state, url = stub(fail_first=5, fail_status=status)
+    client = client_for(url, max_retries=1)
+    try:
+        with pytest.raises(error):
+            client.chat(MESSAGES)
+    finally:
+        client.close()
+    assert state.requests == 2
+
+
+def test_a_bad_request_is_not_retried(stub):
+    state, url = stub(fail_first=1, fail_status=400)
+    client = client_for(url, max_retries=3)
+    try:
+        with pytest.raises(openai.BadRequestError):
+            client.chat(MESSAGES)
+    finally:
+        client.close()
+    assert state.requests == 1
+
+
+def test_a_stream_is_retried_before_its_first_piece(stub):
+    state, url = stub(fail_first=1, token_chars=16)
+    client = client_for(url, max_retries=1)
+    try:
+        pieces = list(client.stream_chat(MESSAGES))
+    finally:
+        client.close()
+    assert len(pieces) > 1
+    assert json.loads("".join(pieces)) == DEFAULT_CANDIDATES
+    assert state.requests == 2
+
+
+def test_retry_delay_is_jittered_and_grows():
+    client = llm_client.LLMClient(base_url="http://127.0.0.1:9/v1", backoff=0.5)
+    delays = [client.retry_delay(3) for _ in range(50)]
+    assert all(0 <= d <= 4 for d in delays)
+    assert len(set(delays)) > 1
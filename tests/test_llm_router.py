@@ -0,0 +1,183 @@
+import json
+import time
+
+import pytest
+
+import llm_router
+from llm_router import CLOSED, HALF_OPEN, OPEN, LLMRouter, NoBackendAvailable
+from stub_llm_server import DEFAULT_CANDIDATES, start_stub
+
+MESSAGES = [{"role": "user", "content": "transpose up 2 semitones"}]
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(**options):
+        server, url = start_stub(**options)
+        servers.append(server)
+        return server.state, url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def router_for(urls, **options):
+    options.setdefault("max_retries", 0)
+    options.setdefault("breaker_failures", 2)
+    options.setdefault("breaker_cooldown", 0.2)
+    options.setdefault("hedge_percentile", 0)
+    options.setdefault("health_interval", 0)
+    return LLMRouter.from_urls(urls, **options)
+
+
+def fail_calls(router, n):
+    for _ in range(n):
+        with pytest.raises(Exception):
+            router.chat(MESSAGES)
+
+
+def test_consecutive_failures_open_the_breaker(stub):
+    state, url = stub(fail_rate=1.0)
+    router = router_for([url])
+    try:
+        fail_calls(router, 1)
+        assert router.backends[0].state == CLOSED
+        fail_calls(router, 1)
+        assert router.backends[0].state == OPEN
+        with pytest.raises(NoBackendAvailable):
+            router.chat(MESSAGES)
+        assert state.requests == 2
+    finally:
+        router.close()
+
+
+def test_trial_after_cooldown_closes_or_reopens(stub):
+    state, url = stub(fail_rate=1.0)
+    router = router_for([url])
+    b = router.backends[0]
+    try:
+        fail_calls(router, 2)
+        time.sleep(0.25)
+        fail_calls(router, 1)  # the trial fails: straight back to open, no second run of failures needed
+        assert b.state == OPEN
+        time.sleep(0.25)
+        state.fail_rate = 0.0
+        assert json.loads(router.chat(MESSAGES)) == DEFAULT_CANDIDATES
+        assert b.state == CLOSED and not b.trial_running
+    finally:
+        router.close()
+
+
+def test_only_the_trial_call_ends_the_trial(stub):
+    _, url = stub()
+    router = router_for([url])
+    b = router.backends[0]
+    try:
+        # two calls that started while the backend was still closed
+        leases = [router._acquire(), router._acquire()]
+        assert not any(trial for _, trial in leases)
+        b.state, b.opened_at = OPEN, time.monotonic() - 1
+        trial_backend, trial = router._acquire()
+        assert trial_backend is b and trial and b.state == HALF_OPEN
+        with pytest.raises(NoBackendAvailable):
+            router._acquire()  # one trial at a time
+
+        router._release(*leases[0], 0.01)
+        assert b.trial_running and b.state == HALF_OPEN
+        router._release(*leases[1], error=True)  # nor does a late failure end the trial
+        assert b.trial_running and b.state == HALF_OPEN
+
+        router._release(b, trial, 0.01)
+        assert not b.trial_running and b.state == CLOSED
+    finally:
+        router.close()
+
+
+def test_health_probe_moves_open_breaker_only_to_half_open(stub):
+    state, url = stub(fail_rate=1.0)
+    router = router_for([url])
+    b = router.backends[0]
+    try:
+        router.check_health()
+        assert b.state == CLOSED
+        router.check_health()
+        assert b.state == OPEN
+
+        state.fail_rate = 0.0
+        router.check_health()
+        assert b.state == OPEN  # the cooldown isn't over
+        time.sleep(0.25)
+        router.check_health()
+        assert b.state == HALF_OPEN
+        router.check_health()
+        assert b.state == HALF_OPEN  # still waiting for a trial call
+
+        assert json.loads(router.chat(MESSAGES)) == DEFAULT_CANDIDATES
+        assert b.state == CLOSED
+    finally:
+        router.close()
+
+
+def test_failing_probe_reopens_half_open_breaker(stub):
+    state, url = stub(fail_rate=1.0)
+    router = router_for([url])
+    b = router.backends[0]
+    try:
+        fail_calls(router, 2)
+        time.sleep(0.25)
+        router.check_health()
+        assert b.state == OPEN
+        with pytest.raises(NoBackendAvailable):
+            router.chat(MESSAGES)
+    finally:
+        router.close()
+
+
+def test_failed_call_moves_to_another_backend(stub):
+    bad_state, bad = stub(fail_rate=1.0)
+    good_state, good = stub()
+    router = router_for([bad, good], max_retries=1)
+    router.backends[1].ewma = 1.0  # the failing backend goes first
+    try:
+        assert json.loads(router.chat(MESSAGES)) == DEFAULT_CANDIDATES
+        assert (bad_state.requests, good_state.requests) == (1, 1)
+    finally:
+        router.close()
+
+
+def test_slow_call_is_hedged_to_another_backend(stub):
+    slow_state, slow = stub(latency=1.0)
+    fast_state, fast = stub()
+    router = router_for([slow, fast], hedge_percentile=95, hedge_min_samples=5)
+    router.latencies.extend([0.02] * 5)
+    router.backends[0].ewma, router.backends[1].ewma = 0.01, 0.05  # the slow backend goes first
+    try:
+        t0 = time.perf_counter()
+        assert json.loads(router.chat(MESSAGES)) == DEFAULT_CANDIDATES
+        assert time.perf_counter() - t0 < 0.8
+        stats = router.stats()
+        assert (stats["hedges"], stats["hedge_wins"]) == (1, 1)
+        assert (slow_state.requests, fast_state.requests) == (1, 1)
+    finally:
+        router.close()
+
+
+def test_no_hedge_without_enough_history(stub):
+    _, a = stub()
+    _, b = stub()
+    router = router_for([a, b], hedge_percentile=95, hedge_min_samples=5)
+    try:
+        assert router.hedge_delay() is None
+        router.chat(MESSAGES)
+        assert router.stats()["hedges"] == 0
+    finally:
+        router.close()
+
+
+def test_router_from_env_needs_two_backends(monkeypatch):
+    monkeypatch.setattr(llm_router, "LLM_BASE_URLS", ["http://127.0.0.1:1/v1"])
+    assert llm_router.router_from_env() is None
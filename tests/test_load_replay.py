@@ -0,0 +1,124 @@
+import json
+import random
+import statistics
+
+import pytest
+
+import load_replay
+from load_replay import Results, load_requests, send
+from stub_llm_server import latency_sampler
+
+httpx = load_replay.httpx
+
+
+def samples(spec, n=4000):
+    sample, rng = latency_sampler(spec), random.Random(3)
+    return [sample(rng) for _ in range(n)]
+
+
+def test_fixed_latency():
+    assert samples(0.25, 3) == samples("0.25", 3) == [0.25] * 3
+
+
+def test_latency_distributions():
+    uniform = samples("uniform:0.1,0.3")
+    assert 0.1 <= min(uniform) and max(uniform) <= 0.3
+    assert statistics.mean(uniform) == pytest.approx(0.2, abs=0.01)
+
+    normal = samples("normal:0.1,0.2")
+    assert min(normal) == 0.0  # cut off at zero
+    assert statistics.median(normal) == pytest.approx(0.1, abs=0.02)
+
+    lognormal = samples("lognormal:0.8,0.5")
+    assert min(lognormal) > 0 and statistics.median(lognormal) == pytest.approx(0.8, rel=0.05)
+    assert statistics.mean(lognormal) > statistics.median(lognormal)  # the long tail
+
+    exp = samples("exp:0.5")
+    assert min(exp) >= 0 and statistics.mean(exp) == pytest.approx(0.5, rel=0.08)
+
+
+@pytest.mark.parametrize("spec", ["gamma:1,2", "uniform:0.1", "exp:1,2", "normal:a,b", "slow"])
+def test_bad_latency_spec(spec):
+    with pytest.raises(ValueError):
+        latency_sampler(spec)
+
+
+def test_load_requests(tmp_path):
+    (tmp_path / "scores").mkdir()
+    (tmp_path / "scores" / "a.xml").write_text("<score-partwise/>", encoding="utf-8")
+    lines = [
+        {"prompt": "brighten it", "xml_file": "scores/a.xml"},
+        {},
+        {"endpoint": "/api/llama3/stream", "prompt": "darken it", "xml_file": "scores/a.xml",
+         "body": {"fresh": True, "prompt": "darker"}},
+        {"endpoint": "/api/jobs", "xml": "<inline/>"},
+    ]
+    path = tmp_path / "requests.jsonl"
+    path.write_text("\n".join(json.dumps(line) for line in lines) + "\n\n", encoding="utf-8")
+    requests = load_requests(str(path))
+    assert requests == [
+        ("/api/llama3", {"prompt": "brighten it", "xml": "<score-partwise/>"}),
+        ("/api/llama3", {"prompt": ""}),
+        ("/api/llama3/stream", {"prompt": "darker", "xml": "<score-partwise/>", "fresh": True}),
+        ("/api/jobs", {"prompt": "", "xml": "<inline/>"}),
+    ]
+    assert requests[0][1]["xml"] is requests[2][1]["xml"]  # a shared score file is read once
+
+
+def test_report():
+    results = Results()
+    for i in range(1, 101):
+        results.add("/api/llama3", 200, i / 100)
+    results.add("/api/llama3", 500, 2.0)
+    results.add("/api/llama3", "ConnectError", 3.0)
+    results.add("/api/llama3/stream", 200, 0.5, first_event=0.1)
+    results.add("/api/llama3/stream", "stream-error", 0.7, first_event=0.2)
+    report = results.report(wall=2.0)
+
+    plain = report["/api/llama3"]
+    assert plain["requests"] == 102 and plain["throughput"] == 51.0
+    assert plain["error_rate"] == pytest.approx(2 / 102)
+    assert plain["statuses"] == {"200": 100, "500": 1, "ConnectError": 1}
+    assert plain["latency"] == {"p50": 0.51, "p95": 0.97, "p99": 2.0, "max": 3.0}
+    assert "first_event" not in plain
+
+    stream = report["/api/llama3/stream"]
+    assert stream["error_rate"] == 0.5 and stream["statuses"] == {"200": 1, "stream-error": 1}
+    assert stream["first_event"]["max"] == 0.2
+    assert Results().report(wall=0) == {}
+
+
+def mock_client(handler):
+    return httpx.Client(transport=httpx.MockTransport(handler))
+
+
+def test_send_counts_statuses_and_stream_errors():
+    results = Results()
+
+    def handler(request):
+        if request.url.path.endswith("/stream"):
+            lines = [{"type": "meta"}, {"type": "error", "error": "boom"}, {"type": "done"}]
+            return httpx.Response(200, text="".join(json.dumps(e) + "\n" for e in lines))
+        return httpx.Response(429)
+
+    with mock_client(handler) as client:
+        send(client, "http://test", "/api/llama3", {}, results, 0.0)
+        send(client, "http://test", "/api/llama3/stream", {}, results, 0.0)
+    assert results.by_endpoint["/api/llama3"]["statuses"] == {429: 1}
+    stream = results.by_endpoint["/api/llama3/stream"]
+    assert stream["statuses"] == {"stream-error": 1} and len(stream["first_event"]) == 1
+
+
+def test_send_counts_any_exception_as_an_error():
+    results = Results()
+
+    def handler(request):
+        if request.url.path.endswith("/stream"):
+            return httpx.Response(200, text="not json\n")
+        raise httpx.ConnectError("refused", request=request)
+
+    with mock_client(handler) as client:
+        send(client, "http://test", "/api/llama3", {}, results, 0.0)
+        send(client, "http://test", "/api/llama3/stream", {}, results, 0.0)
+    assert results.by_endpoint["/api/llama3"]["statuses"] == {"ConnectError": 1}
+    assert results.by_endpoint["/api/llama3/stream"]["statuses"] == {"JSONDecodeError": 1}
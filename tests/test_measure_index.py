@@ -0,0 +1,103 @@
+import copy
+
+from music21 import key, note, stream, tempo
+
+from measure_index import NO_MEASURES, MeasureIndex, resolve_scope
+from musicxml_io import parse_musicxml_string
+
+
+def numbers_of(part):
+    return [m.number for m in part.getElementsByClass(stream.Measure)]
+
+
+def first_pitch(measure):
+    return measure.recurse().getElementsByClass(note.Note).first().nameWithOctave
+
+
+def test_resolve_scope():
+    numbers = list(range(1, 33))
+    assert resolve_scope(numbers, [3, 4]) == (3, 4)
+    assert resolve_scope(numbers, ["4", 3, "x"]) == (3, 4)
+    assert resolve_scope(numbers, [30, 40]) == (30, 32)
+    # the whole score, or no measures named: no scope
+    assert resolve_scope(numbers, None) is None
+    assert resolve_scope(numbers, []) is None
+    assert resolve_scope(numbers, [0, 40]) is None
+    # measures that aren't in the score: nothing to edit, not the whole score
+    assert resolve_scope(numbers, [200, 210]) == NO_MEASURES
+    assert resolve_scope(numbers, [-5, -1]) == NO_MEASURES
+
+
+def test_view_shares_the_measures(score_xml):
+    score = parse_musicxml_string(score_xml(6, parts=2))
+    index = MeasureIndex(score)
+    view = index.view(3, 4)
+    assert [numbers_of(p) for p in view.parts] == [[3, 4], [3, 4]]
+    view.parts[0].getElementsByClass(stream.Measure).first().recurse().notes.first().transpose(12, inPlace=True)
+    index.splice(view, 3, 4)
+    assert first_pitch(score.parts[0].measure(3)) == "D6"
+    assert first_pitch(score.parts[1].measure(3)) == "D5"
+    assert numbers_of(score.parts[0]) == [1, 2, 3, 4, 5, 6]
+
+
+def test_splice_replaced_measures_keep_their_numbers_and_offsets(score_xml):
+    score = parse_musicxml_string(score_xml(4))
+    index = MeasureIndex(score)
+    view = index.view(2, 3)
+    part = view.parts[0]
+    for m in list(part.getElementsByClass(stream.Measure)):
+        replacement = copy.deepcopy(m)
+        replacement.number = 99
+        part.replace(m, replacement)
+    index.splice(view, 2, 3)
+    measures = list(score.parts[0].getElementsByClass(stream.Measure))
+    assert [m.number for m in measures] == [1, 2, 3, 4]
+    assert [m.offset for m in measures] == [0, 4, 8, 12]
+
+
+def test_splice_more_measures_renumbers_the_rest(score_xml):
+    score = parse_musicxml_string(score_xml(5))
+    index = MeasureIndex(score)
+    last = score.parts[0].measure(5)
+    view = index.view(2, 3)
+    part = view.parts[0]
+    extra = [copy.deepcopy(m) for m in part.getElementsByClass(stream.Measure)]
+    for m in extra:
+        part.append(m)
+    index.splice(view, 2, 3)
+    measures = list(score.parts[0].getElementsByClass(stream.Measure))
+    assert [m.number for m in measures] == [1, 2, 3, 4, 5, 6, 7]
+    assert [m.offset for m in measures] == [0, 4, 8, 12, 16, 20, 24]
+    assert measures[-1] is last
+    assert first_pitch(measures[3]) == first_pitch(measures[1])
+    assert index.numbers == [1, 2, 3, 4, 5, 6, 7]
+
+
+def test_restore_context_puts_back_the_tempo_and_key_after_the_range(score_xml):
+    score = parse_musicxml_string(score_xml(6, parts=2, bpm=100))
+    index = MeasureIndex(score)
+    context = index.context_after(3)
+    view = index.view(2, 3)
+    for part in view.parts:
+        first = part.getElementsByClass(stream.Measure).first()
+        first.insert(0, tempo.MetronomeMark(number=150))
+        first.insert(0, key.Key("A", "minor"))
+        first.keySignature = key.KeySignature(3)
+    index.splice(view, 2, 3)
+    index.restore_context(context)
+    for part in score.parts:
+        after = part.measure(4)
+        assert after.getElementsByClass(tempo.MetronomeMark).first().number == 100
+        assert after.keySignature.sharps == 0
+        assert part.measure(3).getContextByClass(tempo.MetronomeMark).number == 150
+    # measures past the first one after the range are left alone
+    assert not score.parts[0].measure(5).getElementsByClass(tempo.MetronomeMark)
+
+
+def test_restore_context_leaves_unchanged_measures_alone(score_xml):
+    score = parse_musicxml_string(score_xml(4, bpm=90))
+    index = MeasureIndex(score)
+    context = index.context_after(2)
+    index.restore_context(context)
+    assert not score.parts[0].measure(3).getElementsByClass(tempo.MetronomeMark)
+    assert score.parts[0].measure(3).keySignature is None
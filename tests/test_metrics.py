@@ -0,0 +1,131 @@
+import concurrent.futures
+import contextvars
+
+import pytest
+
+import metrics
+from metrics import Registry
+
+
+def worker_registry(directory):
+    """A registry like every server process builds, sharing its counts through directory"""
+    registry = Registry()
+    calls = registry.counter("calls_total", "Calls", ["outcome"])
+    seconds = registry.histogram("call_seconds", "Call time", [], (0.1, 1))
+    registry.share(str(directory), interval=3600)
+    return registry, calls, seconds
+
+
+def series(text):
+    return dict(line.rsplit(" ", 1) for line in text.splitlines() if not line.startswith("#"))
+
+
+def test_render_sums_every_process(tmp_path):
+    a, a_calls, a_seconds = worker_registry(tmp_path)
+    b, b_calls, b_seconds = worker_registry(tmp_path)
+    a_calls.inc(outcome="ok")
+    a_calls.inc(outcome="error")
+    a_seconds.observe(0.05)
+    b_calls.inc(2, outcome="ok")
+    b_seconds.observe(0.5)
+    b_seconds.observe(5)
+    b.flush()
+
+    # whichever process answers the scrape sees the same totals
+    for registry in (a, b):
+        a.flush()
+        rendered = series(registry.render())
+        assert rendered['calls_total{outcome="ok"}'] == "3"
+        assert rendered['calls_total{outcome="error"}'] == "1"
+        assert rendered['call_seconds_bucket{le="0.1"}'] == "1"
+        assert rendered['call_seconds_bucket{le="1"}'] == "2"
+        assert rendered['call_seconds_bucket{le="+Inf"}'] == "3"
+        assert rendered["call_seconds_count"] == "3"
+        assert float(rendered["call_seconds_sum"]) == pytest.approx(5.55)
+
+
+def test_an_exited_process_still_counts(tmp_path):
+    a, a_calls, _ = worker_registry(tmp_path)
+    b, b_calls, _ = worker_registry(tmp_path)
+    b_calls.inc(4, outcome="ok")
+    b.flush()
+    del b, b_calls  # its file stays behind, so the counter doesn't go down
+    a_calls.inc(outcome="ok")
+    assert series(a.render())['calls_total{outcome="ok"}'] == "5"
+
+
+def test_reset_and_clear_shared(tmp_path):
+    a, a_calls, _ = worker_registry(tmp_path)
+    a_calls.inc(outcome="ok")
+    a.flush()
+    a.reset()
+    assert 'calls_total{outcome="ok"}' not in series(a.render())
+    metrics.clear_shared(str(tmp_path))
+    assert list(tmp_path.glob("*.json")) == []
+
+
+def test_unshared_registry_renders_its_own_counts():
+    registry = Registry()
+    registry.counter("calls_total", "Calls").inc(2)
+    assert series(registry.render()) == {"calls_total": "2"}
+
+
+def test_spans_on_pool_threads_reach_the_trace():
+    spans = metrics.start_trace()
+    with concurrent.futures.ThreadPoolExecutor(2) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, metrics.record_stage, "llm", 0.1) for _ in range(2)]
+        lost = pool.submit(metrics.record_stage, "lost", 0.1)
+        for f in futures + [lost]:
+            f.result()
+    assert [name for _, name, _ in spans] == ["llm", "llm"]
+
+
+def test_section_calls_record_into_the_request_trace(monkeypatch, score_xml):
+    import server
+
+    def call(prompt, snippet_format=None):
+        metrics.record_stage("llm", 0.01)
+        return None
+
+    monkeypatch.setattr(server, "call_llama3_with_prompt", call)
+    monkeypatch.setattr(server.score_sections, "CHUNK_CONCURRENCY", 2)
+    req = server.Llama3Request("make it louder", score_xml(measures=12), sections=True)
+    sections = [(1, 6, 1, 6), (7, 12, 7, 12)]
+    spans = metrics.start_trace()
+    server.call_sections(req, sections)
+    assert [name for _, name, _ in spans].count("llm") == 2
+
+
+@pytest.fixture
+def client():
+    import server
+    return server.app.test_client()
+
+
+def test_metrics_route_renders_prometheus_text(client, llm_stub, score_xml):
+    llm_stub()
+    metrics.REGISTRY.reset()
+    body = {"xml": score_xml(4), "prompt": "brighten it", "fresh": True}
+    assert client.post("/api/llama3", json=body).status_code == 200
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    text = response.get_data(as_text=True)
+    assert "# TYPE llama3_request_seconds histogram" in text and "# TYPE llama3_llm_calls_total counter" in text
+    rendered = series(text)
+    assert rendered['llama3_request_seconds_count{endpoint="/api/llama3",status="200"}'] == "1"
+    assert rendered['llama3_llm_calls_total{outcome="ok"}'] == "1"
+    assert rendered['llama3_stage_seconds_count{stage="llm"}'] == "1"
+
+
+@pytest.mark.parametrize("url, headers", [("/api/llama3?timing=1", {}), ("/api/llama3", {"X-Timing": "1"})])
+def test_timing_is_sent_back_when_asked_for(client, llm_stub, score_xml, monkeypatch, url, headers):
+    import server
+    monkeypatch.setattr(server, "TIMING_HEADER", False)
+    llm_stub()
+    body = {"xml": score_xml(4), "prompt": "brighten it", "fresh": True}
+    response = client.post(url, json=body, headers=headers)
+    stages = [entry.split(";")[0] for entry in response.headers["Server-Timing"].split(", ")]
+    assert {"fix_steps", "parse", "llm"} <= set(stages)
+    assert all(";dur=" in entry for entry in response.headers["Server-Timing"].split(", "))
+    assert "Server-Timing" not in client.post("/api/llama3", json=body).headers
@@ -0,0 +1,20 @@
+from music21 import note, stream
+
+from musicxml_io import parse_musicxml_string, score_to_musicxml, score_to_musicxml_bytes
+
+
+def test_round_trip_keeps_notes_and_measures(score_xml):
+    score = parse_musicxml_string(score_xml(3, parts=2))
+    again = parse_musicxml_string(score_to_musicxml(score))
+    assert len(again.parts) == 2
+    assert [m.number for m in again.parts[0].getElementsByClass(stream.Measure)] == [1, 2, 3]
+    pitches = [n.nameWithOctave for n in again.parts[0].recurse().getElementsByClass(note.Note)]
+    assert pitches[:5] == ["C4", "D4", "E4", "F4", "G4"]
+
+
+def test_bytes_and_string_agree(score_xml):
+    score = parse_musicxml_string(score_xml(1))
+    data = score_to_musicxml_bytes(score)
+    assert isinstance(data, bytes)
+    assert data.decode("utf-8") == score_to_musicxml(score)
+    assert "<score-partwise" in score_to_musicxml(score)
@@ -0,0 +1,80 @@
+import pytest
+
+from music21 import chord, dynamics, key, note, stream
+
+import note_table
+import server
+
+pytestmark = pytest.mark.skipif(not note_table.available(), reason="numpy is not installed")
+
+
+def sample_score():
+    """Two parts with a key change, accidentals, chords, rests and dynamics"""
+    score = stream.Score()
+    for p in range(2):
+        part = stream.Part(id=f"P{p + 1}")
+        for number in range(1, 5):
+            m = stream.Measure(number=number)
+            if number == 1:
+                m.append(key.KeySignature(-3))
+                m.insert(0, dynamics.Dynamic("p"))
+            if number == 3:
+                m.append(key.KeySignature(2))
+            m.append(note.Note("E-4" if p == 0 else "F#3", quarterLength=1))
+            m.append(chord.Chord(["C4", "E-4", "G4"], quarterLength=1))
+            m.append(note.Rest(quarterLength=0.5))
+            m.append(note.Note("B4", quarterLength=1.5))
+            part.append(m)
+        score.insert(0, part)
+    return score
+
+
+def spelled(score):
+    rows = []
+    for n in score.recurse().notesAndRests:
+        pitches = [p for p in getattr(n, "pitches", ())]
+        rows.append((
+            n.measureNumber, float(n.quarterLength),
+            tuple((p.nameWithOctave, p.accidental.name if p.accidental else None) for p in pitches),
+        ))
+    return rows
+
+
+def dynamic_marks(score):
+    return [(d.measureNumber, d.value) for d in score.recurse().getElementsByClass(dynamics.Dynamic)]
+
+
+@pytest.mark.parametrize("semitones", [-13, -3, 1, 2, 6, 12])
+def test_transpose_matches_music21(semitones):
+    expected, actual = sample_score(), sample_score()
+    for n in expected.recurse().notes:
+        n.transpose(semitones, inPlace=True)
+    note_table.transpose(actual, semitones)
+    assert spelled(actual) == spelled(expected)
+
+
+def test_scale_rhythm_matches_music21():
+    expected, actual = sample_score(), sample_score()
+    for n in expected.recurse().notesAndRests:
+        n.quarterLength *= 0.5
+    note_table.scale_rhythm(actual, 0.5)
+    assert spelled(actual) == spelled(expected)
+
+
+@pytest.mark.parametrize("change", [-3, -1, 1, 4])
+def test_shift_dynamics_matches_music21(change, monkeypatch):
+    expected, actual = sample_score(), sample_score()
+    monkeypatch.setattr(server, "ACTION_ENGINE", "music21")
+    server.modify_dynamics(expected, {"dynamics_shift": change})
+    note_table.shift_dynamics(actual, change)
+    assert dynamic_marks(actual) == dynamic_marks(expected)
+
+
+def test_table_columns():
+    table = note_table.NoteTable(sample_score())
+    assert len(table.elements) == 2 * 4 * 4
+    # one pitch row per note and one per chord member; rests have none
+    assert len(table.midi) == 2 * 4 * (1 + 3 + 1)
+    assert table.in_chord.sum() == 2 * 4 * 3
+    assert sorted(set(table.measure.tolist())) == [1, 2, 3, 4]
+    assert table.onset[:4].tolist() == [0.0, 1.0, 2.0, 2.5]
@@ -0,0 +1,78 @@
+import pytest
+from music21 import dynamics, tempo
+
+import plan_compiler
+import server
+from musicxml_io import parse_musicxml_string
+
+
+def labels(actions):
+    return [stage.label for stage in plan_compiler.compile_plan(actions, server.ACTIONS).stages]
+
+
+def test_per_note_actions_share_one_pass():
+    actions = [("transpose", {"semitones": 2}), ("adjust_rhythm", {"scale": 0.5}),
+               ("add_articulation", {"style": "accent"})]
+    assert labels(actions) == ["fused[transpose+adjust_rhythm+add_articulation]"]
+
+
+def test_deferrable_actions_run_after_the_pass():
+    actions = [("change_tempo", {"ratio": 1.2}), ("transpose", {"semitones": 2}),
+               ("modify_dynamics", {"dynamics_shift": 1}), ("adjust_rhythm", {"scale": 2})]
+    assert labels(actions) == ["fused[transpose+adjust_rhythm]", "change_tempo", "modify_dynamics"]
+
+
+def test_chord_actions_keep_their_place():
+    actions = [("transpose", {"semitones": 2}), ("add_chord_tone", {"interval": "M3"}),
+               ("add_articulation", {"style": "staccato"})]
+    assert labels(actions) == ["fused[transpose]", "add_chord_tone", "fused[add_articulation]"]
+
+
+def test_change_mode_closes_its_pass_and_waits_for_what_its_analysis_needs():
+    actions = [("transpose", {"semitones": 1}), ("change_mode", {"to": "minor"}),
+               ("transpose", {"semitones": 2})]
+    assert labels(actions) == ["fused[transpose]", "fused[change_mode]", "fused[transpose]"]
+    # with the tonic given there's nothing to analyze, so it joins the pass
+    actions[1] = ("change_mode", {"to": "d minor"})
+    assert labels(actions) == ["fused[transpose+change_mode]", "fused[transpose]"]
+
+
+def test_change_mode_after_repeat_segment_keeps_plan_order():
+    actions = [("repeat_segment", {"times": 2}), ("change_mode", {"to": "c minor"})]
+    assert labels(actions) == ["repeat_segment", "fused[change_mode]"]
+
+
+def test_unknown_actions_are_dropped():
+    assert labels([("sing_louder", {}), ("transpose", {"semitones": 1})]) == ["fused[transpose]"]
+
+
+def summary(score):
+    rows = [(n.measureNumber, n.offset, float(n.quarterLength), tuple(p.nameWithOctave for p in n.pitches),
+             tuple(type(a).__name__ for a in n.articulations)) for n in score.recurse().notesAndRests]
+    marks = [(t.measureNumber, t.number) for t in score.recurse().getElementsByClass(tempo.MetronomeMark)]
+    dyns = [(d.measureNumber, d.value) for d in score.recurse().getElementsByClass(dynamics.Dynamic)]
+    return rows, marks, dyns
+
+
+PLANS = [
+    [("transpose", {"semitones": 2}), ("adjust_rhythm", {"scale": 0.5}), ("add_articulation", {"style": "accent"})],
+    [("change_tempo", {"ratio": 1.25}), ("transpose", {"semitones": -3}), ("modify_dynamics", {"dynamics_shift": 2})],
+    [("transpose", {"semitones": 1}), ("change_mode", {"to": "minor"}), ("add_articulation", {"style": "staccato"})],
+    [("add_chord_tone", {"interval": "m3"}), ("transpose", {"semitones": 5}), ("adjust_rhythm", {"scale": 2})],
+    [("repeat_segment", {"times": 2}), ("change_mode", {"from": "major", "to": "a minor"})],
+]
+
+
+@pytest.mark.parametrize("actions", PLANS)
+def test_fused_run_matches_one_action_at_a_time(score_xml, actions, monkeypatch):
+    monkeypatch.setattr(server, "ACTION_ENGINE", "music21")
+    xml = score_xml(4, parts=2, bpm=100, dynamic="mp")
+    expected = parse_musicxml_string(xml)
+    for action, params in actions:
+        result = server.ACTIONS[action](expected, params)
+        if result is not None:
+            expected = result
+    compiled = plan_compiler.compile_plan(actions, server.ACTIONS)
+    actual = compiled.run(parse_musicxml_string(xml), server.NOTE_OPS, server.ACTIONS)
+    assert summary(actual) == summary(expected)
+    assert [label for label, _ in compiled.timings] == ["compile"] + [s.label for s in compiled.stages]
@@ -0,0 +1,37 @@
+import server
+from stub_llm_server import approx_tokens
+
+INFO = {"key": "C major", "time_signature": "4/4", "tempo": 100}
+
+
+def test_system_message_is_the_same_for_every_request():
+    a = server.llama3_messages(server.build_prompt("make it joyful", INFO, "<score-partwise/>"))
+    b = server.llama3_messages(server.build_prompt("transpose measures 2-3", dict(INFO, key="g minor"), "<x/>"))
+    assert a[0] == b[0] and a[0]["role"] == "system"
+    assert a[0]["content"] is server.SYSTEM_MESSAGES["xml"]
+
+
+def test_request_text_only_goes_in_the_user_message():
+    user = server.build_prompt("make it joyful", INFO, "<score-partwise>snippet</score-partwise>")
+    assert user.startswith("Instruction: make it joyful")
+    assert "key=C major, time_signature=4/4, tempo=100" in user
+    assert "\nMusicXML snippet:\n<score-partwise>snippet</score-partwise>" in user
+    assert "make it joyful" not in server.SYSTEM_MESSAGES["xml"]
+
+
+def test_snippet_formats_share_the_prefix_up_to_the_legend():
+    xml, digest = server.SYSTEM_MESSAGES["xml"], server.SYSTEM_MESSAGES["digest"]
+    assert xml.startswith(server.SYSTEM_INSTRUCTIONS) and digest.startswith(server.SYSTEM_INSTRUCTIONS)
+    assert xml.endswith(server.CLOSING_INSTRUCTIONS) and digest.endswith(server.CLOSING_INSTRUCTIONS)
+    assert server.DIGEST_LEGEND in digest and server.DIGEST_LEGEND not in xml
+    assert "Score digest (in place of the MusicXML snippet)" in server.build_prompt("x", INFO, "m1 C4", "digest")
+    assert server.llama3_messages("x", "unknown")[0]["content"] == xml
+
+
+def test_the_static_prefix_is_reused_by_a_prefix_caching_backend(llm_stub):
+    state = llm_stub(prefix_cache=True)
+    for prompt in ("make it joyful", "make it darker"):
+        assert server.call_llama3_with_prompt(server.build_prompt(prompt, INFO, "<score-partwise/>"))
+    # the second request only prefills what follows the system message
+    system_tokens = approx_tokens(server.SYSTEM_MESSAGES["xml"])
+    assert system_tokens - 32 < state.cached_tokens <= system_tokens + 16
@@ -0,0 +1,66 @@
+import result_cache
+import server
+
+PLAN = {"id": "v1", "action": "transpose", "params": {"semitones": 2}, "target": {"measures": [2, 1]},
+        "secondary_actions": [{"action": "add_articulation", "params": {"style": "accent"}}]}
+
+
+def test_plan_key_ignores_what_doesnt_change_the_output():
+    same = dict(PLAN, id="v9", explanation="brighter", target={"measures": [1, 2]})
+    assert result_cache.plan_key("s", PLAN, "1") == result_cache.plan_key("s", same, "1")
+    assert result_cache.plan_key("s", PLAN, "1") != result_cache.plan_key("s", dict(PLAN, params={"semitones": 3}), "1")
+    assert result_cache.plan_key("s", PLAN, "1") != result_cache.plan_key("s", PLAN, "2")
+
+
+def test_plan_key_changes_with_the_code_that_builds_the_output(monkeypatch):
+    key = result_cache.plan_key("s", PLAN, "1", "engine=music21,fast_path=1")
+    assert key != result_cache.plan_key("s", PLAN, "1", "engine=numpy,fast_path=1")
+    monkeypatch.setattr(result_cache, "PLAN_CACHE_VERSION", result_cache.PLAN_CACHE_VERSION + 1)
+    assert key != result_cache.plan_key("s", PLAN, "1", "engine=music21,fast_path=1")
+
+
+def test_server_keys_options_by_its_engine_flags(monkeypatch):
+    flags = server.engine_flags()
+    monkeypatch.setattr(server, "XML_FAST_PATH", not server.XML_FAST_PATH)
+    assert server.engine_flags() != flags
+
+
+def test_prompt_key_normalizes_the_prompt():
+    assert result_cache.prompt_key("s", "Transpose  up 2.") == result_cache.prompt_key("s", "transpose up 2")
+    assert result_cache.prompt_key("s", "transpose up 2") != result_cache.prompt_key("t", "transpose up 2")
+
+
+def test_prompt_key_covers_the_section_layout():
+    keys = {
+        result_cache.prompt_key("s", "brighten it"),
+        result_cache.prompt_key("s", "brighten it", [(1, 16, 1, 18), (17, 32, 15, 32)]),
+        result_cache.prompt_key("s", "brighten it", [(1, 20, 1, 22), (21, 32, 19, 32)]),
+    }
+    assert len(keys) == 3
+    assert result_cache.prompt_key("s", "brighten it", []) == result_cache.prompt_key("s", "brighten it")
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = result_cache.ResultCache(max_bytes=10)
+    cache.put("a", "xxxx")
+    cache.put("b", "yyyy")
+    assert cache.get("a") == "xxxx"
+    cache.put("c", "zzzz")
+    assert cache.get("b") is None and cache.get("a") == "xxxx" and cache.get("c") == "zzzz"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_sqlite_tier_survives_a_restart(tmp_path):
+    path = str(tmp_path / "results.db")
+    cache = result_cache.ResultCache(1000, result_cache.SqliteTier(path, "plan_results"))
+    cache.put("k", "<score-partwise/>")
+    again = result_cache.ResultCache(1000, result_cache.SqliteTier(path, "plan_results"))
+    assert again.get("k") == "<score-partwise/>"
+    assert again.stats()["disk_hits"] == 1
+
+
+def test_sqlite_tier_is_bounded(tmp_path):
+    tier = result_cache.SqliteTier(str(tmp_path / "results.db"), "plan_results", max_entries=2)
+    for k in "abc":
+        tier.put(k, k)
+    assert tier.count() == 2 and tier.get("a") is None
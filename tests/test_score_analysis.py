@@ -0,0 +1,119 @@
+import random
+
+import pytest
+from music21 import corpus, stream
+
+import bench_pipeline
+import score_analysis
+import server
+from musicxml_io import score_to_musicxml
+
+pytestmark = pytest.mark.skipif(not score_analysis.available(), reason="numpy is not installed")
+
+
+def same_key(found, expected):
+    assert str(found) == str(expected)
+    assert found.correlationCoefficient == pytest.approx(expected.correlationCoefficient)
+
+
+@pytest.fixture(scope="module")
+def score():
+    return bench_pipeline.generate_score(96, 3)
+
+
+def test_key_of_the_whole_score_matches_music21(score):
+    same_key(score_analysis.ScoreAnalysis(score).key(), score.analyze("key"))
+
+
+def test_key_of_a_window_matches_music21(score):
+    analysis = score_analysis.ScoreAnalysis(score)
+    rng = random.Random(7)
+    for _ in range(12):
+        start = rng.randint(1, 96)
+        end = rng.randint(start, min(96, start + 30))
+        same_key(analysis.key(start, end), score.measures(start, end).analyze("key"))
+
+
+@pytest.mark.parametrize("name", ["bach/bwv66.6", "bach/bwv7.7", "mozart/k80/movement1"])
+def test_key_of_a_corpus_piece_matches_music21(name):
+    piece = corpus.parse(name)
+    analysis = score_analysis.ScoreAnalysis(piece)
+    same_key(analysis.key(), piece.analyze("key"))
+    first, last = analysis.numbers[0], analysis.numbers[-1]
+    middle = (first + last) // 2
+    for start, end in [(first, middle), (middle, last)]:
+        same_key(analysis.key(start, end), piece.measures(start, end).analyze("key"))
+
+
+def test_a_window_without_notes_has_no_key(score):
+    analysis = score_analysis.ScoreAnalysis(score)
+    assert analysis.key(200, 300) is None
+    assert analysis.global_info(200, 300)["key"] == "None"
+
+
+def test_time_signature_by_measure(score):
+    analysis = score_analysis.ScoreAnalysis(score)
+    current = None
+    for m in score.parts[0].getElementsByClass(stream.Measure):
+        if m.timeSignature is not None:
+            current = m.timeSignature.ratioString
+        assert analysis.time_signature(m.number) == current
+    assert analysis.time_signature() == "4/4"
+    assert analysis.time_signature(0) == "4/4"  # before the first one, the first one
+
+
+def test_tempo_by_measure(score):
+    analysis = score_analysis.ScoreAnalysis(score)
+    boundaries = score.metronomeMarkBoundaries()
+    for m in score.parts[0].getElementsByClass(stream.Measure):
+        expected = next(mark.number for start, end, mark in boundaries if start <= m.offset < end)
+        assert analysis.tempo(m.number) == expected
+    assert analysis.tempo() == boundaries[0][2].number
+    assert analysis.global_info(17, 24)["tempo"] == analysis.tempo(17)
+
+
+def test_tempo_defaults_without_a_mark(score_xml):
+    analysis = score_analysis.ScoreAnalysis(server.score_cache.get(score_xml(4))[1])
+    assert analysis.tempo(2) == score_analysis.DEFAULT_TEMPO
+
+
+def change_mode(measures, to="minor"):
+    return {"action": "change_mode", "target": {"measures": measures}, "params": {"to": to},
+            "secondary_actions": []}
+
+
+@pytest.fixture(scope="module")
+def req():
+    return server.Llama3Request("make it minor", score_to_musicxml(bench_pipeline.generate_score(64, 2)))
+
+
+def window_tonic(req, start, end):
+    return req.score.measures(start, end).analyze("key").tonic.name
+
+
+def test_mode_change_gets_the_tonic_of_its_target(req):
+    candidate = change_mode(list(range(9, 17)))
+    server.resolve_mode_tonic(candidate, req)
+    assert candidate["params"]["to"] == f"{window_tonic(req, 9, 16)} minor"
+
+    whole = change_mode([], to="Major")
+    server.resolve_mode_tonic(whole, req)
+    assert whole["params"]["to"] == f"{req.score.analyze('key').tonic.name} major"
+
+
+def test_mode_change_with_a_tonic_or_no_measures_is_left_alone(req):
+    named = change_mode([1, 2], to="D minor")
+    missing = change_mode([500])
+    other = dict(change_mode([1, 2]), action="transpose")
+    for candidate in (named, missing, other):
+        server.resolve_mode_tonic(candidate, req)
+    assert named["params"]["to"] == "D minor"
+    assert missing["params"]["to"] == "minor" and other["params"]["to"] == "minor"
+
+
+def test_each_section_plan_gets_its_own_tonic(req):
+    candidate = {"id": "v1", "sections": [change_mode(list(range(1, 9))), change_mode(list(range(41, 49)))]}
+    server.resolve_mode_tonic(candidate, req)
+    first, second = candidate["sections"]
+    assert first["params"]["to"] == f"{window_tonic(req, 1, 8)} minor"
+    assert second["params"]["to"] == f"{window_tonic(req, 41, 48)} minor"
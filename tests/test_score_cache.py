@@ -0,0 +1,67 @@
+from music21 import note
+
+from musicxml_io import parse_musicxml_string
+from score_cache import ScoreCache, normalize_xml, score_hash
+
+
+def counting_cache(**kwargs):
+    parses = []
+
+    def parse(xml):
+        parses.append(xml)
+        return parse_musicxml_string(xml)
+
+    return ScoreCache(parse, **kwargs), parses
+
+
+def test_hash_ignores_line_endings_and_surrounding_whitespace(score_xml):
+    xml = score_xml(2)
+    lines = xml.replace("><", ">\n<")
+    assert score_hash(lines) == score_hash(lines.replace("\n", "\r\n") + "  \n")
+    assert normalize_xml("a\r\nb\rc ") == "a\nb\nc"
+    assert score_hash(xml) != score_hash(score_xml(3))
+
+
+def test_same_score_is_parsed_once(score_xml):
+    cache, parses = counting_cache()
+    xml = score_xml(4)
+    first, _ = cache.get(xml)
+    second, _ = cache.get(xml + "\n")
+    assert first is second
+    assert len(parses) == 1
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_every_caller_gets_an_independent_copy(score_xml):
+    cache, _ = counting_cache()
+    xml = score_xml(2)
+    a = cache.get_score(xml)
+    b = cache.get_score(xml)
+    first = a.recurse().getElementsByClass(note.Note).first()
+    first.transpose(5, inPlace=True)
+    assert b.recurse().getElementsByClass(note.Note).first().pitch.name == "C"
+
+
+def test_evicts_least_recently_used_past_max_bytes(score_xml):
+    probe, _ = counting_cache()
+    size = probe.entry(score_xml(4)).size
+    cache, parses = counting_cache(max_bytes=int(size * 2.5))
+    a, b, c = score_xml(4), score_xml(4, fifths=1), score_xml(4, fifths=2)
+    cache.entry(a)
+    cache.entry(b)
+    cache.entry(a)  # b is now the least recently used
+    cache.entry(c)
+    assert cache.stats()["evictions"] == 1
+    cache.entry(a)
+    assert len(parses) == 3
+    cache.entry(b)
+    assert len(parses) == 4
+
+
+def test_scores_larger_than_the_cache_are_not_kept(score_xml):
+    cache, parses = counting_cache(max_bytes=10)
+    xml = score_xml(2)
+    cache.entry(xml)
+    cache.entry(xml)
+    assert len(parses) == 2
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,121 @@
+import json
+import xml.etree.ElementTree as ET
+
+import pytest
+from music21 import interval
+
+import server
+from musicxml_io import parse_musicxml_string, score_to_musicxml
+from score_delta import measure_digests, measure_divisions, score_delta
+
+CANDIDATES = {"candidates": [
+    {"id": "v1", "target": {"measures": [2, 3]}, "action": "transpose", "params": {"semitones": 2},
+     "secondary_actions": [{"action": "add_articulation", "params": {"style": "staccato"}}]},
+    {"id": "v2", "target": {"measures": [5]}, "action": "adjust_rhythm", "params": {"scale": 2},
+     "secondary_actions": []},
+]}
+
+
+def patch(sent_xml, delta):
+    """The score the editor ends up with after applying a delta to the document it sent"""
+    if "full" in delta:
+        return delta["full"]
+    root = ET.fromstring(sent_xml[sent_xml.find("<score-partwise"):])
+    for part in root.findall("part"):
+        pid = part.get("id")
+        for number in delta["removed"].get(pid, []):
+            part.remove(part.find(f"measure[@number='{number}']"))
+        for number, text in delta["parts"].get(pid, {}).items():
+            new = ET.fromstring(text)
+            old = part.find(f"measure[@number='{number}']")
+            if old is None:
+                part.append(new)
+            else:
+                part[list(part).index(old)] = new
+    return ET.tostring(root, encoding="unicode")
+
+
+def notes(xml):
+    """(part, measure, offset, duration, pitches) of every note and rest, as music21 reads the document"""
+    score = parse_musicxml_string(xml)
+    return [
+        (p, n.measureNumber, float(n.offset), float(n.quarterLength),
+         tuple(x.nameWithOctave for x in getattr(n, "pitches", ())))
+        for p, part in enumerate(score.parts) for n in part.recurse().notesAndRests
+    ]
+
+
+def bases(sent_xml):
+    return [measure_digests(sent_xml), measure_digests(score_to_musicxml(parse_musicxml_string(sent_xml)))]
+
+
+def music21_option(sent_xml, edit):
+    score = parse_musicxml_string(sent_xml)
+    edit(score)
+    return score_to_musicxml(score)
+
+
+def transpose_measure(number):
+    def edit(score):
+        for n in score.parts[0].measure(number).recurse().notes:
+            n.transpose(interval.Interval(2), inPlace=True)
+    return edit
+
+
+def test_music21_option_patches_into_the_sent_document(score_xml):
+    sent = score_xml(8, parts=2)
+    option = music21_option(sent, transpose_measure(3))
+    assert "<divisions>10080</divisions>" in option
+    delta = score_delta(option, bases(sent), measure_divisions(sent))
+    assert delta["parts"].keys() == {"P1"} and list(delta["parts"]["P1"]) == ["3"]
+    assert "<duration>1</duration>" in delta["parts"]["P1"]["3"]
+    assert notes(patch(sent, delta)) == notes(option)
+
+
+def test_without_divisions_the_measure_keeps_the_options_durations(score_xml):
+    sent = score_xml(4)
+    delta = score_delta(music21_option(sent, transpose_measure(2)), bases(sent))
+    assert "<duration>10080</duration>" in delta["parts"]["P1"]["2"]
+
+
+def test_first_measure_declares_the_sent_divisions(score_xml):
+    sent = score_xml(4)
+    option = music21_option(sent, transpose_measure(1))
+    delta = score_delta(option, bases(sent), measure_divisions(sent))
+    assert "<divisions>1</divisions>" in delta["parts"]["P1"]["1"]
+    assert notes(patch(sent, delta)) == notes(option)
+
+
+def test_durations_that_dont_fit_come_back_whole(score_xml):
+    sent = score_xml(4)
+
+    def halve(score):
+        for n in score.parts[0].measure(2).recurse().notes:
+            n.quarterLength = 0.5
+
+    option = music21_option(sent, halve)
+    delta = score_delta(option, bases(sent), measure_divisions(sent))
+    assert delta["full"] == option
+
+
+def test_rewriter_option_keeps_its_own_divisions(score_xml):
+    sent = score_xml(4).replace("<duration>1</duration>", "<duration>4</duration>").replace(
+        "<divisions>1</divisions>", "<divisions>4</divisions>")
+    option = sent.replace("<step>G</step>", "<step>A</step>", 1)  # measure 2
+    delta = score_delta(option, bases(sent), measure_divisions(sent))
+    assert delta["changed"] == 1 and "<duration>4</duration>" in delta["parts"]["P1"]["2"]
+    assert notes(patch(sent, delta)) == notes(option)
+
+
+@pytest.mark.parametrize("fast_path", [False, True])
+def test_delta_response_matches_full_response(llm_stub, monkeypatch, score_xml, fast_path):
+    monkeypatch.setattr(server, "XML_FAST_PATH", fast_path)
+    llm_stub(content=json.dumps(CANDIDATES))
+    sent = score_xml(6)
+    full, status = server.llama3_response({"xml": sent, "prompt": "brighten it", "response": "full"})
+    assert status == 200
+    body, status = server.llama3_response({"xml": sent, "prompt": "brighten it", "response": "delta"})
+    assert status == 200 and body["base"] == server.score_hash(sent)
+    for option, delta in zip(full["options"], body["deltas"]):
+        assert "full" not in delta
+        assert notes(patch(sent, delta)) == notes(option)
@@ -0,0 +1,56 @@
+from music21 import articulations, chord, key, meter, note, stream, tie
+
+from measure_index import MeasureIndex
+from musicxml_io import parse_musicxml_string
+from score_digest import DIGEST_LEGEND, score_digest
+
+
+def test_digest_of_a_small_score(score_xml):
+    score = parse_musicxml_string(score_xml(2, bpm=90, dynamic="mf", fifths=2))
+    assert score_digest(score) == "\n".join([
+        "P1 Part 1",
+        "m1 [Q:90] [K:2#] [M:4/4] !mf! C4 D4 E4 F4",
+        "m2 G4 A4 B4 C5",
+    ])
+
+
+def test_a_range_opens_with_the_context_in_force(score_xml):
+    score = parse_musicxml_string(score_xml(4, parts=2, bpm=90, fifths=-3))
+    index = MeasureIndex(score)
+    digest = score_digest(score, (3, 4), index)
+    assert digest.splitlines() == [
+        "P1 Part 1", "m3 [M:4/4] [K:3b] [Q:90] D5 E5 F5 G5", "m4 A5 B5 C4 D4",
+        "P2 Part 2", "m3 [M:4/4] [K:3b] D5 E5 F5 G5", "m4 A5 B5 C4 D4",
+    ]
+    # the index only saves the scan over the parts
+    assert score_digest(score, (3, 4)) == digest
+
+
+def test_events_lengths_ties_and_marks():
+    m = stream.Measure(number=1)
+    m.append(meter.TimeSignature("3/4"))
+    m.append(key.Key("a", "minor"))
+    first = note.Note("B-4", quarterLength=0.5)
+    first.articulations.append(articulations.Staccato())
+    m.append(first)
+    m.append(note.Rest(quarterLength=0.5))
+    held = chord.Chord(["A3", "C4", "E4"], quarterLength=1.5)
+    held.tie = tie.Tie("start")
+    held.articulations.append(articulations.Accent())
+    m.append(held)
+    m.append(note.Note("G#4", quarterLength=0.5))
+    part = stream.Part([m], id="P1")
+    part.partName = "Flute"
+    score = stream.Score([part])
+    assert score_digest(score) == "P1 Flute\nm1 [K:A minor] [M:3/4] B-4/.5. z/.5 [A3 C4 E4]/1.5-> G#4/.5"
+
+
+def test_digest_is_much_smaller_than_the_xml(score_xml):
+    xml = score_xml(32, parts=2)
+    digest = score_digest(parse_musicxml_string(xml))
+    assert len(digest) * 10 < len(xml)
+
+
+def test_legend_explains_the_tokens():
+    for token in ("m<number>", "z is a rest", "[K:", "[Q:", "!mf!", "V<n>"):
+        assert token in DIGEST_LEGEND
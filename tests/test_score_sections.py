@@ -0,0 +1,149 @@
+import json
+
+import pytest
+from music21 import bar, key, meter
+
+import server
+from musicxml_io import parse_musicxml_string
+from score_sections import merge_sections, plan_sections, section_ends, section_instruction, section_plans
+
+
+def owned(sections):
+    return [n for first, last, _, _ in sections for n in range(first, last + 1)]
+
+
+@pytest.mark.parametrize("count, size", [(1, 16), (16, 16), (17, 16), (40, 16), (100, 7), (5, 1)])
+def test_sections_cover_every_measure_once(count, size):
+    numbers = list(range(1, count + 1))
+    sections = plan_sections(numbers, size=size, overlap=2)
+    assert owned(sections) == numbers
+    for first, last, context_first, context_last in sections:
+        assert last - first + 1 <= size + size // 3
+        assert context_first == max(1, first - 2) and context_last == min(count, last + 2)
+
+
+def test_short_last_section_joins_the_one_before():
+    assert [(f, l) for f, l, _, _ in plan_sections(list(range(1, 35)), size=16)] == [(1, 16), (17, 34)]
+    assert [(f, l) for f, l, _, _ in plan_sections(list(range(1, 38)), size=16)] == [(1, 16), (17, 32), (33, 37)]
+
+
+def test_section_ends_early_at_a_boundary_past_two_thirds():
+    numbers = list(range(1, 41))
+    assert [(f, l) for f, l, _, _ in plan_sections(numbers, size=16, ends={12})][0] == (1, 12)
+    # too early in the section to cut there
+    assert [(f, l) for f, l, _, _ in plan_sections(numbers, size=16, ends={5})][0] == (1, 16)
+
+
+def test_sections_follow_the_score_numbers():
+    numbers = [0, 1, 2, 3, 5, 6, 7, 8, 9]  # a pickup measure and a gap
+    sections = plan_sections(numbers, size=4, overlap=1)
+    assert owned(sections) == numbers
+    assert sections[:2] == [(0, 3, 0, 5), (5, 8, 3, 9)]
+
+
+def test_section_ends_of_a_score(score_xml):
+    score = parse_musicxml_string(score_xml(12))
+    part = score.parts[0]
+    part.measure(4).rightBarline = bar.Barline("double")
+    part.measure(6).rightBarline = bar.Repeat(direction="end")
+    part.measure(9).insert(0, key.KeySignature(2))
+    part.measure(11).insert(0, meter.TimeSignature("3/4"))
+    assert section_ends(score) == {4, 6, 8, 10}
+
+
+def plan(measures, action="transpose", **params):
+    return {"action": action, "target": {"measures": measures}, "params": params, "secondary_actions": []}
+
+
+def test_merge_clips_each_section_to_its_measures():
+    sections = [(1, 8, 1, 10), (9, 16, 7, 16)]
+    results = [
+        [plan([1, 2, 3, 9, 10], semitones=2), plan([], semitones=-1)],
+        [plan([8, 9, 12], semitones=3), plan([20], semitones=4)],
+    ]
+    merged = merge_sections(sections, results)
+    assert [m["id"] for m in merged] == ["v1", "v2"]
+    assert [p["target"]["measures"] for p in merged[0]["sections"]] == [[1, 2, 3], [9, 12]]
+    # no measures means the whole section; measures only outside the section drop the plan
+    assert [p["target"]["measures"] for p in merged[1]["sections"]] == [list(range(1, 9))]
+    assert results[0][0]["target"]["measures"] == [1, 2, 3, 9, 10]  # the model's answers are left alone
+
+
+def test_merge_reuses_a_sections_last_candidate_and_skips_failed_sections():
+    sections = [(1, 4, 1, 4), (5, 8, 5, 8), (9, 12, 9, 12)]
+    results = [[plan([], semitones=1), plan([], semitones=2)], [], [plan([], semitones=3)]]
+    merged = merge_sections(sections, results)
+    assert [[p["params"]["semitones"] for p in m["sections"]] for m in merged] == [[1, 3], [2, 3]]
+    assert merge_sections(sections, [[], [], []]) == []
+    assert merge_sections(sections, [[{"explanation": "no action"}], [], []]) == []
+
+
+def test_section_plans_run_from_the_end_of_the_score():
+    candidate = {"sections": [plan([1, 2]), plan([9]), "junk", plan([5, 6])]}
+    assert [p["target"]["measures"] for p in section_plans(candidate)] == [[9], [5, 6], [1, 2]]
+    single = plan([3])
+    assert section_plans(single) == [single]
+
+
+def test_section_instruction_names_the_owned_measures():
+    text = section_instruction(" make it joyful ", 2, 3, 17, 32)
+    assert text.startswith("make it joyful (this is section 2 of 3") and "measures 17-32" in text
+
+
+def test_long_score_is_edited_section_by_section(llm_stub, score_xml):
+    stub = llm_stub()
+    sent = score_xml(40)
+    body, status = server.llama3_response({"xml": sent, "prompt": "make it brighter", "sections": True})
+    assert status == 200
+    assert stub.requests == 3  # sections of 16, 16 and 8 measures
+    before = parse_musicxml_string(sent).parts[0].recurse().notes
+    after = parse_musicxml_string(body["options"][0]).parts[0].recurse().notes
+    # option 1 is every section's transpose up 2 semitones, so together they cover the whole score
+    assert [n.pitch.midi + 2 for n in before] == [n.pitch.midi for n in after]
+
+
+def test_sectioned_and_whole_score_answers_are_cached_apart(llm_stub, score_xml):
+    stub = llm_stub()
+    server.prompt_results.clear()
+    request = {"xml": score_xml(40), "prompt": "make it brighter"}
+    body, _ = server.llama3_response(dict(request, sections=True))
+    assert body["source"] == "llm" and stub.requests == 3
+    body, _ = server.llama3_response(dict(request, sections=False))
+    assert body["source"] == "llm" and stub.requests == 4
+    body, _ = server.llama3_response(dict(request, sections=True))
+    assert body["source"] == "cache" and stub.requests == 4
+
+
+@pytest.fixture
+def second_section_fails(llm_stub, monkeypatch):
+    stub = llm_stub()
+    call = server.call_llama3_with_prompt
+
+    def failing(prompt, **kwargs):
+        return None if "section 2 of" in prompt else call(prompt, **kwargs)
+
+    monkeypatch.setattr(server, "call_llama3_with_prompt", failing)
+    server.prompt_results.clear()
+    server.plan_results.clear()
+    return stub
+
+
+def test_failed_section_is_reported_and_not_cached(second_section_fails, score_xml):
+    request = {"xml": score_xml(40), "prompt": "make it brighter", "sections": True}
+    body, status = server.llama3_response(request)
+    assert status == 200 and body["source"] == "llm"
+    assert body["failed_sections"] == [[17, 32]]
+    again, _ = server.llama3_response(request)
+    assert again["source"] == "llm" and again["failed_sections"] == [[17, 32]]
+    assert second_section_fails.requests == 4  # sections 1 and 3, twice
+
+
+def test_failed_section_is_reported_at_the_end_of_a_stream(second_section_fails, score_xml):
+    client = server.app.test_client()
+    request = {"xml": score_xml(40), "prompt": "make it brighter", "sections": True}
+    for _ in range(2):
+        response = client.post("/api/llama3/stream", json=request)
+        events = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert events[0]["source"] == "llm"
+        assert events[-1] == {"type": "done", "count": 2, "failed_sections": [[17, 32]]}
+    assert second_section_fails.requests == 4
@@ -0,0 +1,114 @@
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def run_together(n, fn):
+    """Call fn(i) on n threads at once; returns the results (or exceptions) in order"""
+    results = [None] * n
+    start = threading.Barrier(n)
+
+    def worker(i):
+        start.wait()
+        try:
+            results[i] = fn(i)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def slow(value, delay=0.2):
+    def fn():
+        time.sleep(delay)
+        return value
+    return fn
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        time.sleep(0.2)
+        return "answer"
+
+    results = run_together(4, lambda i: flight.do("k", fn))
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+    assert {value for value, _ in results} == {"answer"}
+    assert flight.stats()["coalesced"] == 3 and flight.stats()["in_flight"] == 0
+
+
+def test_different_keys_run_separately():
+    flight = SingleFlight()
+    results = run_together(2, lambda i: flight.do(str(i), slow(i)))
+    assert results == [(0, False), (1, False)]
+
+
+def test_later_callers_compute_again():
+    flight = SingleFlight()
+    assert flight.do("k", slow(1, 0)) == (1, False)
+    assert flight.do("k", slow(2, 0)) == (2, False)
+
+
+def test_waiters_get_the_leaders_exception():
+    flight = SingleFlight()
+
+    def fn():
+        time.sleep(0.2)
+        raise RuntimeError("model down")
+
+    results = run_together(3, lambda i: flight.do("k", fn))
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert flight.stats()["in_flight"] == 0
+    assert flight.do("k", slow(1, 0)) == (1, False)
+
+
+@pytest.fixture
+def answered(monkeypatch):
+    """run_llama3 with llama3_response replaced by a slow stub; returns the bodies the stub answered"""
+    import server
+
+    bodies = []
+
+    def response(data, session=None, batch_score=None):
+        bodies.append(data)
+        time.sleep(0.2)
+        return {"options": [data.get("prompt")]}, 200
+
+    monkeypatch.setattr(server, "COALESCE_REQUESTS", True)
+    monkeypatch.setattr(server, "llama3_response", response)
+    return bodies
+
+
+def test_identical_requests_are_answered_once(answered, score_xml):
+    import server
+
+    body = {"xml": score_xml(), "prompt": "Make it louder", "sections": True}
+    results = run_together(3, lambda i: server.run_llama3(dict(body)))
+    assert len(answered) == 1
+    assert all(r == ({"options": ["Make it louder"]}, 200) for r in results)
+
+
+@pytest.mark.parametrize("field, values", [
+    ("sections", [True, False]),
+    ("snippet_format", ["json", None]),
+    ("response", ["full", "delta"]),
+])
+def test_requests_that_differ_in_an_option_are_not_shared(answered, score_xml, field, values):
+    import server
+
+    xml = score_xml()
+    bodies = [{"xml": xml, "prompt": "Make it louder", field: v} for v in values]
+    run_together(len(bodies), lambda i: server.run_llama3(bodies[i]))
+    assert sorted(str(b.get(field)) for b in answered) == sorted(str(v) for v in values)
@@ -0,0 +1,166 @@
+import xml.etree.ElementTree as ET
+
+import pytest
+from music21 import dynamics, tempo
+
+import server
+import xml_rewriter
+from musicxml_io import parse_musicxml_string
+
+
+def pitch_xml(step, alter=None, octave=4):
+    alter = f"<alter>{alter}</alter>" if alter is not None else ""
+    return f"<pitch><step>{step}</step>{alter}<octave>{octave}</octave></pitch>"
+
+
+def note_xml(step, alter=None, octave=4, accidental=None, chord=False, tie=None):
+    return (
+        "<note>" + ("<chord/>" if chord else "") + pitch_xml(step, alter, octave) + "<duration>1</duration>"
+        + (f'<tie type="{tie}"/>' if tie else "") + "<type>quarter</type>"
+        + (f"<accidental>{accidental}</accidental>" if accidental else "")
+        + (f'<notations><tied type="{tie}"/></notations>' if tie else "") + "</note>"
+    )
+
+
+def tricky_score_xml(fifths=-3):
+    """Accidentals, a chord, a tie over the barline and a key change, one measure after another"""
+    measures = [
+        note_xml("E", -1) + note_xml("F", 1, accidental="sharp") + note_xml("F")
+        + note_xml("C") + note_xml("E", -1, chord=True) + note_xml("G", chord=True),
+        note_xml("B", -1, 3) + note_xml("B", 0, 4, accidental="natural") + note_xml("A", -1)
+        + note_xml("G", 1, accidental="sharp", tie="start"),
+        note_xml("G", 1, tie="stop") + note_xml("D") + note_xml("C", 1, 5, accidental="sharp") + note_xml("C", octave=5),
+        '<attributes><key><fifths>2</fifths></key></attributes>'
+        + note_xml("F", 1) + note_xml("C", 1) + note_xml("B", -1, accidental="flat") + note_xml("B"),
+    ]
+    body = []
+    for number, notes in enumerate(measures, 1):
+        body.append(f'<measure number="{number}">')
+        if number == 1:
+            body.append(
+                f"<attributes><divisions>1</divisions><key><fifths>{fifths}</fifths></key>"
+                "<time><beats>4</beats><beat-type>4</beat-type></time>"
+                "<clef><sign>G</sign><line>2</line></clef></attributes>"
+            )
+        body.append(notes + "</measure>")
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?><score-partwise version="3.1">'
+        '<part-list><score-part id="P1"><part-name>Part 1</part-name></score-part></part-list>'
+        f'<part id="P1">{"".join(body)}</part></score-partwise>'
+    )
+
+
+def through_music21(xml, plan):
+    return server.apply_llama_plan_to_score(plan, parse_musicxml_string(xml))
+
+
+def fast_path(xml, plan):
+    target = plan.get("target", {}).get("measures")
+    out = xml_rewriter.rewrite_musicxml(xml, list(server.plan_actions(plan)), target)
+    assert out is not None
+    return out
+
+
+def written_notes(xml):
+    """(measure, step, alter, octave, accidental) of every pitched note, as written in the document"""
+    root = ET.fromstring(xml[xml.find("<score-partwise"):])
+    rows = []
+    for measure in root.iter("measure"):
+        for n in measure.iter("note"):
+            p = n.find("pitch")
+            if p is None:
+                continue
+            rows.append((measure.get("number"), p.findtext("step"), float(p.findtext("alter") or 0),
+                         int(p.findtext("octave")), n.findtext("accidental")))
+    return rows
+
+
+def test_every_fast_path_action_is_covered():
+    assert xml_rewriter.FAST_PATH_ACTIONS == {"transpose", "change_tempo", "add_articulation", "modify_dynamics"}
+
+
+@pytest.mark.parametrize("semitones", [-13, -5, -1, 1, 2, 6, 11])
+def test_transpose_matches_music21(semitones):
+    xml = tricky_score_xml()
+    plan = {"action": "transpose", "params": {"semitones": semitones}}
+    assert written_notes(fast_path(xml, plan)) == written_notes(through_music21(xml, plan))
+
+
+@pytest.mark.parametrize("semitones", [-13, -1, 2, 6])
+@pytest.mark.parametrize("measures", [[2, 3], [4, 4]])
+def test_transpose_in_a_range_matches_music21(semitones, measures):
+    # music21 spells the range out of its key context, so only the pitches are compared
+    xml = tricky_score_xml()
+    plan = {"action": "transpose", "params": {"semitones": semitones}, "target": {"measures": measures}}
+    fast = [row[:4] for row in written_notes(fast_path(xml, plan))]
+    assert fast == [row[:4] for row in written_notes(through_music21(xml, plan))]
+
+
+@pytest.mark.parametrize("fifths", [-3, 0, 4])
+def test_transpose_shows_new_accidentals(score_xml, fifths):
+    xml = score_xml(3, fifths=fifths)
+    plan = {"action": "transpose", "params": {"semitones": 1}}
+    fast = written_notes(fast_path(xml, plan))
+    assert fast == written_notes(through_music21(xml, plan))
+    assert any(row[4] for row in fast)
+
+
+def tempo_marks(xml):
+    score = parse_musicxml_string(xml)
+    return [(m.measureNumber, m.number or m.numberSounding) for m in score.parts[0].recurse()
+            .getElementsByClass(tempo.MetronomeMark)]
+
+
+@pytest.mark.parametrize("measures", [None, [3, 4]])
+def test_change_tempo_matches_music21(score_xml, measures):
+    xml = score_xml(6, bpm=90)
+    plan = {"action": "change_tempo", "params": {"ratio": 1.5}}
+    if measures:
+        plan["target"] = {"measures": measures}
+    assert tempo_marks(fast_path(xml, plan)) == tempo_marks(through_music21(xml, plan))
+
+
+def articulation_marks(xml):
+    score = parse_musicxml_string(xml)
+    return [(n.measureNumber, n.nameWithOctave if hasattr(n, "nameWithOctave") else None,
+             [type(a).__name__ for a in n.articulations])
+            for n in score.recurse().notes]
+
+
+@pytest.mark.parametrize("style", ["staccato", "accent", "legato"])
+def test_add_articulation_matches_music21(score_xml, style):
+    xml = score_xml(4, parts=2)
+    plan = {"action": "add_articulation", "params": {"style": style}, "target": {"measures": [2, 3]}}
+    fast = articulation_marks(fast_path(xml, plan))
+    assert fast == articulation_marks(through_music21(xml, plan))
+    assert any(marks for _, _, marks in fast) == (style != "legato")
+
+
+def dynamic_marks(xml):
+    score = parse_musicxml_string(xml)
+    return [(p.id, d.measureNumber, d.value) for p in score.parts
+            for d in p.recurse().getElementsByClass(dynamics.Dynamic)]
+
+
+@pytest.mark.parametrize("change", [-2, 1, 5])
+@pytest.mark.parametrize("measures", [None, [2, 3]])
+def test_modify_dynamics_matches_music21(score_xml, change, measures):
+    xml = score_xml(4, parts=2, dynamic="p")
+    plan = {"action": "modify_dynamics", "params": {"dynamics_shift": change}}
+    if measures:
+        plan["target"] = {"measures": measures}
+    assert dynamic_marks(fast_path(xml, plan)) == dynamic_marks(through_music21(xml, plan))
+
+
+def test_a_plan_with_a_structural_action_is_left_to_music21(score_xml):
+    actions = [("transpose", {"semitones": 2}), ("add_chord_tone", {"interval": "M3"})]
+    assert xml_rewriter.rewrite_musicxml(score_xml(2), actions) is None
+
+
+def test_untouched_measures_keep_their_markup(score_xml):
+    xml = score_xml(4)
+    out = fast_path(xml, {"action": "transpose", "params": {"semitones": 2}, "target": {"measures": [3, 3]}})
+    measures = {m.get("number"): ET.tostring(m) for m in ET.fromstring(out[out.find("<score"):]).iter("measure")}
+    before = {m.get("number"): ET.tostring(m) for m in ET.fromstring(xml[xml.find("<score"):]).iter("measure")}
+    assert measures["1"] == before["1"] and measures["4"] == before["4"]
+    assert measures["3"] != before["3"]
@@ -0,0 +1,486 @@
+import xml.etree.ElementTree as ET
+
+from music21 import interval, key, pitch
+
+from measure_index import NO_MEASURES, resolve_scope
+
+
+# -------------------------------
+# Direct MusicXML rewriter (fast path)
+# -------------------------------
+# Plans made only of transpose / change_tempo / add_articulation /
+# modify_dynamics don't need a music21 object graph: the edit is a rewrite of
+# <pitch>, <sound tempo>, <notations> and <dynamics> elements. Everything else
+# in the document (layout, ids, comments, the XML declaration and DOCTYPE) is
+# left as it was. Structural actions still go through music21.
+
+FAST_PATH_ACTIONS = {"transpose", "change_tempo", "add_articulation", "modify_dynamics"}
+
+DYNAMIC_LEVELS = ['pp', 'p', 'mp', 'mf', 'f', 'ff']
+
+ACCIDENTAL_NAMES = {
+    -2: "flat-flat", -1: "flat", 0: "natural", 1: "sharp", 2: "double-sharp",
+}
+
+# children of <note> in schema order, for inserting <notations> in the right place
+NOTE_CHILD_ORDER = [
+    "grace", "cue", "chord", "pitch", "unpitched", "rest", "duration", "tie", "instrument",
+    "footnote", "level", "voice", "type", "dot", "accidental", "time-modification", "stem",
+    "notehead", "notehead-text", "staff", "beam", "notations", "lyric", "play", "listen",
+]
+
+# children that come before any <direction> at the start of a measure
+MEASURE_LEADING = {"print", "attributes", "barline"}
+
+
+def can_rewrite(actions):
+    """True if every (action, params) of a plan can be done by the rewriter"""
+    return all(action in FAST_PATH_ACTIONS for action, _ in actions)
+
+
+def _split_prolog(xml_str):
+    # ElementTree drops the XML declaration and DOCTYPE; keep them verbatim
+    start = xml_str.find("<score-partwise")
+    if start < 0:
+        return None, None
+    return xml_str[:start], xml_str[start:]
+
+
+def _parse(body):
+    parser = ET.XMLParser(target=ET.TreeBuilder(insert_comments=True, insert_pis=True))
+    parser.feed(body)
+    return parser.close()
+
+
+def _insert_note_child(note_el, child):
+    """Insert child into <note> at its schema position"""
+    rank = NOTE_CHILD_ORDER.index(child.tag)
+    pos = len(note_el)
+    for i, existing in enumerate(note_el):
+        if existing.tag in NOTE_CHILD_ORDER and NOTE_CHILD_ORDER.index(existing.tag) > rank:
+            pos = i
+            break
+    note_el.insert(pos, child)
+
+
+def _insert_at_measure_start(measure, element):
+    pos = 0
+    for i, child in enumerate(measure):
+        if child.tag in MEASURE_LEADING and not (child.tag == "barline" and child.get("location") == "right"):
+            pos = i + 1
+        elif child.tag not in MEASURE_LEADING:
+            break
+    measure.insert(pos, element)
+
+
+def _measure_number(measure):
+    number = measure.get("number", "")
+    return int(number) if number.lstrip("-").isdigit() else None
+
+
+class _Transposer:
+    """Transposes (step, alter, octave) the way Note.transpose(semitones) does, memoized per spelling and key"""
+
+    def __init__(self, semitones):
+        self.semitones = semitones
+        self.interval = interval.Interval(semitones)
+        self._cache = {}
+        self._key_sigs = {}
+
+    def key_signature(self, fifths):
+        if fifths not in self._key_sigs:
+            self._key_sigs[fifths] = key.KeySignature(fifths)
+        return self._key_sigs[fifths]
+
+    def __call__(self, step, alter, octave, fifths):
+        cache_key = (step, alter, octave, fifths)
+        if cache_key not in self._cache:
+            p = pitch.Pitch(step=step, octave=octave)
+            if alter:
+                p.accidental = pitch.Accidental(alter)
+            p.spellingIsInferred = False
+            p.transpose(self.interval, inPlace=True)
+            # single notes (fifths is not None) get the same key-signature respelling music21 applies
+            if fifths is not None and p.accidental is not None:
+                for altered in self.key_signature(fifths).alteredPitches:
+                    if p.pitchClass == altered.pitchClass and p.accidental.alter != altered.accidental.alter:
+                        p.getEnharmonic(inPlace=True)
+            new_alter = p.accidental.alter if p.accidental is not None else 0
+            self._cache[cache_key] = (p.step, new_alter, p.octave)
+        return self._cache[cache_key]
+
+
+def _format_number(value):
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+
+def _transpose(parts, scope, semitones):
+    transposer = _Transposer(semitones)
+    for part in parts:
+        fifths = 0
+        transposed = set()
+        for measure in part.findall("measure"):
+            in_scope = _in_scope(measure, scope)
+            for child in measure:
+                if child.tag == "attributes":
+                    fifths_el = child.find("key/fifths")
+                    if fifths_el is not None and fifths_el.text:
+                        fifths = int(fifths_el.text)
+            if not in_scope:
+                continue
+            notes = measure.findall(".//note")
+            for i, note_el in enumerate(notes):
+                pitch_el = note_el.find("pitch")
+                if pitch_el is None:
+                    continue
+                # chord members are transposed by the Chord, which skips the key-signature check
+                next_is_chord = i + 1 < len(notes) and notes[i + 1].find("chord") is not None
+                in_chord = note_el.find("chord") is not None or next_is_chord
+                step_el = pitch_el.find("step")
+                alter_el = pitch_el.find("alter")
+                octave_el = pitch_el.find("octave")
+                step, new_alter, octave = transposer(
+                    step_el.text.strip(), _alter_of(pitch_el), int(octave_el.text), None if in_chord else fifths
+                )
+                step_el.text = step
+                octave_el.text = str(octave)
+                if new_alter:
+                    if alter_el is None:
+                        alter_el = ET.Element("alter")
+                        pitch_el.insert(list(pitch_el).index(step_el) + 1, alter_el)
+                    alter_el.text = _format_number(new_alter)
+                elif alter_el is not None:
+                    pitch_el.remove(alter_el)
+                transposed.add(note_el)
+        _show_accidentals(part, scope, transposed)
+
+
+def _alter_of(pitch_el):
+    alter_el = pitch_el.find("alter")
+    alter = float(alter_el.text) if alter_el is not None and alter_el.text else 0.0
+    return int(alter) if alter.is_integer() else alter
+
+
+def _measure_pitches(measure, transposed):
+    """
+    [(note element, Pitch)] of a measure's pitched notes, in document order. A transposed note's accidental is
+    left for updateAccidentalDisplay to decide; any other note shows one only where the document has it.
+    """
+    found = []
+    for note_el in measure.iter("note"):
+        pitch_el = note_el.find("pitch")
+        if pitch_el is None:
+            continue
+        p = pitch.Pitch(step=pitch_el.find("step").text.strip(), octave=int(pitch_el.find("octave").text))
+        alter = _alter_of(pitch_el)
+        shown = note_el.find("accidental") is not None
+        if alter or (shown and note_el not in transposed):
+            p.accidental = pitch.Accidental(alter)
+            p.accidental.displayStatus = None if note_el in transposed else shown
+        found.append((note_el, p))
+    return found
+
+
+def _show_accidentals(part, scope, transposed):
+    """
+    Write <accidental> for the transposed notes (and the measure after the range) the way music21's
+    makeAccidentals does when it exports a transposed score: against the key signature, earlier notes of the
+    measure and the measure before.
+    """
+    key_sig = None
+    previous = None  # the measure before, as [(note element, Pitch)] once it's been needed
+    previous_measure = None
+    previous_in_scope = False
+    for measure in part.findall("measure"):
+        in_scope = _in_scope(measure, scope)
+        new_key = None
+        for fifths_el in measure.findall("attributes/key/fifths"):
+            if fifths_el.text:
+                new_key = key.KeySignature(int(fifths_el.text))
+        if in_scope or previous_in_scope:
+            if previous is None and previous_measure is not None:
+                previous = _measure_pitches(previous_measure, transposed)
+            past_measure = [p for _, p in previous or ()]
+            if new_key is not None and key_sig is not None:
+                # after a key change only the previous measure's chromatic notes call for a cautionary sign
+                diatonic = {p.name for p in key_sig.getScale().pitches}
+                past_measure = [p for p in past_measure if p.name not in diatonic]
+            if new_key is not None:
+                key_sig = new_key
+            tied = _tied_over(previous or [])
+            if new_key is not None:
+                # a tie into the new key only carries on for the notes that are in it
+                tied &= {p.name for p in new_key.getScale().pitches}
+            current = _measure_pitches(measure, transposed)
+            _update_display(current, past_measure, key_sig.alteredPitches if key_sig is not None else [], tied)
+            for note_el, p in current:
+                if note_el in transposed or (p.accidental is not None and p.accidental.displayStatus
+                                             and note_el.find("accidental") is None):
+                    _set_accidental(note_el, p)
+            previous = current
+        else:
+            if new_key is not None:
+                key_sig = new_key
+            previous = None
+        previous_measure = measure
+        previous_in_scope = in_scope
+
+
+def _groups(pitches):
+    """Split [(note element, Pitch)] into notes and chords: lists of consecutive entries joined by <chord/>"""
+    groups = []
+    for entry in pitches:
+        if groups and entry[0].find("chord") is not None:
+            groups[-1].append(entry)
+        else:
+            groups.append([entry])
+    return groups
+
+
+def _tied_over(pitches):
+    """nameWithOctave of the pitches a measure's last note or chord ties into the next measure"""
+    groups = _groups(pitches)
+    if not groups:
+        return set()
+    return {p.nameWithOctave for el, p in groups[-1] if el.find("tie[@type='start']") is not None}
+
+
+def _update_display(current, past_measure, altered, tied):
+    """Pitch.updateAccidentalDisplay for every note of a measure, in the order makeAccidentals visits them"""
+    past = []
+    for group in _groups(current):
+        members = [p for _, p in group]
+        for _, p in group:
+            p.updateAccidentalDisplay(
+                pitchPast=past, pitchPastMeasure=past_measure,
+                otherSimultaneousPitches=[m for m in members if m is not p] if len(members) > 1 else None,
+                alteredPitches=altered, cautionaryPitchClass=True, cautionaryNotImmediateRepeat=True,
+                lastNoteWasTied=p.nameWithOctave in tied,
+            )
+        past.extend(members)
+        tied = _tied_over(group)
+
+
+def _set_accidental(note_el, p):
+    accidental_el = note_el.find("accidental")
+    if p.accidental is None or not p.accidental.displayStatus:
+        if accidental_el is not None:
+            note_el.remove(accidental_el)
+        return
+    alter = p.accidental.alter
+    alter = int(alter) if float(alter).is_integer() else alter
+    if alter not in ACCIDENTAL_NAMES:
+        return  # microtones keep whatever the document had
+    if accidental_el is None:
+        accidental_el = ET.Element("accidental")
+        _insert_note_child(note_el, accidental_el)
+    accidental_el.text = ACCIDENTAL_NAMES[alter]
+
+
+def _in_scope(measure, scope):
+    if scope is None:
+        return True
+    number = _measure_number(measure)
+    return number is not None and scope[0] <= number <= scope[1]
+
+
+def _tempo_of(element):
+    """Tempo (bpm) set by a <direction> or <sound>, or None"""
+    sound = element if element.tag == "sound" else element.find("sound")
+    if sound is not None and sound.get("tempo"):
+        return float(sound.get("tempo"))
+    per_minute = element.find(".//metronome/per-minute")
+    if per_minute is not None and per_minute.text:
+        try:
+            return float(per_minute.text)
+        except ValueError:
+            return None
+    return None
+
+
+def _change_tempo(parts, scope, ratio):
+    # the tempo being scaled: the first mark in the edited range, else the one in force before it
+    base_bpm = None
+    before = None
+    for measure in parts[0].findall("measure") if parts else []:
+        for child in measure:
+            if child.tag in ("direction", "sound"):
+                bpm = _tempo_of(child)
+                if bpm is None:
+                    continue
+                if _in_scope(measure, scope):
+                    base_bpm = bpm
+                    break
+                if scope is None or (_measure_number(measure) or 0) < scope[0]:
+                    before = bpm
+        if base_bpm is not None:
+            break
+    if base_bpm is None:
+        base_bpm = before if before is not None else 120
+    new_bpm = int(base_bpm * ratio)
+    # the tempo the measure after the range starts with, put back there so the change ends with the range
+    restore = _tempo_after(parts[0], scope[1]) if scope and parts else None
+
+    for part in parts:
+        first = None
+        for measure in part.findall("measure"):
+            if not _in_scope(measure, scope):
+                continue
+            if first is None:
+                first = measure
+            for child in list(measure):
+                if child.tag == "sound" and child.get("tempo"):
+                    del child.attrib["tempo"]
+                    if not child.attrib and not len(child):
+                        measure.remove(child)
+                elif child.tag == "direction":
+                    for dt in child.findall("direction-type"):
+                        if dt.find("metronome") is not None:
+                            child.remove(dt)
+                    sound = child.find("sound")
+                    if sound is not None and sound.get("tempo"):
+                        del sound.attrib["tempo"]
+                        if not sound.attrib and not len(sound):
+                            child.remove(sound)
+                    if child.find("direction-type") is None:
+                        measure.remove(child)
+        if first is None:
+            continue
+        _insert_at_measure_start(first, _tempo_direction(new_bpm))
+        if restore is not None and restore != new_bpm:
+            after = next((m for m in part.findall("measure") if (_measure_number(m) or 0) > scope[1]), None)
+            if after is not None:
+                _insert_at_measure_start(after, _tempo_direction(restore))
+
+
+def _tempo_direction(bpm):
+    direction = ET.Element("direction", placement="above")
+    metronome = ET.SubElement(ET.SubElement(direction, "direction-type"), "metronome", parentheses="no")
+    ET.SubElement(metronome, "beat-unit").text = "quarter"
+    ET.SubElement(metronome, "per-minute").text = _format_number(bpm)
+    ET.SubElement(direction, "sound", tempo=_format_number(bpm))
+    return direction
+
+
+def _tempo_after(part, end):
+    """
+    The tempo in force at the end of measure `end` if the measure after it has no mark of its own (so an edit
+    to the range would carry on into it), else None
+    """
+    bpm = None
+    for measure in part.findall("measure"):
+        number = _measure_number(measure)
+        if number is None:
+            continue
+        marks = [t for t in (_tempo_of(child) for child in measure if child.tag in ("direction", "sound"))
+                 if t is not None]
+        if number > end:
+            return None if marks else bpm
+        if marks:
+            bpm = marks[-1]
+    return None
+
+
+def _add_articulation(parts, scope, style):
+    if style not in ("staccato", "accent"):
+        return
+    for part in parts:
+        for measure in part.findall("measure"):
+            if not _in_scope(measure, scope):
+                continue
+            for note_el in measure.iter("note"):
+                # one mark per note or chord (on its first note), none on rests
+                if note_el.find("rest") is not None or note_el.find("chord") is not None:
+                    continue
+                notations = note_el.find("notations")
+                if notations is None:
+                    notations = ET.Element("notations")
+                    _insert_note_child(note_el, notations)
+                articulations = notations.find("articulations")
+                if articulations is None:
+                    articulations = ET.SubElement(notations, "articulations")
+                ET.SubElement(articulations, style)
+
+
+def _modify_dynamics(parts, scope, change):
+    for part in parts:
+        for measure in part.findall("measure"):
+            if not _in_scope(measure, scope):
+                continue
+            base = None
+            for direction in measure.iter("direction"):
+                dyn = direction.find("direction-type/dynamics")
+                if dyn is not None and len(dyn):
+                    base = dyn[0].tag
+                    break
+            base = base or 'mf'
+            if base in DYNAMIC_LEVELS:
+                new_index = min(max(DYNAMIC_LEVELS.index(base) + change, 0), len(DYNAMIC_LEVELS) - 1)
+                new_dyn = DYNAMIC_LEVELS[new_index]
+            else:
+                new_dyn = 'mf'
+
+            for direction in list(measure.iter("direction")):
+                for dt in direction.findall("direction-type"):
+                    if dt.find("dynamics") is not None:
+                        direction.remove(dt)
+            for direction in list(measure.findall("direction")):
+                if direction.find("direction-type") is None:
+                    measure.remove(direction)
+
+            direction = ET.Element("direction", placement="below")
+            dynamics_el = ET.SubElement(ET.SubElement(direction, "direction-type"), "dynamics")
+            ET.SubElement(dynamics_el, new_dyn)
+            _insert_at_measure_start(measure, direction)
+
+
+def _set_title(root, title):
+    work = root.find("work")
+    if work is None:
+        work = ET.Element("work")
+        root.insert(0, work)
+    work_title = work.find("work-title")
+    if work_title is None:
+        work_title = ET.SubElement(work, "work-title")
+    work_title.text = title
+    movement_title = root.find("movement-title")
+    if movement_title is not None:
+        movement_title.text = title
+
+
+def rewrite_musicxml(xml_str, actions, target_measures=None, title=None):
+    """
+    Apply (action, params) pairs straight to a score-partwise MusicXML string.
+    Returns the new MusicXML string, or None if the document or a plan step needs the music21 path.
+    """
+    return rewrite_sections(xml_str, [(actions, target_measures)], title=title)
+
+
+def rewrite_sections(xml_str, sections, title=None):
+    """Like rewrite_musicxml for several [(actions, target_measures)] at once, with one parse and one write"""
+    if not all(can_rewrite(actions) for actions, _ in sections):
+        return None
+    prolog, body = _split_prolog(xml_str)
+    if body is None:
+        return None
+    root = _parse(body)
+    parts = root.findall("part")
+
+    numbers = sorted({n for n in (_measure_number(m) for m in root.iter("measure")) if n is not None})
+    for actions, target_measures in sections:
+        scope = resolve_scope(numbers, target_measures) if numbers else None
+        if scope == NO_MEASURES:
+            continue  # the target names no measure of this score
+        for action, params in actions:
+            if action == "transpose":
+                _transpose(parts, scope, int(params.get("semitones", 2)))
+            elif action == "change_tempo":
+                _change_tempo(parts, scope, float(params.get("ratio", 1.0)))
+            elif action == "add_articulation":
+                _add_articulation(parts, scope, params.get("style", "staccato"))
+            elif action == "modify_dynamics":
+                _modify_dynamics(parts, scope, int(params.get("dynamics_shift", 0)))
+
+    if title is not None:
+        _set_title(root, title)
+    return prolog + ET.tostring(root, encoding="unicode")